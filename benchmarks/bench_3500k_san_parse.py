@@ -0,0 +1,59 @@
+"""Reports the 3500k SAN preprocessing throughput against the worker count.
+
+    python -m benchmarks.bench_3500k_san_parse --lines 200000 --workers 1 2 4
+"""
+import argparse
+import os
+import random
+import tempfile
+import time
+
+from chessmate.data import dataset
+
+
+GAMES = [
+    "W1.e4 B1.e5 W2.Nf3 B2.Nc6 W3.Bb5 B3.a6 W4.Ba4 B4.Nf6 W5.O-O B5.Be7 W6.Re1 B6.b5 W7.Bb3 B7.d6",
+    "W1.d4 B1.d5 W2.c4 B2.e6 W3.Nc3 B3.Nf6 W4.Bg5 B4.Be7 W5.e3 B5.O-O W6.Nf3 B6.h6 W7.Bh4 B7.b6",
+    "W1.e4 B1.c5 W2.Nf3 B2.d6 W3.d4 B3.cxd4 W4.Nxd4 B4.Nf6 W5.Nc3 B5.a6",
+]
+
+
+def write_corpus(path, n, seed=0):
+    rng = random.Random(seed)
+    with open(path, "w") as f:
+        for i in range(5):
+            f.write(f"# header {i}\n")
+        for i in range(n):
+            moves = rng.choice(GAMES)
+            f.write(f"{i + 1} 2000.03.{rng.randint(10, 28)} {rng.choice(['1-0', '0-1', '1/2-1/2'])} "
+                    f"{rng.randint(2000, 2800)} {rng.randint(2000, 2800)} {moves.count('.')} date_false "
+                    f"result_false welo_false belo_false edate_true setup_false fen_false "
+                    f"result2_false oyrange_false blen_false ### {moves} \n")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--lines", type=int, default=200_000)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, os.cpu_count()])
+    parser.add_argument("--chunk-bytes", type=int, default=4 << 20)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "games.txt")
+        write_corpus(path, args.lines)
+
+        start = time.perf_counter()
+        with open(path, "rb") as f:
+            rows = sum(len(chunk) for chunk in dataset._iter_3500k_san(f))
+        elapsed = time.perf_counter() - start
+        print(f"{'serial':<12} {args.lines / elapsed:>12,.0f} lines/s ({rows} games)")
+
+        for workers in sorted(set(args.workers)):
+            start = time.perf_counter()
+            rows = sum(len(chunk) for chunk in dataset._iter_3500k_san_parallel(path, workers, args.chunk_bytes))
+            elapsed = time.perf_counter() - start
+            print(f"{f'{workers} workers':<12} {args.lines / elapsed:>12,.0f} lines/s ({rows} games)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,52 @@
+"""Compares the per board and batched HalfKP feature extraction throughput.
+
+    python -m benchmarks.bench_batch_features --positions 100000
+"""
+import argparse
+import random
+import time
+
+import chess
+
+from chessmate.features import board as board_features
+
+
+def random_positions(n, seed=0):
+    rng = random.Random(seed)
+    boards = []
+    board = chess.Board()
+    while len(boards) < n:
+        moves = list(board.legal_moves)
+        if not moves or board.ply() > 120:
+            board = chess.Board()
+            continue
+        board.push(rng.choice(moves))
+        boards.append(board.copy(stack=False))
+    return boards
+
+
+def bench(name, fn, inputs, n):
+    start = time.perf_counter()
+    fn(inputs)
+    elapsed = time.perf_counter() - start
+    print(f"{name:<24} {n / elapsed:>12,.0f} positions/s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--positions", type=int, default=100_000)
+    parser.add_argument("--dense-positions", type=int, default=2_000)
+    args = parser.parse_args()
+
+    boards = random_positions(args.positions)
+    fens = [b.fen() for b in boards]
+    dense = boards[:args.dense_positions]
+
+    bench("per board (dense)", lambda bs: [board_features.halfkp(b) for b in bs], dense, len(dense))
+    bench("per board (indices)", lambda bs: [board_features.halfkp_indices(b) for b in bs], boards, len(boards))
+    bench("batch (boards)", board_features.halfkp_batch, boards, len(boards))
+    bench("batch (fens)", board_features.halfkp_batch, fens, len(fens))
+
+
+if __name__ == "__main__":
+    main()
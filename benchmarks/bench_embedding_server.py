@@ -0,0 +1,80 @@
+"""Compares embedding boards one at a time with the micro-batching server.
+
+    python -m benchmarks.bench_embedding_server --positions 20000 --clients 8
+"""
+import argparse
+import threading
+import time
+
+import chess
+import torch
+
+from chessmate.features import board as board_features
+from chessmate.features import embedding_server, nnue
+
+from .bench_batch_features import random_positions
+
+
+def random_embedding(seed=0):
+    generator = torch.Generator().manual_seed(seed)
+    shapes = {
+        "input": (nnue.L1, nnue.NUM_PLANES * nnue.NUM_SQ),
+        "l1": (nnue.L2, 2 * nnue.L1),
+        "l2": (nnue.L3, nnue.L2),
+        "output": (1, nnue.L3),
+    }
+    state_dict = {}
+    for name, shape in shapes.items():
+        state_dict[f"{name}.weight"] = (torch.rand(shape, generator=generator) - 0.5) * 0.1
+        state_dict[f"{name}.bias"] = torch.rand(shape[0], generator=generator) * 0.5
+    return nnue.NNUEEmbedding(state_dict)
+
+
+def report(name, n, elapsed, stats=None):
+    line = f"{name:<28} {n / elapsed:>10,.0f} positions/s"
+    if stats is not None:
+        line += (f"  p50 {stats['p50'] * 1e3:6.2f} ms  p99 {stats['p99'] * 1e3:6.2f} ms"
+                 f"  batch {stats['mean_batch_size']:6.1f}")
+    print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--positions", type=int, default=20_000)
+    parser.add_argument("--single-positions", type=int, default=2_000)
+    parser.add_argument("--clients", type=int, default=8)
+    parser.add_argument("--max-batch-size", type=int, default=256)
+    parser.add_argument("--max-latency", type=float, default=0.002)
+    args = parser.parse_args()
+
+    torch.set_grad_enabled(False)
+    embedding = random_embedding()
+    fens = [b.fen() for b in random_positions(args.positions)]
+
+    single = fens[:args.single_positions]
+    start = time.perf_counter()
+    for fen in single:
+        current, other = board_features.halfkp(chess.Board(fen))
+        embedding(current[None], other[None])
+    report("forward, one at a time", len(single), time.perf_counter() - start)
+
+    with embedding_server.EmbeddingServer(embedding, args.max_batch_size, args.max_latency) as server:
+        def client(i):
+            for fen in fens[i::args.clients]:
+                server.embed(fen)
+        threads = [threading.Thread(target=client, args=(i,)) for i in range(args.clients)]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        report(f"server, {args.clients} interactive clients", len(fens), time.perf_counter() - start, server.stats())
+
+    with embedding_server.EmbeddingServer(embedding, args.max_batch_size, args.max_latency) as server:
+        start = time.perf_counter()
+        server.embed_many(fens)
+        report("server, bulk", len(fens), time.perf_counter() - start, server.stats())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+"""Measures the import time of the chessmate modules in fresh interpreters.
+
+    python -m benchmarks.bench_import_time --repeat 5
+
+Board features, engine labels and the games table tools should not import
+the heavy dependencies, ``--check`` fails when one of them does.
+"""
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+
+
+MODULES = [
+    "chessmate.features.board",
+    "chessmate.features.engine",
+    "chessmate.data.dataset",
+    "chessmate.data.labeling",
+    "chessmate.features.nnue",
+    "chessmate.data.positions",
+]
+HEAVY = ["torch", "pandas", "requests"]
+# Modules that must import none of the heavy dependencies
+LIGHT = ["chessmate.features.board", "chessmate.features.engine", "chessmate.data.dataset",
+         "chessmate.data.labeling"]
+
+_PROBE = """
+import json, sys, time
+start = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - start
+print(json.dumps({{"time": elapsed, "heavy": [m for m in {heavy!r} if m in sys.modules]}}))
+"""
+
+
+def probe(module) -> dict:
+    """Imports ``module`` in a new interpreter, returns the import time and
+    the heavy modules it imported."""
+    code = _PROBE.format(module=module, heavy=HEAVY)
+    output = subprocess.run([sys.executable, "-c", code], check=True, capture_output=True, text=True).stdout
+    return json.loads(output)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--check", action="store_true", help="Fail if a light module imports a heavy one")
+    args = parser.parse_args()
+
+    failed = []
+    for module in MODULES:
+        probes = [probe(module) for _ in range(args.repeat)]
+        elapsed = statistics.median(p["time"] for p in probes)
+        heavy = probes[0]["heavy"]
+        print(f"{module:<28} {elapsed * 1e3:8.1f} ms  {', '.join(heavy) or '-'}")
+        if module in LIGHT and heavy:
+            failed.append(module)
+
+    if args.check and failed:
+        sys.exit(f"Heavy dependencies imported by {', '.join(failed)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,56 @@
+"""Compares the float and the quantized NNUE embeddings on sparse batches.
+
+    python -m benchmarks.bench_quantized_nnue --positions 20000 --threads 1
+"""
+import argparse
+import time
+
+import torch
+
+from chessmate.features import board as board_features
+from chessmate.features import nnue
+
+from .bench_batch_features import random_positions
+from .bench_embedding_server import random_embedding
+
+
+def bench(name, fn, batches, n, repeat):
+    fn(*batches[0])
+    # The best of the repeats, the others are slowed down by other processes
+    elapsed = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for batch in batches:
+            fn(*batch)
+        elapsed = min(elapsed, time.perf_counter() - start)
+    print(f"{name:<32} {n / elapsed:>12,.0f} positions/s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--positions", type=int, default=20_000)
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 64, 4096])
+    parser.add_argument("--threads", type=int, default=1)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    torch.set_num_threads(args.threads)
+    torch.set_grad_enabled(False)
+    embedding = random_embedding()
+    quantized = nnue.QuantizedNNUEEmbedding.from_embedding(embedding)
+    boards = random_positions(args.positions)
+
+    for batch_size in args.batch_sizes:
+        # Single positions are slow, fewer of them are timed
+        n = min(args.positions, 100 * batch_size)
+        batches = []
+        for i in range(0, n, batch_size):
+            current, other, offsets = board_features.halfkp_batch(boards[i:i + batch_size])
+            batches.append((current, offsets, other, offsets))
+        torch_batches = [tuple(torch.from_numpy(a).long() for a in batch) for batch in batches]
+        bench(f"float, batch {batch_size}", embedding.forward_sparse, torch_batches, n, args.repeat)
+        bench(f"quantized, batch {batch_size}", quantized.forward_sparse, batches, n, args.repeat)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,73 +1,377 @@
+import collections
+import concurrent.futures
 import io
 import itertools
+import os
 import pathlib
 import re
+import shutil
+import tempfile
+from typing import TYPE_CHECKING, Iterator
 
 import chess
-import chess.engine
 import numpy
-import pandas
-from torch.utils.data import Dataset
-
-from ..nnue_pytorch import halfkp
-from .. import utils
-
-
-def _preprocess_3500k_san(content: io.BytesIO) -> pandas.DataFrame:
-    data = content.read()
-    data = re.sub(r"###\s(.*?)\s?$", r"\"\g<1>\"", data, flags=re.MULTILINE)
-    data = re.sub(r"[WB]\d+\.", "", data)
-    data = io.StringIO(data)
-
-    df = pandas.read_csv(data,
-                         sep=" ",
-                         usecols=[0, 1, 2, 3, 4, 5, 7, 11, 16],
-                         header=None,
-                         names=[
-                             "id", "date", "result", "white_rating",
-                             "black_rating", "len", "result_null", "setup",
-                             "moves"
-                         ],
-                         skiprows=5)
+
+from ..features import board as board_features
+from ..utils import fetch
+
+# pandas, pyarrow, torch and requests are only imported by the functions
+# that need them, replaying games does not pay for their import
+if TYPE_CHECKING:
+    import pandas
+
+
+_3500K_SAN_HEADER_LINES = 5
+_3500K_SAN_COLUMNS = [
+    "id", "date", "result", "white_rating", "black_rating", "len", "result_null",
+    "setup", "moves"
+]
+_MOVE_NUMBER = re.compile(r"[WB]\d+\.")
+_WINNERS = {"1-0": "W", "0-1": "B", "1/2-1/2": "D"}
+
+
+def _3500k_san_schema(encode=False):
+    import pyarrow
+
+    fields = [
+        ("id", pyarrow.int64()),
+        ("date", pyarrow.timestamp("ns")),
+        ("white_rating", pyarrow.float64()),
+        ("black_rating", pyarrow.float64()),
+        ("len", pyarrow.int64()),
+        ("moves", pyarrow.string()),
+        ("winner", pyarrow.string()),
+    ]
+    if encode:
+        fields += [("encoded_moves", pyarrow.list_(pyarrow.uint16())), ("invalid_ply", pyarrow.int32())]
+    return pyarrow.schema(fields)
+
+
+def _parse_3500k_san_line(line: str):
+    # Lines are 16 space separated header fields followed by the moves,
+    # e.g. "1 2000.03.14 1-0 2851 None 67 ... ### W1.d4 B1.d5 W2.c4"
+    header, sep, moves = line.partition("###")
+    fields = header.split()
+    if not sep or len(fields) < 12:
+        return None
+    moves = " ".join(_MOVE_NUMBER.sub("", moves).split())
+    return (fields[0], fields[1], fields[2], fields[3], fields[4], fields[5], fields[7],
+            fields[11], moves)
+
+
+def _3500k_san_frame(rows, encode=False) -> "pandas.DataFrame":
+    import pandas
+
+    df = pandas.DataFrame(rows, columns=_3500K_SAN_COLUMNS)
 
     df = df[df["setup"] == "setup_false"]
     df = df.drop("setup", axis=1)
 
-    df["date"] = pandas.to_datetime(df["date"], format="%Y.%m.%d", errors="coerce")
-    df["white_rating"] = pandas.to_numeric(df["white_rating"], errors="coerce")
-    df["black_rating"] = pandas.to_numeric(df["black_rating"], errors="coerce")
-    df[df["result_null"] == "result_true"]["result"] = numpy.nan
+    # Games with a malformed id or length are dropped
+    df["id"] = pandas.to_numeric(df["id"], errors="coerce")
+    df["len"] = pandas.to_numeric(df["len"], errors="coerce")
+    df = df.dropna(subset=["id", "len"])
+    df["id"] = df["id"].astype("int64")
+    df["len"] = df["len"].astype("int64")
+    df["date"] = pandas.to_datetime(df["date"], format="%Y.%m.%d", errors="coerce").astype("datetime64[ns]")
+    df["white_rating"] = pandas.to_numeric(df["white_rating"], errors="coerce").astype("float64")
+    df["black_rating"] = pandas.to_numeric(df["black_rating"], errors="coerce").astype("float64")
+    df.loc[df["result_null"] == "result_true", "result"] = numpy.nan
     df = df.drop("result_null", axis=1)
 
-    df[df["result"] == "1-0"]["winner"] = "W"
-    df[df["result"] == "0-1"]["winner"] = "B"
-    df[df["result"] == "1/2-1/2"]["winner"] = "D"
+    df["winner"] = df["result"].map(_WINNERS)
     df = df.drop("result", axis=1)
 
-    return df
+    df = df.reset_index(drop=True)
+    return encode_games(df) if encode else df
+
+
+def encode_games(games) -> "pandas.DataFrame":
+    """Returns the games table with the ``encoded_moves`` of each game (see
+    :func:`encode_moves`) and the ``invalid_ply`` of its first unplayable
+    move added. Replaying encoded games is several times faster, but
+    encoding replays every game once."""
+    import pandas
+
+    games = games.copy()
+    encoded = [encode_moves(moves) for moves in games["moves"]]
+    games["encoded_moves"] = pandas.Series([codes for codes, _ in encoded], index=games.index, dtype=object)
+    games["invalid_ply"] = numpy.array([invalid for _, invalid in encoded], dtype=numpy.int32)
+    return games
+
+
+def encode_moves(moves: str) -> tuple[numpy.ndarray, int]:
+    """Converts space separated SAN ``moves`` to 16 bits move codes (from
+    square, to square << 6, promotion piece type << 12).
+
+    Returns the codes of the moves that could be played and the index of the
+    first move that could not be (invalid or truncated SAN), -1 when the whole
+    game is valid.
+    """
+    board = chess.Board()
+    moves = _split_moves(moves)
+    codes = numpy.empty(len(moves), dtype=numpy.uint16)
+    for i, san in enumerate(moves):
+        try:
+            move = board.push_san(san)
+        except ValueError:
+            return codes[:i], i
+        codes[i] = move.from_square | move.to_square << 6 | (move.promotion or 0) << 12
+    return codes, -1
+
+
+def decode_move(code) -> chess.Move:
+    code = int(code)
+    return chess.Move(code & 0x3F, (code >> 6) & 0x3F, (code >> 12) or None)
+
+
+def replay_encoded(codes) -> Iterator[chess.Board]:
+    """:func:`iter_boards` for moves encoded by :func:`encode_moves`. Moves
+    were validated when encoded, so they are pushed without the SAN parsing
+    and legality checks."""
+    board = chess.Board()
+    for code in codes:
+        board.push(decode_move(code))
+        yield board
+
+
+def _iter_3500k_san(content: io.BufferedIOBase, chunksize=100_000, encode=False) -> Iterator["pandas.DataFrame"]:
+    """Parses the raw games file line by line, yielding DataFrames of at most
+    ``chunksize`` games so only one chunk is ever held in memory. ``encode``
+    adds the encoded moves, see :func:`encode_games`."""
+    lines = io.TextIOWrapper(content, encoding="utf-8", errors="replace", newline="\n")
+    lines = itertools.islice(lines, _3500K_SAN_HEADER_LINES, None)
+    rows = filter(None, map(_parse_3500k_san_line, lines))
+    while True:
+        chunk = list(itertools.islice(rows, chunksize))
+        if not chunk:
+            break
+        yield _3500k_san_frame(chunk, encode)
+
+
+def _preprocess_3500k_san(content: io.BufferedIOBase, encode=False) -> "pandas.DataFrame":
+    import pandas
+
+    chunks = list(_iter_3500k_san(content, encode=encode))
+    if not chunks:
+        return _3500k_san_frame([], encode)
+    return pandas.concat(chunks, ignore_index=True)
+
+
+def _3500k_san_ranges(path, chunk_bytes) -> list[tuple[int, int]]:
+    """Splits the games file past its header into byte ranges of about
+    ``chunk_bytes``, each ending right after a line break."""
+    size = os.path.getsize(path)
+    ranges = []
+    with open(path, "rb") as f:
+        for _ in range(_3500K_SAN_HEADER_LINES):
+            f.readline()
+        begin = f.tell()
+        while begin < size:
+            f.seek(min(begin + chunk_bytes, size))
+            f.readline()
+            end = min(f.tell(), size)
+            ranges.append((begin, end))
+            begin = end
+    return ranges
+
+
+def _parse_3500k_san_range(path, begin, end, encode=False) -> "pandas.DataFrame":
+    with open(path, "rb") as f:
+        f.seek(begin)
+        text = f.read(end - begin).decode("utf-8", errors="replace")
+    rows = filter(None, map(_parse_3500k_san_line, text.split("\n")))
+    return _3500k_san_frame(list(rows), encode)
+
+
+def _iter_3500k_san_parallel(path, workers, chunk_bytes=32 << 20, encode=False) -> Iterator["pandas.DataFrame"]:
+    """Parallel :func:`_iter_3500k_san` over an uncompressed games file,
+    parsing line aligned byte ranges in a pool of ``workers`` processes and
+    yielding their DataFrames in file order."""
+    ranges = _3500k_san_ranges(path, chunk_bytes)
+    with concurrent.futures.ProcessPoolExecutor(workers) as executor:
+        # Only keep a few ranges in flight so parsed chunks do not pile up
+        pending = collections.deque()
+        for begin, end in ranges:
+            pending.append(executor.submit(_parse_3500k_san_range, path, begin, end, encode))
+            if len(pending) >= 2 * workers:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def _write_3500k_san(chunks, path: pathlib.Path, encode=False):
+    """Writes DataFrame chunks to a feather file as they come, the file only
+    appears at ``path`` once complete."""
+    import pyarrow
+    import pyarrow.ipc
+
+    tmp_path = path.with_name(path.name + ".tmp")
+    schema = _3500k_san_schema(encode)
+    options = pyarrow.ipc.IpcWriteOptions(compression="lz4")
+    with pyarrow.OSFile(str(tmp_path), "wb") as sink:
+        with pyarrow.ipc.new_file(sink, schema, options=options) as writer:
+            for chunk in chunks:
+                table = pyarrow.Table.from_pandas(chunk, schema=schema, preserve_index=False)
+                writer.write_table(table)
+    tmp_path.replace(path)
 
 
 def _fetch_3500k_san():
+    import zipfile
+
     id_ = "0Bw0y3jV73lx_aXE3RnhmeE5Rb1E"
-    content = utils.download_file_from_google_drive(id_)
-    return content
+    path = fetch.download_file_from_google_drive(id_, fetch.data_root() / "3500k_san.zip")
+    # The archive member is streamed from the disk
+    return zipfile.ZipFile(path).open("all_with_filtered_anotations_since1998.txt")
+
 
+def load_3500k_san(workers=1, encode=False) -> "pandas.DataFrame":
+    """Loads the games table, downloading and preprocessing it on first use
+    with ``workers`` processes. Both the archive and the table are cached in
+    the data root, see :func:`chessmate.utils.fetch.data_root`. ``encode``
+    loads the table with the encoded moves of :func:`encode_games`, cached
+    separately."""
+    import pandas
 
-def load_3500k_san() -> pandas.DataFrame:
-    # TODO: Find data root
-    path = pathlib.Path("../data/3500k_san.feather")
+    path = fetch.data_root() / "3500k_san.feather"
+    if encode:
+        encoded_path = path.with_name("3500k_san_encoded.feather")
+        if not encoded_path.exists():
+            # Encoded in a separate pass over the plain table
+            _write_3500k_san([encode_games(load_3500k_san(workers))], encoded_path, encode=True)
+        return pandas.read_feather(encoded_path)
     if path.exists():
         return pandas.read_feather(path)
 
     content = _fetch_3500k_san()
-    df = _preprocess_3500k_san(content)
-    path.parent.mkdir(exist_ok=True)
-    df.to_feather(path)
-    return df
+    path.parent.mkdir(parents=True, exist_ok=True)
+    if workers > 1:
+        # Workers need random access, so the archive member is spooled to an
+        # uncompressed file first
+        with tempfile.NamedTemporaryFile(dir=path.parent, suffix=".txt") as raw:
+            shutil.copyfileobj(content, raw)
+            raw.flush()
+            _write_3500k_san(_iter_3500k_san_parallel(raw.name, workers), path)
+    else:
+        _write_3500k_san(_iter_3500k_san(content), path)
+    return pandas.read_feather(path)
+
+
+def _split_moves(moves: str) -> list[str]:
+    return moves.split(" ") if moves else []
 
 
 def build_board(moves: str, move_index=None) -> chess.Board:
+    """Returns the board after the first ``move_index`` moves of the space
+    separated SAN ``moves`` (all of them by default)."""
+    moves = _split_moves(moves)
+    if move_index is not None:
+        if not 0 <= move_index <= len(moves):
+            raise IndexError(f"Move index {move_index} out of range for {len(moves)} moves")
+        moves = moves[:move_index]
+
     board = chess.Board()
-    for i, move in enumerate(moves.split(" ")):
+    for move in moves:
         board.push_san(move)
     return board
+
+
+def iter_boards(moves: str) -> Iterator[chess.Board]:
+    """Yields the board after each move of the space separated SAN ``moves``,
+    replaying the game once. The same board is updated in place between
+    iterations, copy it to keep a position."""
+    board = chess.Board()
+    for move in _split_moves(moves):
+        board.push_san(move)
+        yield board
+
+
+class BoardCheckpoints:
+    """Random access to the positions of a game.
+
+    Snapshots of the board are kept every ``every`` plies as the game gets
+    replayed, so :meth:`board_at` only replays the moves from the nearest
+    snapshot before the requested ply.
+    """
+    def __init__(self, moves: str, every=16):
+        if every < 1:
+            raise ValueError("Snapshots interval should be at least 1")
+        self.moves = _split_moves(moves)
+        self.every = every
+        self._snapshots = [chess.Board()]
+
+    def __len__(self):
+        return len(self.moves) + 1
+
+    def board_at(self, ply) -> chess.Board:
+        """Returns a copy of the board after the first ``ply`` moves."""
+        if not 0 <= ply < len(self):
+            raise IndexError(f"Ply {ply} out of range for {len(self.moves)} moves")
+
+        start = min(ply // self.every, len(self._snapshots) - 1) * self.every
+        board = self._snapshots[start // self.every].copy()
+        for i in range(start, ply):
+            board.push_san(self.moves[i])
+            if (i + 1) % self.every == 0 and (i + 1) // self.every == len(self._snapshots):
+                self._snapshots.append(board.copy())
+        return board
+
+
+_RESULTS = {"W": (1.0, 0.0), "B": (0.0, 1.0), "D": (0.5, 0.5)}
+
+
+def _iter_game_boards(moves: str):
+    """:func:`iter_boards` stopping at the first move that cannot be played."""
+    try:
+        yield from iter_boards(moves)
+    except ValueError:
+        return
+
+
+def _read_games(games) -> "pandas.DataFrame":
+    import pandas
+
+    return games if isinstance(games, pandas.DataFrame) else pandas.read_feather(games)
+
+
+def _game_replay(games):
+    """Returns the column of the games table holding the moves and the
+    function replaying them into boards."""
+    # Prefer the precompiled moves, replaying them skips the SAN parsing
+    if "encoded_moves" in games:
+        return "encoded_moves", replay_encoded
+    return "moves", _iter_game_boards
+
+
+def iter_positions(games, features=board_features.halfkp_indices, shard=0, num_shards=1):
+    """Yields the position samples of every ``num_shards``-th game of the
+    games table (a DataFrame or the path of its feather file) starting at
+    ``shard``, see :class:`chessmate.data.positions.GamePositions` for
+    their content."""
+    games = _read_games(games)
+    moves_column, replay = _game_replay(games)
+    columns = [games[c].to_numpy() for c in ("id", moves_column, "winner", "white_rating", "black_rating")]
+    for game_id, moves, winner, white_rating, black_rating in itertools.islice(
+            zip(*columns), shard, None, num_shards):
+        white_result, black_result = _RESULTS.get(winner, (float("nan"), float("nan")))
+        for board in replay(moves):
+            current, other = features(board)
+            yield {
+                "current": current,
+                "other": other,
+                "result": white_result if board.turn else black_result,
+                "white_rating": white_rating,
+                "black_rating": black_rating,
+                "id": game_id,
+                "ply": board.ply(),
+            }
+
+
+def __getattr__(name):
+    # The torch datasets moved to their own module so replaying games does
+    # not import torch, they are still found here
+    if name in ("GamePositions", "collate_positions"):
+        from . import positions
+        return getattr(positions, name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
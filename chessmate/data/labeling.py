@@ -0,0 +1,209 @@
+"""Labels the positions of the games table with engine features.
+
+    python -m chessmate.data.labeling labels/ --games 3500k_san.feather --workers 8 --depth 12
+
+Labels are written to append-only Parquet shards along with a progress
+manifest, running the command again on the same directory resumes the job.
+"""
+import argparse
+import collections
+import json
+import os
+import pathlib
+
+import chess
+import chess.polyglot
+import pyarrow
+import pyarrow.parquet
+from tqdm import tqdm
+
+from ..features import engine as engine_features
+from . import dataset
+
+
+MANIFEST = "manifest.json"
+
+_Position = collections.namedtuple("_Position", ["game", "id", "ply", "key", "board"])
+
+
+def _zobrist(board) -> int:
+    # Parquet integers are signed 64 bits
+    key = chess.polyglot.zobrist_hash(board)
+    return key - (1 << 64) if key >= (1 << 63) else key
+
+
+def _load_manifest(directory: pathlib.Path, config) -> dict:
+    path = directory / MANIFEST
+    if not path.exists():
+        return {"config": config, "games": 0, "positions": 0, "shards": []}
+    with open(path) as f:
+        manifest = json.load(f)
+    if manifest["config"] != config:
+        raise ValueError(f"{directory} holds labels computed with {manifest['config']}, not {config}")
+    return manifest
+
+
+def _save_manifest(directory: pathlib.Path, manifest):
+    tmp_path = directory / f"{MANIFEST}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(manifest, f, indent=2)
+    tmp_path.replace(directory / MANIFEST)
+
+
+def _labeled_keys(directory: pathlib.Path, manifest) -> set:
+    keys = set()
+    for name in manifest["shards"]:
+        table = pyarrow.parquet.read_table(directory / name, columns=["zobrist"])
+        keys.update(table.column("zobrist").to_pylist())
+    return keys
+
+
+def _iter_positions(games, start, seen):
+    """Yields the positions of the games from the ``start``-th one that are
+    not in ``seen``, each game followed by an end marker without board."""
+    moves_column, replay = dataset._game_replay(games)
+    ids, moves = games["id"].to_numpy(), games[moves_column].to_numpy()
+    for game in range(start, len(games)):
+        for board in replay(moves[game]):
+            key = _zobrist(board)
+            if key in seen:
+                continue
+            seen.add(key)
+            yield _Position(game, int(ids[game]), board.ply(), key, board.copy(stack=False))
+        yield _Position(game, int(ids[game]), None, None, None)
+
+
+def label_games(games, directory, features, engine, *, config=None, positions_per_shard=100_000,
+                progress=True, **search) -> dict:
+    """Labels every position of the games table (a DataFrame or the path of
+    its feather file) with ``features``, a dict of named engine features
+    computed by one :class:`chessmate.features.engine.EnginePipeline` search
+    per position on ``engine`` (an
+    :class:`chessmate.features.engine.EnginePool` to label on several
+    engine processes).
+
+    Labels are written to ``directory`` as Parquet shards of at least
+    ``positions_per_shard`` positions (a shard always ends with a game), with
+    the game ``id``, the ``ply``, ``fen`` and ``zobrist`` hash of the
+    position and one column per feature. Positions already labeled, by this
+    job or earlier in the games, are skipped.
+
+    The manifest records the games done and the shards, it is updated after
+    each shard so a killed job resumes at the last shard, and an interrupted
+    one (including by :class:`chessmate.features.engine.BudgetExhausted`)
+    saves the games it finished first. ``config`` describes the labels, a
+    job does not resume over labels with another one. ``search`` are the
+    node, time, budget and adaptive depth options of the search, see
+    :class:`chessmate.features.engine.EngineFeature`. Returns the manifest.
+    """
+    directory = pathlib.Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+    config = {"features": sorted(features)} if config is None else config
+    manifest = _load_manifest(directory, config)
+    seen = _labeled_keys(directory, manifest)
+    games = dataset._read_games(games)
+
+    pipeline = engine_features.EnginePipeline(list(features.values()), engine=engine, **search)
+    names = list(features)
+
+    def label(position):
+        return position, None if position.board is None else pipeline(position.board)
+
+    positions = _iter_positions(games, manifest["games"], seen)
+    imap = getattr(engine, "imap", None)
+    results = imap(label, positions) if imap is not None else map(label, positions)
+
+    def flush(rows, games_done):
+        if rows:
+            name = f"labels-{len(manifest['shards']):05d}.parquet"
+            columns = {
+                "id": pyarrow.array([p.id for p, _ in rows], pyarrow.int64()),
+                "ply": pyarrow.array([p.ply for p, _ in rows], pyarrow.int32()),
+                "fen": pyarrow.array([p.board.fen() for p, _ in rows], pyarrow.string()),
+                "zobrist": pyarrow.array([p.key for p, _ in rows], pyarrow.int64()),
+            }
+            for i, feature in enumerate(names):
+                columns[feature] = pyarrow.array([labels[i] for _, labels in rows])
+            tmp_path = directory / f"{name}.tmp"
+            pyarrow.parquet.write_table(pyarrow.table(columns), tmp_path)
+            tmp_path.replace(directory / name)
+            manifest["shards"].append(name)
+            manifest["positions"] += len(rows)
+        manifest["games"] = games_done
+        _save_manifest(directory, manifest)
+
+    rows, finished, games_done = [], 0, manifest["games"]
+    bar = tqdm(total=len(games), initial=games_done, unit="game", disable=not progress)
+    try:
+        for position, labels in results:
+            if position.board is not None:
+                rows.append((position, labels))
+                continue
+            # Game over, its positions can be saved
+            finished, games_done = len(rows), position.game + 1
+            bar.update(1)
+            bar.set_postfix(positions=manifest["positions"] + finished, refresh=False)
+            if finished >= positions_per_shard:
+                flush(rows, games_done)
+                rows, finished = [], 0
+    finally:
+        bar.close()
+        flush(rows[:finished], games_done)
+    return manifest
+
+
+def read_labels(directory) -> pyarrow.Table:
+    """Returns the labels written to ``directory`` by :func:`label_games`."""
+    directory = pathlib.Path(directory)
+    with open(directory / MANIFEST) as f:
+        manifest = json.load(f)
+    tables = [pyarrow.parquet.read_table(directory / name) for name in manifest["shards"]]
+    return pyarrow.concat_tables(tables)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("output", help="Directory of the labels shards")
+    parser.add_argument("--games", help="Games table feather file, the 3500k games dataset by default")
+    parser.add_argument("--engine", default=engine_features.engine_settings()["path"],
+                        help="UCI engine executable, $CHESSMATE_ENGINE by default")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="Number of engine processes")
+    parser.add_argument("--threads", type=int, default=1, help="Threads of each engine process")
+    parser.add_argument("--hash", type=int, help="Hash table size of each engine process in MB")
+    parser.add_argument("--depth", type=int, default=12, help="Search depth of the engine estimate")
+    parser.add_argument("--nodes", type=int, help="Node limit of each search")
+    parser.add_argument("--time", type=float, help="Time limit of each search in seconds")
+    parser.add_argument("--material-depth", type=int, default=0,
+                        help="Also label the material along the best line up to this ply")
+    parser.add_argument("--stable-depths", type=int,
+                        help="Stop searches once the score is stable over this many depths")
+    parser.add_argument("--budget-nodes", type=int, help="Total node budget of the job")
+    parser.add_argument("--budget-time", type=float, help="Total search time budget of the job in seconds")
+    parser.add_argument("--positions-per-shard", type=int, default=100_000)
+    args = parser.parse_args()
+
+    search = {"nodes": args.nodes, "time": args.time, "stable_depths": args.stable_depths}
+    config = {"engine": os.path.basename(args.engine), "depth": args.depth, "material_depth": args.material_depth,
+              **search}
+    budget = None
+    if args.budget_nodes is not None or args.budget_time is not None:
+        budget = engine_features.LabelingBudget(args.budget_nodes, args.budget_time)
+    games = args.games if args.games is not None else dataset.load_3500k_san()
+
+    with engine_features.EnginePool(args.engine, args.workers, threads=args.threads, hash=args.hash) as pool:
+        features = {"estimate": engine_features.EngineEstimate(args.depth, engine=pool)}
+        if args.material_depth:
+            features["material"] = engine_features.RawMaterialScores(depth=args.material_depth, engine=pool)
+        try:
+            manifest = label_games(games, args.output, features, pool, config=config,
+                                   positions_per_shard=args.positions_per_shard, budget=budget, **search)
+        except (KeyboardInterrupt, engine_features.BudgetExhausted) as e:
+            manifest = _load_manifest(pathlib.Path(args.output), config)
+            reason = "Budget spent" if isinstance(e, engine_features.BudgetExhausted) else "Interrupted"
+            print(f"{reason} after {manifest['games']} games, run again to resume")
+            return
+    print(f"Labeled {manifest['positions']} positions of {manifest['games']} games in {args.output}")
+
+
+if __name__ == "__main__":
+    main()
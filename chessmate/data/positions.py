@@ -0,0 +1,82 @@
+"""torch datasets of the positions of the games table."""
+import itertools
+import random
+
+import numpy
+import torch
+from torch.utils.data import IterableDataset, get_worker_info
+
+from ..features import board as board_features
+from . import dataset
+
+
+def _shard():
+    """Returns the index and count of the shards the current data loader
+    worker of the current distributed rank should read."""
+    rank, world_size = 0, 1
+    if torch.distributed.is_available() and torch.distributed.is_initialized():
+        rank, world_size = torch.distributed.get_rank(), torch.distributed.get_world_size()
+    worker = get_worker_info()
+    worker_id, num_workers = (0, 1) if worker is None else (worker.id, worker.num_workers)
+    return rank * num_workers + worker_id, world_size * num_workers
+
+
+class GamePositions(IterableDataset):
+    """Streams every position of the games table as samples of sparse board
+    features and labels.
+
+    Games are expanded lazily into the position after each of their moves,
+    and distributed round robin over the data loader workers of every
+    distributed rank. Positions are shuffled through a buffer of
+    ``shuffle_buffer`` samples, call :meth:`set_epoch` to reshuffle.
+
+    Each sample is a dict with the ``current`` and ``other`` player feature
+    indices (see :mod:`chessmate.features.board`), the game ``result`` from
+    the point of view of the player to move (1 win, 0.5 draw, 0 loss, NaN
+    unknown), the ``white_rating`` and ``black_rating``, and the game ``id``
+    and ``ply`` of the position. Use :func:`collate_positions` to batch them.
+    """
+    def __init__(self, games, features=board_features.halfkp_indices, *, shuffle_buffer=0, seed=0):
+        super().__init__()
+        self.games = games
+        self.features = features
+        self.shuffle_buffer = shuffle_buffer
+        self.seed = seed
+        self.epoch = 0
+
+    def set_epoch(self, epoch):
+        self.epoch = epoch
+
+    def __iter__(self):
+        shard, num_shards = _shard()
+        positions = dataset.iter_positions(self.games, self.features, shard, num_shards)
+        if self.shuffle_buffer <= 1:
+            yield from positions
+            return
+
+        rng = random.Random(f"{self.seed}-{self.epoch}-{shard}")
+        buffer = list(itertools.islice(positions, self.shuffle_buffer))
+        for position in positions:
+            i = rng.randrange(len(buffer))
+            yield buffer[i]
+            buffer[i] = position
+        rng.shuffle(buffer)
+        yield from buffer
+
+
+def collate_positions(samples) -> dict:
+    """Batches :class:`GamePositions` samples, packing the feature indices in
+    the flattened indices and offsets form of
+    :meth:`chessmate.features.nnue.NNUEEmbedding.forward_sparse`."""
+    current_indices, current_offsets = board_features.pack_indices([s["current"] for s in samples])
+    other_indices, other_offsets = board_features.pack_indices([s["other"] for s in samples])
+    batch = {
+        "current_indices": torch.from_numpy(current_indices.astype(numpy.int32, copy=False)),
+        "current_offsets": torch.from_numpy(current_offsets),
+        "other_indices": torch.from_numpy(other_indices.astype(numpy.int32, copy=False)),
+        "other_offsets": torch.from_numpy(other_offsets),
+    }
+    for key, dtype in (("result", torch.float32), ("white_rating", torch.float32),
+                       ("black_rating", torch.float32), ("id", torch.int64), ("ply", torch.int64)):
+        batch[key] = torch.tensor([s[key] for s in samples], dtype=dtype)
+    return batch
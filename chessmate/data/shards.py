@@ -0,0 +1,123 @@
+import bisect
+import itertools
+import pathlib
+import shutil
+
+import numpy
+from torch.utils.data import Dataset
+
+from ..features import board as board_features
+from . import dataset
+
+
+META_DTYPE = numpy.dtype([
+    ("id", numpy.int64),
+    ("ply", numpy.int16),
+    ("result", numpy.float32),
+    ("white_rating", numpy.float32),
+    ("black_rating", numpy.float32),
+])
+
+
+def _write_shard(path: pathlib.Path, positions):
+    counts = numpy.fromiter((len(p["current"]) for p in positions), dtype=numpy.int64, count=len(positions))
+    offsets = numpy.zeros(len(positions) + 1, dtype=numpy.int64)
+    numpy.cumsum(counts, out=offsets[1:])
+
+    current = numpy.concatenate([p["current"] for p in positions])
+    other = numpy.concatenate([p["other"] for p in positions])
+    if len(current) != len(other):
+        raise ValueError("Both players should have the same number of active features")
+    # Feature indices fit in 16 bits for HalfKP and HalfKA
+    dtype = numpy.uint16 if max(current.max(initial=0), other.max(initial=0)) <= 0xFFFF else numpy.int32
+
+    meta = numpy.empty(len(positions), dtype=META_DTYPE)
+    for name in META_DTYPE.names:
+        meta[name] = [p[name] for p in positions]
+
+    tmp_path = path.with_name(path.name + ".tmp")
+    old_path = path.with_name(path.name + ".old")
+    # Left over by an interrupted write
+    for leftover in (tmp_path, old_path):
+        shutil.rmtree(leftover, ignore_errors=True)
+    tmp_path.mkdir(parents=True)
+    numpy.save(tmp_path / "offsets.npy", offsets)
+    numpy.save(tmp_path / "current.npy", current.astype(dtype))
+    numpy.save(tmp_path / "other.npy", other.astype(dtype))
+    numpy.save(tmp_path / "meta.npy", meta)
+    # Directories cannot be renamed over non empty ones, a shard written
+    # before is moved aside first and only deleted once replaced
+    if path.exists():
+        path.rename(old_path)
+    tmp_path.rename(path)
+    shutil.rmtree(old_path, ignore_errors=True)
+
+
+def write_position_shards(games, directory, features=board_features.halfkp_indices,
+                          positions_per_shard=1_000_000) -> list[pathlib.Path]:
+    """Expands every game of the games table (a DataFrame or the path of its
+    feather file) into positions and writes them to ``directory`` as shards of
+    ``positions_per_shard`` positions.
+
+    Each shard stores the active feature indices of both players in CSR form
+    (``current.npy``, ``other.npy`` and the shared ``offsets.npy``) and the
+    position labels in ``meta.npy``, ready to be memory mapped by
+    :class:`PositionShards`. Shards of an earlier run in ``directory`` are
+    replaced, those beyond the new ones are deleted.
+    """
+    directory = pathlib.Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+    positions = dataset.iter_positions(games, features)
+    paths = []
+    for i in itertools.count():
+        chunk = list(itertools.islice(positions, positions_per_shard))
+        if not chunk:
+            break
+        path = directory / f"shard-{i:05d}"
+        _write_shard(path, chunk)
+        paths.append(path)
+    for stale in directory.glob("shard-*[0-9]"):
+        if stale not in paths:
+            shutil.rmtree(stale)
+    return paths
+
+
+class PositionShards(Dataset):
+    """Map style dataset over the shards written by
+    :func:`write_position_shards`.
+
+    Shards are memory mapped, so opening them is instant, any position is
+    read in constant time and its feature indices are views into the shard
+    files. Samples have the same content as
+    :class:`chessmate.data.positions.GamePositions` ones and batch with
+    :func:`chessmate.data.positions.collate_positions`.
+    """
+    def __init__(self, directory):
+        self.directory = pathlib.Path(directory)
+        self._shards = []
+        self._starts = []
+        length = 0
+        for path in sorted(self.directory.glob("shard-*[0-9]")):
+            shard = {name: numpy.load(path / f"{name}.npy", mmap_mode="r")
+                     for name in ("offsets", "current", "other", "meta")}
+            self._shards.append(shard)
+            self._starts.append(length)
+            length += len(shard["meta"])
+        self._length = length
+
+    def __len__(self):
+        return self._length
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += self._length
+        if not 0 <= index < self._length:
+            raise IndexError(f"Position {index} out of range")
+
+        s = bisect.bisect_right(self._starts, index) - 1
+        shard, i = self._shards[s], index - self._starts[s]
+        begin, end = shard["offsets"][i], shard["offsets"][i + 1]
+        meta = shard["meta"][i]
+        sample = {"current": shard["current"][begin:end], "other": shard["other"][begin:end]}
+        sample.update((name, meta[name].item()) for name in META_DTYPE.names)
+        return sample
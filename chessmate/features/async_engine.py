@@ -0,0 +1,227 @@
+import asyncio
+import collections
+import contextlib
+import os
+import time
+
+import chess.engine
+
+from .engine import (EngineEstimate, EngineFeature, EnginePipeline, EngineTopScores, RawMaterialScores,
+                     _stable_update, engine_settings)
+
+
+class AsyncEnginePool:
+    """asyncio counterpart of :class:`chessmate.features.engine.EnginePool`
+    built on :func:`chess.engine.popen_uci`.
+
+    At most one analysis runs per engine process at a time, callers awaiting
+    :meth:`analyse` queue up for the next idle process. Engines that die are
+    restarted and the interrupted analysis is retried once.
+    """
+    def __init__(self, path=None, size=None, *, threads=1, hash=None, options=None):
+        self.path = engine_settings()["path"] if path is None else path
+        self.size = size or os.cpu_count() or 1
+        self.options = dict(options or {})
+        self.options["Threads"] = threads
+        if hash is not None:
+            self.options["Hash"] = hash
+
+        self._idle = None
+        self._engines = {}
+        self._closed = False
+
+    async def start(self):
+        self._idle = asyncio.Queue()
+        try:
+            for _ in range(self.size):
+                self._idle.put_nowait(await self._start())
+        except BaseException:
+            await self.close()
+            raise
+        return self
+
+    async def _start(self) -> chess.engine.Protocol:
+        transport, engine = await chess.engine.popen_uci(self.path)
+        await engine.configure({k: v for k, v in self.options.items() if k in engine.options})
+        self._engines[engine] = transport
+        return engine
+
+    async def _restart(self, engine) -> chess.engine.Protocol:
+        transport = self._engines.pop(engine, None)
+        if transport is not None:
+            transport.close()
+        return await self._start()
+
+    async def _acquire(self) -> chess.engine.Protocol:
+        # Slots whose engine could not be restarted are queued empty and get
+        # a new engine on their next use
+        engine = await self._idle.get()
+        if engine is None:
+            try:
+                engine = await self._start()
+            except BaseException:
+                self._idle.put_nowait(None)
+                raise
+        return engine
+
+    @property
+    def id(self):
+        if not self._engines:
+            raise RuntimeError("No engine of the pool is running")
+        return next(iter(self._engines)).id
+
+    async def analyse(self, board, limit, **kwargs):
+        if self._closed or self._idle is None:
+            raise RuntimeError("Engine pool is not running")
+        engine = await self._acquire()
+        try:
+            try:
+                return await engine.analyse(board, limit, **kwargs)
+            except chess.engine.EngineTerminatedError:
+                # The dead engine is never queued again, even when no new
+                # one can be started
+                dead, engine = engine, None
+                engine = await self._restart(dead)
+                return await engine.analyse(board, limit, **kwargs)
+        finally:
+            self._idle.put_nowait(engine)
+
+    @contextlib.asynccontextmanager
+    async def analysis(self, board, limit=None, **kwargs):
+        """Same as :meth:`chess.engine.Protocol.analysis`, the engine process
+        is held until the context exits."""
+        if self._closed or self._idle is None:
+            raise RuntimeError("Engine pool is not running")
+        engine = await self._acquire()
+        try:
+            try:
+                analysis = await engine.analysis(board, limit, **kwargs)
+            except chess.engine.EngineTerminatedError:
+                dead, engine = engine, None
+                engine = await self._restart(dead)
+                analysis = await engine.analysis(board, limit, **kwargs)
+            with analysis:
+                yield analysis
+            # A stopped search ends before the engine serves the next one
+            await analysis.wait()
+        finally:
+            self._idle.put_nowait(engine)
+
+    async def imap(self, fn, boards):
+        """Yields ``await fn(board)`` for each board, in order, keeping a
+        bounded number of boards in flight."""
+        pending = collections.deque()
+        try:
+            for board in boards:
+                pending.append(asyncio.ensure_future(fn(board)))
+                if len(pending) >= 2 * self.size:
+                    yield await pending.popleft()
+            while pending:
+                yield await pending.popleft()
+        finally:
+            for task in pending:
+                task.cancel()
+
+    async def map(self, fn, boards) -> list:
+        """Returns ``[await fn(board) for board in boards]`` computed on the
+        pool."""
+        return [result async for result in self.imap(fn, boards)]
+
+    async def close(self):
+        self._closed = True
+        engines, self._engines = self._engines, {}
+        for engine, transport in engines.items():
+            try:
+                await asyncio.wait_for(engine.quit(), timeout=10)
+            except (chess.engine.EngineError, asyncio.TimeoutError):
+                pass
+            transport.close()
+
+    async def __aenter__(self):
+        return await self.start()
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+
+@contextlib.asynccontextmanager
+async def _analysis(engine, board, limit, **kwargs):
+    # Protocols return their analysis from a coroutine, pools from an async
+    # context manager
+    analysis = engine.analysis(board, limit, **kwargs)
+    if hasattr(analysis, "__aenter__"):
+        async with analysis as result:
+            yield result
+    else:
+        with await analysis as result:
+            yield result
+
+
+async def analyse_until_stable(engine, board, limit, *, stable_depths=3, tolerance=10, multipv=1,
+                               info=chess.engine.INFO_ALL) -> list[dict]:
+    """Awaitable :func:`chessmate.features.engine.analyse_until_stable` for
+    asyncio UCI protocols and :class:`AsyncEnginePool`."""
+    infos = {}
+    scores = []
+    async with _analysis(engine, board, limit, multipv=multipv, info=info | chess.engine.INFO_SCORE) as analysis:
+        async for update in analysis:
+            if _stable_update(infos, scores, update, stable_depths, tolerance):
+                analysis.stop()
+                break
+        else:
+            return list(analysis.multipv)
+    return [infos[rank] for rank in sorted(infos)]
+
+
+class AsyncEngineFeature(EngineFeature):
+    """Engine feature whose engine is an asyncio UCI protocol or an
+    :class:`AsyncEnginePool`, it never uses the shared blocking engine."""
+    engine = None
+
+    async def __call__(self, board: chess.Board):
+        return self._from_analysis(board, await self._analyse(board))
+
+    async def _analyse(self, board) -> list[dict]:
+        if self.engine is None:
+            raise RuntimeError
+        limit = self._limit()
+        start = time.perf_counter()
+        if self.stable_depths:
+            infos = await analyse_until_stable(self.engine, board, limit, stable_depths=self.stable_depths,
+                                               tolerance=self.tolerance, multipv=self.multipv, info=self.info)
+        else:
+            kwargs = {"multipv": self.multipv} if self.multipv > 1 else {}
+            infos = await self.engine.analyse(board, limit, info=self.info, **kwargs)
+            infos = infos if isinstance(infos, list) else [infos]
+        if self.budget is not None:
+            self.budget.charge(infos, time.perf_counter() - start)
+        return infos
+
+    async def _get_line(self, board, depth) -> list[chess.Move]:
+        if self.engine is None:
+            raise RuntimeError
+        analysis = await self.engine.analyse(board, chess.engine.Limit(depth=depth))
+        return analysis["pv"]
+
+    async def _get_pov_score(self, board, pov, depth, mate_score=1000):
+        if self.engine is None:
+            raise RuntimeError
+
+        analysis = await self.engine.analyse(board, chess.engine.Limit(depth=depth))
+        return self._analysis_pov_score(analysis, pov, mate_score)
+
+
+class AsyncRawMaterialScores(AsyncEngineFeature, RawMaterialScores):
+    """Awaitable :class:`chessmate.features.engine.RawMaterialScores`."""
+
+
+class AsyncEngineEstimate(AsyncEngineFeature, EngineEstimate):
+    """Awaitable :class:`chessmate.features.engine.EngineEstimate`."""
+
+
+class AsyncEnginePipeline(AsyncEngineFeature, EnginePipeline):
+    """Awaitable :class:`chessmate.features.engine.EnginePipeline`."""
+
+
+class AsyncEngineTopScores(AsyncEngineFeature, EngineTopScores):
+    """Awaitable :class:`chessmate.features.engine.EngineTopScores`."""
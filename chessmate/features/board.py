@@ -1,13 +1,30 @@
 from functools import partial
 
+import numpy
+
 from ..nnue_pytorch import halfka as nnue_halfka
 from ..nnue_pytorch import halfkp as nnue_halfkp
 
 
-_halfka = nnue_halfka.Features()
-_factorized_halfka = nnue_halfka.FactorizedFeatures()
-_halfkp = nnue_halfkp.Features()
-_factorized_halfkp = nnue_halfkp.FactorizedFeatures()
+class _LazyFeatures:
+    """Feature set built on first use, importing this module builds none."""
+    def __init__(self, factory):
+        self._factory = factory
+        self._features = None
+
+    def __getattr__(self, name):
+        # Special lookups (e.g. pickling) must not build the feature set
+        if name.startswith("__") or name in ("_factory", "_features"):
+            raise AttributeError(name)
+        if self._features is None:
+            self._features = self._factory()
+        return getattr(self._features, name)
+
+
+_halfka = _LazyFeatures(nnue_halfka.Features)
+_factorized_halfka = _LazyFeatures(nnue_halfka.FactorizedFeatures)
+_halfkp = _LazyFeatures(nnue_halfkp.Features)
+_factorized_halfkp = _LazyFeatures(nnue_halfkp.FactorizedFeatures)
 
 
 def _configurable_board_repr(board, *, f=None):
@@ -19,7 +36,59 @@ def _configurable_board_repr(board, *, f=None):
     return current, other
 
 
+def _configurable_board_indices(board, *, f=None, with_values=False):
+    """Computes the active feature indices of current player"""
+    if board.turn:    # White's turn
+        current, other = f.get_active_indices(board, with_values=with_values)
+    else:             # Black's turn
+        other, current = f.get_active_indices(board, with_values=with_values)
+    return current, other
+
+
+def _configurable_batch_indices(boards, *, f=None):
+    """Computes the active feature indices of current player for many boards
+    (or FENs) at once. Returns the current and other player indices of all
+    boards concatenated, along with the offset of each board in them."""
+    white, black, offsets, turns = f.get_active_indices_batch(boards)
+    # Both perspectives see the same pieces, so each board spans the same
+    # slice in both arrays and we can swap them element wise
+    counts = numpy.diff(offsets, append=len(white))
+    turns = numpy.repeat(turns, counts)
+    current = numpy.where(turns, white, black)
+    other = numpy.where(turns, black, white)
+    return current, other, offsets
+
+
+def batch_indices(boards, features):
+    """Computes the active feature indices of current player for many boards
+    (or FENs) with the ``features`` set (e.g.
+    :class:`chessmate.nnue_pytorch.halfkp.Features`), see
+    :func:`halfkp_batch`."""
+    return _configurable_batch_indices(boards, f=features)
+
+
+def pack_indices(indices, values=None):
+    """Flattens a sequence of per board index arrays into the
+    ``(indices, offsets[, per_sample_weights])`` triplet consumed by
+    :func:`torch.nn.functional.embedding_bag`."""
+    counts = numpy.fromiter((len(i) for i in indices), dtype=numpy.int32, count=len(indices))
+    offsets = numpy.zeros(len(indices), dtype=numpy.int32)
+    numpy.cumsum(counts[:-1], out=offsets[1:])
+    flat = numpy.concatenate(indices) if len(indices) else numpy.empty(0, dtype=numpy.int32)
+    if values is None:
+        return flat, offsets
+    weights = numpy.concatenate(values) if len(values) else numpy.empty(0, dtype=numpy.float32)
+    return flat, offsets, weights
+
+
 halfka = partial(_configurable_board_repr, f=_halfka)
 factorized_halfka = partial(_configurable_board_repr, f=_factorized_halfka)
 halfkp = partial(_configurable_board_repr, f=_halfkp)
 factorized_halfkp = partial(_configurable_board_repr, f=_factorized_halfkp)
+
+halfka_indices = partial(_configurable_board_indices, f=_halfka)
+halfkp_indices = partial(_configurable_board_indices, f=_halfkp)
+factorized_halfkp_indices = partial(_configurable_board_indices, f=_factorized_halfkp, with_values=True)
+
+halfka_batch = partial(_configurable_batch_indices, f=_halfka)
+halfkp_batch = partial(_configurable_batch_indices, f=_halfkp)
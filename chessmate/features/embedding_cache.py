@@ -0,0 +1,104 @@
+import threading
+
+import chess
+import chess.polyglot
+import numpy
+import torch
+
+from .nnue import L3
+
+
+class EmbeddingCache:
+    """Caches the embeddings computed by ``embedding`` (an
+    :class:`chessmate.features.nnue.NNUEEmbedding` or anything with an
+    ``embed_boards`` method) by the Zobrist hash of the positions, so
+    positions seen again, including transpositions reached through other move
+    orders, are not embedded again.
+
+    Embeddings live in a float32 arena preallocated to fit
+    ``memory_budget`` bytes and are evicted with the CLOCK policy. The cache
+    has the same ``embed_boards`` interface, so it can be given to an
+    :class:`chessmate.features.embedding_server.EmbeddingServer`.
+    """
+    def __init__(self, embedding, memory_budget=64 << 20, width=L3):
+        self.embedding = embedding
+        # Each entry takes its embedding, its key and its reference bit
+        self.capacity = max(1, memory_budget // (width * 4 + 8 + 1))
+        self._values = numpy.empty((self.capacity, width), dtype=numpy.float32)
+        self._keys = numpy.zeros(self.capacity, dtype=numpy.uint64)
+        self._referenced = numpy.zeros(self.capacity, dtype=bool)
+        self._slots = {}
+        self._hand = 0
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._slots)
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def stats(self) -> dict:
+        return {"hits": self.hits, "misses": self.misses, "hit_rate": self.hit_rate,
+                "size": len(self), "capacity": self.capacity}
+
+    def embed_boards(self, boards):
+        """Returns the ``[N][width]`` embeddings of ``boards`` (or FENs),
+        only embedding the positions missing from the cache, once each."""
+        boards = [chess.Board(b) if isinstance(b, str) else b for b in boards]
+        keys = [chess.polyglot.zobrist_hash(b) for b in boards]
+        out = numpy.empty((len(boards), self._values.shape[1]), dtype=numpy.float32)
+
+        # Hits and misses count the input boards, a position repeated in
+        # the batch is embedded once but counts one miss per repetition
+        missing = {}
+        hits = 0
+        with self._lock:
+            for i, key in enumerate(keys):
+                slot = self._slots.get(key)
+                if slot is None:
+                    missing.setdefault(key, []).append(i)
+                    continue
+                self._referenced[slot] = True
+                out[i] = self._values[slot]
+                hits += 1
+            self.hits += hits
+            self.misses += len(boards) - hits
+
+        if missing:
+            first = [rows[0] for rows in missing.values()]
+            values = self.embedding.embed_boards([boards[i] for i in first])
+            values = numpy.asarray(values, dtype=numpy.float32)
+            with self._lock:
+                for (key, rows), value in zip(missing.items(), values):
+                    out[rows] = value
+                    if key not in self._slots:
+                        self._insert(key, value)
+        return torch.from_numpy(out)
+
+    def _insert(self, key, value):
+        if len(self._slots) < self.capacity:
+            slot = len(self._slots)
+        else:
+            # CLOCK: skip and clear the recently used entries, evict the first
+            # one that was not used since the hand last passed it
+            while self._referenced[self._hand]:
+                self._referenced[self._hand] = False
+                self._hand = (self._hand + 1) % self.capacity
+            slot = self._hand
+            self._hand = (self._hand + 1) % self.capacity
+            del self._slots[int(self._keys[slot])]
+        self._slots[key] = slot
+        self._keys[slot] = key
+        self._values[slot] = value
+        self._referenced[slot] = False
+
+    def clear(self):
+        with self._lock:
+            self._slots.clear()
+            self._referenced[:] = False
+            self._hand = 0
@@ -0,0 +1,221 @@
+import collections
+import concurrent.futures
+import itertools
+import math
+import os
+import queue
+import socket
+import socketserver
+import threading
+import time
+
+import numpy
+import torch
+
+
+# Priorities of the requests, lower ones are served first
+INTERACTIVE = 0
+BULK = 1
+
+
+class EmbeddingServer:
+    """Embeds boards (or FENs) submitted from any thread with an
+    :class:`chessmate.features.nnue.NNUEEmbedding` in dynamically sized
+    micro-batches.
+
+    A background thread takes the pending requests, waits at most
+    ``max_latency`` seconds after the oldest one was submitted for more to
+    arrive, and embeds up to ``max_batch_size`` of them in one call. Bulk
+    requests wait behind interactive ones, so both can share the model.
+    :meth:`serve_unix` exposes the server to other processes.
+    """
+    def __init__(self, embedding, max_batch_size=256, max_latency=0.002, window=100_000):
+        self.embedding = embedding
+        self.max_batch_size = max_batch_size
+        self.max_latency = max_latency
+
+        self._queue = queue.PriorityQueue()
+        self._sequence = itertools.count()
+        self._unix_servers = []
+        self._closed = False
+        # Guards closing against submissions and the statistics against the
+        # worker thread
+        self._lock = threading.Lock()
+
+        self.requests = 0
+        self.batches = 0
+        self.latencies = collections.deque(maxlen=window)
+        self._started = time.perf_counter()
+
+        self._thread = threading.Thread(target=self._run, name="embedding-server", daemon=True)
+        self._thread.start()
+
+    def submit(self, board, priority=INTERACTIVE) -> concurrent.futures.Future:
+        """Queues ``board`` and returns the future of its ``[L3]`` embedding."""
+        future = concurrent.futures.Future()
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("Embedding server is closed")
+            self._queue.put((priority, next(self._sequence), time.perf_counter(), board, future))
+        return future
+
+    def embed(self, board):
+        return self.submit(board).result()
+
+    def embed_many(self, boards, priority=BULK):
+        """Returns the ``[N][L3]`` embeddings of ``boards``."""
+        futures = [self.submit(board, priority) for board in boards]
+        return torch.stack([future.result() for future in futures])
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item[3] is None:
+                return
+            batch = [item]
+            deadline = item[2] + self.max_latency
+            while len(batch) < self.max_batch_size:
+                try:
+                    item = self._queue.get(timeout=max(deadline - time.perf_counter(), 0))
+                except queue.Empty:
+                    break
+                if item[3] is None:
+                    # Serve what is left before stopping
+                    self._queue.put(item)
+                    break
+                batch.append(item)
+            self._process(batch)
+
+    def _process(self, batch):
+        batch = [item for item in batch if item[4].set_running_or_notify_cancel()]
+        if not batch:
+            return
+        try:
+            embeddings = self.embedding.embed_boards([item[3] for item in batch])
+        except Exception as e:
+            # Find out which boards are invalid by embedding them one by one
+            embeddings = [e] if len(batch) == 1 else [self._embed_one(item[3]) for item in batch]
+
+        done = time.perf_counter()
+        with self._lock:
+            self.batches += 1
+            for item, embedding in zip(batch, embeddings):
+                if not isinstance(embedding, Exception):
+                    self.requests += 1
+                    self.latencies.append(done - item[2])
+        for item, embedding in zip(batch, embeddings):
+            if isinstance(embedding, Exception):
+                item[4].set_exception(embedding)
+            else:
+                item[4].set_result(embedding)
+
+    def _embed_one(self, board):
+        try:
+            return self.embedding.embed_boards([board])[0]
+        except Exception as e:
+            return e
+
+    def stats(self) -> dict:
+        """Returns the number of served requests and batches, the p50 and p99
+        latencies in seconds over the last requests and the throughput in
+        requests per second since the server started."""
+        with self._lock:
+            latencies = numpy.array(self.latencies)
+            requests, batches = self.requests, self.batches
+        p50, p99 = numpy.percentile(latencies, [50, 99]) if len(latencies) else (math.nan, math.nan)
+        return {
+            "requests": requests,
+            "batches": batches,
+            "mean_batch_size": requests / batches if batches else 0.0,
+            "p50": float(p50),
+            "p99": float(p99),
+            "throughput": requests / (time.perf_counter() - self._started),
+        }
+
+    def serve_unix(self, path):
+        """Serves embeddings on the Unix socket ``path`` until the server is
+        closed. Clients write one FEN per line and read, in the same order,
+        one line per FEN with the embedding values separated by spaces (or
+        ``error`` and a message), see :func:`request_embeddings`."""
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("Embedding server is closed")
+            server = _UnixServer(str(path), _EmbeddingHandler)
+            server.embedding_server = self
+            self._unix_servers.append(server)
+        threading.Thread(target=server.serve_forever, name="embedding-server-unix", daemon=True).start()
+        return server
+
+    def close(self):
+        with self._lock:
+            if self._closed:
+                return
+            servers, self._unix_servers = self._unix_servers, []
+        # Socket clients finish submitting before the queue is closed
+        for server in servers:
+            server.shutdown()
+            server.server_close()
+            os.unlink(server.server_address)
+        with self._lock:
+            self._closed = True
+            # Requests submitted so far are all queued before this sentinel
+            self._queue.put((math.inf, next(self._sequence), 0.0, None, None))
+        self._thread.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class _UnixServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+class _EmbeddingHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        # Requests are submitted as they are read so a client pipelining many
+        # FENs fills the micro-batches, replies are written in order
+        pending = queue.Queue()
+        writer = threading.Thread(target=self._reply, args=(pending,))
+        writer.start()
+        try:
+            for line in self.rfile:
+                fen = line.decode("ascii", "replace").strip()
+                if fen:
+                    pending.put(self.server.embedding_server.submit(fen, BULK))
+        finally:
+            pending.put(None)
+            writer.join()
+
+    def _reply(self, pending):
+        for future in iter(pending.get, None):
+            try:
+                line = " ".join(f"{v:.9g}" for v in future.result().tolist())
+            except Exception as e:
+                line = f"error {e}".replace("\n", " ")
+            try:
+                self.wfile.write(line.encode("ascii") + b"\n")
+            except OSError:
+                return
+
+
+def request_embeddings(path, boards) -> numpy.ndarray:
+    """Client of :meth:`EmbeddingServer.serve_unix`, returns the ``[N][L3]``
+    embeddings of ``boards`` (or FENs). Raises a ValueError if the server
+    failed to embed one of them."""
+    fens = [b if isinstance(b, str) else b.fen() for b in boards]
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.connect(str(path))
+        sock.sendall("".join(f"{fen}\n" for fen in fens).encode("ascii"))
+        sock.shutdown(socket.SHUT_WR)
+        with sock.makefile("r", encoding="ascii") as replies:
+            lines = [replies.readline() for _ in fens]
+
+    rows = []
+    for fen, line in zip(fens, lines):
+        if not line or line.startswith("error"):
+            raise ValueError(f"Could not embed {fen}: {line.strip() or 'connection closed'}")
+        rows.append(numpy.array(line.split(), dtype=numpy.float32))
+    return numpy.stack(rows) if rows else numpy.empty((0, 0), dtype=numpy.float32)
@@ -1,6 +1,15 @@
-from typing import Union
-
+import atexit
+import collections
+import concurrent.futures
+import contextlib
+import dataclasses
+import math
+import os
+import queue
+import threading
+import time
 import chess.engine
+import numpy
 
 
 MATERIAL_VALUE = {
@@ -8,18 +17,540 @@ MATERIAL_VALUE = {
     "P": 1, "N": 3, "B": 3, "R": 5, "Q": 9, "K": 0
 }
 
+# Material value indexed by piece type, kings are worth nothing
+PIECE_TYPE_VALUE = (0, 1, 3, 3, 5, 9, 0)
+_VALUES = numpy.array(PIECE_TYPE_VALUE[chess.PAWN:chess.KING], dtype=numpy.int64)
+
+
+def material_balance(board: chess.Board) -> int:
+    """White material minus black material, computed from the piece
+    bitboards popcounts."""
+    white = board.occupied_co[chess.WHITE]
+    balance = 0
+    for mask, value in zip((board.pawns, board.knights, board.bishops, board.rooks, board.queens), _VALUES.tolist()):
+        balance += value * (2 * chess.popcount(mask & white) - chess.popcount(mask))
+    return balance
+
+
+def _popcount(masks):
+    if hasattr(numpy, "bitwise_count"):
+        return numpy.bitwise_count(masks).astype(numpy.int64)
+    bits = numpy.unpackbits(masks[..., None].view(numpy.uint8), axis=-1)
+    return bits.sum(axis=-1, dtype=numpy.int64)
+
+
+def material_balances(boards) -> numpy.ndarray:
+    """:func:`material_balance` of many boards in one call, as an int64
+    array."""
+    masks = numpy.array([(b.pawns, b.knights, b.bishops, b.rooks, b.queens, b.occupied_co[chess.WHITE])
+                         for b in boards], dtype=numpy.uint64).reshape(-1, 6)
+    pieces, white = masks[:, :5], masks[:, 5:]
+    return (2 * _popcount(pieces & white) - _popcount(pieces)) @ _VALUES
+
+
+def line_material_balances(board: chess.Board, line) -> numpy.ndarray:
+    """:func:`material_balance` of ``board`` followed by the balance after
+    each move of ``line``, as a ``len(line) + 1`` int64 array.
+
+    Only captures and promotions change the material, so the moves are
+    followed on a mailbox of signed piece types rather than played on a
+    board, ``board`` is left untouched.
+    """
+    mailbox = [0] * 64
+    for color, sign in ((chess.WHITE, 1), (chess.BLACK, -1)):
+        for piece_type in chess.PIECE_TYPES:
+            for square in chess.scan_forward(board.pieces_mask(piece_type, color)):
+                mailbox[square] = sign * piece_type
+
+    def value(code):
+        return PIECE_TYPE_VALUE[code] if code > 0 else -PIECE_TYPE_VALUE[-code]
+
+    deltas = numpy.zeros(len(line) + 1, dtype=numpy.int64)
+    deltas[0] = material_balance(board)
+    for i, move in enumerate(line, 1):
+        if not move:
+            continue
+        code, target = mailbox[move.from_square], mailbox[move.to_square]
+        from_file, to_file = chess.square_file(move.from_square), chess.square_file(move.to_square)
+        rank = chess.square_rank(move.from_square)
+        mailbox[move.from_square] = 0
+
+        if abs(code) == chess.KING and (target * code > 0 or abs(to_file - from_file) > 1):
+            # Castling, as king to rook (Chess960) or king two squares
+            kingside = to_file > from_file
+            rook_from = move.to_square if target else chess.square(7 if kingside else 0, rank)
+            rook, mailbox[rook_from] = mailbox[rook_from], 0
+            mailbox[chess.square(5 if kingside else 3, rank)] = rook
+            mailbox[chess.square(6 if kingside else 2, rank)] = code
+            continue
+
+        if abs(code) == chess.PAWN and from_file != to_file and not target:
+            # En passant
+            captured = chess.square(to_file, rank)
+            target, mailbox[captured] = mailbox[captured], 0
+        if move.promotion:
+            promoted = code // abs(code) * move.promotion
+            deltas[i] += value(promoted) - value(code)
+            code = promoted
+        deltas[i] -= value(target)
+        mailbox[move.to_square] = code
+    return numpy.cumsum(deltas)
+
 stockfish_path = "/usr/local/bin/stockfish"
 
-def _start_engine(path) -> Union[chess.engine.SimpleEngine, None]:
-    try:
-        return chess.engine.SimpleEngine.popen_uci(path)
-    except FileNotFoundError:
-        return None
+
+def engine_settings(environ=None) -> dict:
+    """Returns the engine settings configured by the environment:
+    ``CHESSMATE_ENGINE`` (the engine executable, :data:`stockfish_path` by
+    default), ``CHESSMATE_ENGINE_THREADS``, ``CHESSMATE_ENGINE_HASH`` (MB)
+    and ``CHESSMATE_ENGINE_NNUE`` (the network file of the engine)."""
+    environ = os.environ if environ is None else environ
+    threads, hash = environ.get("CHESSMATE_ENGINE_THREADS"), environ.get("CHESSMATE_ENGINE_HASH")
+    return {
+        "path": environ.get("CHESSMATE_ENGINE", stockfish_path),
+        "threads": int(threads) if threads else None,
+        "hash": int(hash) if hash else None,
+        "nnue": environ.get("CHESSMATE_ENGINE_NNUE") or None,
+    }
+
+
+def _engine_options(threads=None, hash=None, nnue=None, options=None) -> dict:
+    configured = {}
+    if threads is not None:
+        configured["Threads"] = threads
+    if hash is not None:
+        configured["Hash"] = hash
+    if nnue is not None:
+        configured["EvalFile"] = os.fspath(nnue)
+        configured["Use NNUE"] = True
+    configured.update(options or {})
+    return configured
+
+
+class EngineSession:
+    """UCI engine process started on first use and closed with the session.
+
+    Settings left to None are read from the environment, see
+    :func:`engine_settings`. The session stands in for the engine it owns
+    (:meth:`analyse`, :meth:`analysis` and :attr:`id`) so it can be given to
+    engine features. A process forked from the one that started the engine
+    does not share it, its session starts its own engine when used.
+    """
+    def __init__(self, path=None, *, threads=None, hash=None, nnue=None, options=None, timeout=10.0):
+        settings = engine_settings()
+        self.path = settings["path"] if path is None else path
+        self.options = _engine_options(settings["threads"] if threads is None else threads,
+                                       settings["hash"] if hash is None else hash,
+                                       settings["nnue"] if nnue is None else nnue, options)
+        self.timeout = timeout
+        self._engine = None
+        self._pid = os.getpid()
+        self._lock = threading.Lock()
+
+    @property
+    def engine(self) -> chess.engine.SimpleEngine:
+        """The engine process, started by the first call."""
+        with self._lock:
+            if self._pid != os.getpid():
+                # The engine belongs to the parent process, leave it alone
+                self._engine, self._pid = None, os.getpid()
+            if self._engine is None:
+                try:
+                    engine = chess.engine.SimpleEngine.popen_uci(self.path, timeout=self.timeout)
+                except FileNotFoundError as e:
+                    raise RuntimeError(f"No UCI engine at {self.path}, set CHESSMATE_ENGINE") from e
+                engine.configure({k: v for k, v in self.options.items() if k in engine.options})
+                self._engine = engine
+            return self._engine
+
+    @property
+    def started(self) -> bool:
+        return self._engine is not None and self._pid == os.getpid()
+
+    @property
+    def id(self):
+        return self.engine.id
+
+    def analyse(self, board, limit, **kwargs):
+        return self.engine.analyse(board, limit, **kwargs)
+
+    def analysis(self, board, limit=None, **kwargs):
+        return self.engine.analysis(board, limit, **kwargs)
+
+    def close(self):
+        with self._lock:
+            engine, self._engine = self._engine, None
+        if engine is None or self._pid != os.getpid():
+            return
+        try:
+            engine.quit()
+        except (chess.engine.EngineError, concurrent.futures.TimeoutError):
+            engine.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+_default_session = None
+_default_session_lock = threading.Lock()
+
+
+def default_session() -> EngineSession:
+    """Returns the session of the engine shared by the features not given
+    their own, configured by the environment and closed at exit."""
+    global _default_session
+    with _default_session_lock:
+        if _default_session is None:
+            _default_session = EngineSession()
+        return _default_session
+
+
+def set_default_session(session: EngineSession) -> EngineSession:
+    """Makes ``session`` the shared one and returns the previous one, which
+    is not closed."""
+    global _default_session
+    with _default_session_lock:
+        previous, _default_session = _default_session, session
+    return previous
+
+
+def _forget_default_session():
+    # Forked children start their own engine rather than share the parent
+    # one, the lock may have been held by another thread of the parent
+    global _default_session, _default_session_lock
+    _default_session = None
+    _default_session_lock = threading.Lock()
+
+
+def _close_default_session():
+    if _default_session is not None:
+        _default_session.close()
+
+
+if hasattr(os, "register_at_fork"):
+    # Not available on Windows, which does not fork
+    os.register_at_fork(after_in_child=_forget_default_session)
+atexit.register(_close_default_session)
+
+
+class EnginePool:
+    """Pool of UCI engine processes that can stand in for a single engine.
+
+    Each :meth:`analyse` call runs on whichever process is idle, so engine
+    features given the pool as engine can be spread over all the processes
+    with :meth:`map` and :meth:`imap`. Engines that die are restarted and the
+    interrupted analysis is retried once.
+    """
+    def __init__(self, path=None, size=None, *, threads=1, hash=None, options=None, timeout=10.0):
+        self.path = engine_settings()["path"] if path is None else path
+        self.size = size or os.cpu_count() or 1
+        self.timeout = timeout
+        self.options = dict(options or {})
+        self.options["Threads"] = threads
+        if hash is not None:
+            self.options["Hash"] = hash
+
+        self._lock = threading.Lock()
+        self._idle = queue.Queue()
+        self._engines = []
+        self._executor = None
+        self._closed = False
+        try:
+            for _ in range(self.size):
+                self._idle.put(self._start())
+        except BaseException:
+            self.close()
+            raise
+
+    def _start(self) -> chess.engine.SimpleEngine:
+        engine = chess.engine.SimpleEngine.popen_uci(self.path, timeout=self.timeout)
+        engine.configure({k: v for k, v in self.options.items() if k in engine.options})
+        with self._lock:
+            self._engines.append(engine)
+        return engine
+
+    def _restart(self, engine) -> chess.engine.SimpleEngine:
+        with self._lock:
+            if engine in self._engines:
+                self._engines.remove(engine)
+        try:
+            engine.close()
+        except chess.engine.EngineError:
+            pass
+        return self._start()
+
+    def _acquire(self) -> chess.engine.SimpleEngine:
+        # Slots whose engine could not be restarted are queued empty and get
+        # a new engine on their next use
+        engine = self._idle.get()
+        if engine is None:
+            try:
+                engine = self._start()
+            except BaseException:
+                self._idle.put(None)
+                raise
+        return engine
+
+    @property
+    def id(self):
+        if not self._engines:
+            raise RuntimeError("No engine of the pool is running")
+        return self._engines[0].id
+
+    def analyse(self, board, limit, **kwargs):
+        if self._closed:
+            raise RuntimeError("Engine pool is closed")
+        engine = self._acquire()
+        try:
+            try:
+                return engine.analyse(board, limit, **kwargs)
+            except chess.engine.EngineTerminatedError:
+                # The dead engine is never queued again, even when no new
+                # one can be started
+                dead, engine = engine, None
+                engine = self._restart(dead)
+                return engine.analyse(board, limit, **kwargs)
+        finally:
+            self._idle.put(engine)
+
+    @contextlib.contextmanager
+    def analysis(self, board, limit=None, **kwargs):
+        """Same as :meth:`chess.engine.SimpleEngine.analysis`, the engine
+        process is held until the context exits."""
+        if self._closed:
+            raise RuntimeError("Engine pool is closed")
+        engine = self._acquire()
+        try:
+            try:
+                analysis = engine.analysis(board, limit, **kwargs)
+            except chess.engine.EngineTerminatedError:
+                dead, engine = engine, None
+                engine = self._restart(dead)
+                analysis = engine.analysis(board, limit, **kwargs)
+            with analysis:
+                yield analysis
+        finally:
+            self._idle.put(engine)
+
+    def imap(self, fn, boards):
+        """Lazily yields ``fn(board)`` for each board, in order, running up to
+        one call per engine process concurrently."""
+        with self._lock:
+            if self._executor is None:
+                self._executor = concurrent.futures.ThreadPoolExecutor(self.size)
+        pending = collections.deque()
+        for board in boards:
+            pending.append(self._executor.submit(fn, board))
+            if len(pending) >= 2 * self.size:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+    def map(self, fn, boards) -> list:
+        """Returns ``[fn(board) for board in boards]`` computed on the pool."""
+        return list(self.imap(fn, boards))
+
+    def close(self):
+        self._closed = True
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+        with self._lock:
+            engines, self._engines = self._engines, []
+        for engine in engines:
+            try:
+                engine.quit()
+            except (chess.engine.EngineError, concurrent.futures.TimeoutError):
+                engine.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class BudgetExhausted(Exception):
+    """Raised by the searches of engine features once their
+    :class:`LabelingBudget` is spent."""
+
+
+class LabelingBudget:
+    """Total search budget of a labeling job, in engine nodes and/or seconds
+    of search, shared by the engine features given it (from any thread).
+
+    Each search is limited to its share of what remains, the remaining
+    budget split evenly over the remaining ``positions`` when their number is
+    known, so the job ends on budget however hard the positions are. Once the
+    budget is spent searches raise :class:`BudgetExhausted`.
+    """
+    def __init__(self, nodes=None, time=None, positions=None):
+        if nodes is None and time is None:
+            raise ValueError("A nodes or time budget should be provided")
+        self.nodes = nodes
+        self.time = time
+        self.positions = positions
+        self.spent_nodes = 0
+        self.spent_time = 0.0
+        self.searches = 0
+        self._lock = threading.Lock()
+
+    @property
+    def exhausted(self) -> bool:
+        return ((self.nodes is not None and self.spent_nodes >= self.nodes)
+                or (self.time is not None and self.spent_time >= self.time))
+
+    def limit(self, limit: chess.engine.Limit) -> chess.engine.Limit:
+        """Returns ``limit`` restricted to the share of the budget of the next
+        search."""
+        with self._lock:
+            if self.exhausted:
+                raise BudgetExhausted(f"Labeling budget spent after {self.searches} searches")
+            remaining = 1
+            if self.positions is not None:
+                remaining = max(self.positions - self.searches, 1)
+            changes = {}
+            if self.nodes is not None:
+                share = max((self.nodes - self.spent_nodes) // remaining, 1)
+                changes["nodes"] = min(limit.nodes or share, share)
+            if self.time is not None:
+                share = (self.time - self.spent_time) / remaining
+                changes["time"] = min(limit.time or share, share)
+            return dataclasses.replace(limit, **changes)
+
+    def charge(self, infos, elapsed):
+        """Records a search of ``elapsed`` seconds that returned ``infos``."""
+        nodes = max((info.get("nodes", 0) for info in infos), default=0)
+        with self._lock:
+            self.spent_nodes += nodes
+            self.spent_time += elapsed
+            self.searches += 1
+
+
+def _stable(scores, stable_depths, tolerance):
+    last = scores[-stable_depths:]
+    return len(last) == stable_depths and max(last) - min(last) <= tolerance
+
+
+def _stable_update(infos, scores, update, stable_depths, tolerance) -> bool:
+    """Records an analysis ``update`` in ``infos`` (by principal variation)
+    and ``scores`` (of the best one), returns whether the best score is
+    stable."""
+    if "score" not in update or "lowerbound" in update or "upperbound" in update:
+        return False
+    rank = update.get("multipv", 1)
+    infos[rank] = update
+    if rank != 1:
+        return False
+    scores.append(update["score"].white().score(mate_score=100_000))
+    return _stable(scores, stable_depths, tolerance)
+
+
+def analyse_until_stable(engine, board, limit, *, stable_depths=3, tolerance=10, multipv=1,
+                         info=chess.engine.INFO_ALL) -> list[dict]:
+    """Analyses ``board`` like ``engine.analyse`` (``engine`` is a UCI engine
+    or an :class:`EnginePool`) but stops the search as soon as the best score
+    moved by at most ``tolerance`` centipawns over the last ``stable_depths``
+    iterations. Returns the infos of each principal variation, best first,
+    those of the complete search when the score never got stable."""
+    infos = {}
+    scores = []
+    with engine.analysis(board, limit, multipv=multipv, info=info | chess.engine.INFO_SCORE) as analysis:
+        for update in analysis:
+            if _stable_update(infos, scores, update, stable_depths, tolerance):
+                analysis.stop()
+                break
+        else:
+            # The search reached its limit, its final result is the one
+            # analyse would have returned
+            return list(analysis.multipv)
+    return [infos[rank] for rank in sorted(infos)]
+
+
+def _merge_limits(limits) -> chess.engine.Limit:
+    # Search as much as the most demanding limit of each kind
+    merged = {}
+    for limit in limits:
+        for name, value in dataclasses.asdict(limit).items():
+            if value is not None and name in ("depth", "nodes", "time"):
+                merged[name] = max(merged.get(name, value), value)
+    return chess.engine.Limit(**merged)
 
 
 class EngineFeature:
-    # TODO: need config file
-    engine = _start_engine(stockfish_path)
+    """Base of the features computed from an engine analysis of the board.
+
+    The search is bounded by the feature own limit (usually a depth) and by
+    ``nodes`` and ``time`` (seconds) when given, whichever comes first.
+    ``budget`` shares a :class:`LabelingBudget` between features and
+    ``stable_depths`` stops the searches early once the score is stable
+    within ``tolerance`` centipawns, see :func:`analyse_until_stable`.
+    """
+    # What the feature needs from the analysis, an EnginePipeline merges them
+    # to serve several features with a single search
+    info = chess.engine.INFO_ALL
+    multipv = 1
+
+    def __init__(self, engine=None, *, nodes=None, time=None, budget=None, stable_depths=None, tolerance=10):
+        # Features use the shared engine unless given their own engine or pool
+        if engine is not None:
+            self.engine = engine
+        self.nodes = nodes
+        self.time = time
+        self.budget = budget
+        self.stable_depths = stable_depths
+        self.tolerance = tolerance
+
+    @property
+    def engine(self):
+        """The engine, pool or session of the feature, the shared
+        :func:`default_session` unless given one."""
+        return self.__dict__["_engine"] if "_engine" in self.__dict__ else default_session()
+
+    @engine.setter
+    def engine(self, engine):
+        self._engine = engine
+
+    def __call__(self, board: chess.Board):
+        return self._from_analysis(board, self._analyse(board))
+
+    def _search_limit(self) -> chess.engine.Limit:
+        raise NotImplementedError
+
+    def _bounded_limit(self) -> chess.engine.Limit:
+        limit = self._search_limit()
+        if self.nodes is not None or self.time is not None:
+            limit = dataclasses.replace(limit, nodes=self.nodes, time=self.time)
+        return limit
+
+    def _limit(self) -> chess.engine.Limit:
+        limit = self._bounded_limit()
+        if self.budget is not None:
+            limit = self.budget.limit(limit)
+        return limit
+
+    def _from_analysis(self, board, infos):
+        """Computes the feature from the analysis ``infos`` of ``board``, one
+        info per principal variation, best first."""
+        raise NotImplementedError
+
+    def _analyse(self, board) -> list[dict]:
+        if self.engine is None:
+            raise RuntimeError
+        limit = self._limit()
+        start = time.perf_counter()
+        if self.stable_depths:
+            infos = analyse_until_stable(self.engine, board, limit, stable_depths=self.stable_depths,
+                                         tolerance=self.tolerance, multipv=self.multipv, info=self.info)
+        else:
+            kwargs = {"multipv": self.multipv} if self.multipv > 1 else {}
+            infos = self.engine.analyse(board, limit, info=self.info, **kwargs)
+            infos = infos if isinstance(infos, list) else [infos]
+        if self.budget is not None:
+            self.budget.charge(infos, time.perf_counter() - start)
+        return infos
 
     def _get_line(self, board, depth) -> list[chess.Move]:
         if self.engine is None:
@@ -32,20 +563,18 @@ class EngineFeature:
             raise RuntimeError
 
         analysis = self.engine.analyse(board, chess.engine.Limit(depth=depth))
-        pov_score = analysis["score"].pov(pov).score(mate_score=mate_score)
-        return pov_score
-
-    def __del__(self):
-        if self.engine is not None:
-            self.engine.close()
-
+        return self._analysis_pov_score(analysis, pov, mate_score)
 
+    @staticmethod
+    def _analysis_pov_score(analysis, pov, mate_score):
+        return analysis["score"].pov(pov).score(mate_score=mate_score)
 
 
 class RawMaterialScores(EngineFeature):
     """Computes the raw material scores at given plies following the best
     line for this move."""
-    def __init__(self, *, depth=None, relative_plies=None):
+    def __init__(self, *, depth=None, relative_plies=None, engine=None, **search):
+        super().__init__(engine, **search)
         if (depth is None) == (relative_plies is None):
             raise ValueError("One and only one of depth and plies should be provided")
 
@@ -58,50 +587,103 @@ class RawMaterialScores(EngineFeature):
 
         self._feature_length = sum(self.use_ply) + 1
 
+    info = chess.engine.INFO_PV
+
+    def _search_limit(self) -> chess.engine.Limit:
+        return chess.engine.Limit(depth=self.depth + 2)
+
+    def _from_analysis(self, board, infos) -> list[float]:
+        return self._line_scores(board, infos[0].get("pv", []))
+
     def _raw_material_score(self, board, pov) -> float:
-        score = sum(MATERIAL_VALUE[p.symbol()] for _, p in board.piece_map().items())
+        score = material_balance(board)
         if pov == chess.BLACK:
             # Invert black score
             score *= -1
         return score
 
-    def __call__(self, board: chess.Board) -> list[float]:
+    def line_scores(self, board: chess.Board, line: list[chess.Move]) -> numpy.ndarray:
+        """Returns the material scores along ``line`` as a float array, NaN
+        past the end of the line. ``board`` is not modified."""
         # We are in a situation where we evaluate a given move (already played here).
         # So if we want to evaluate the value of a move it is the value as the
         # other player (which is ours!)
         us = not board.turn
 
-        # First move is already done, get current material score
-        material_scores: list[float] = []
-        if len(self.use_ply) > 1 and self.use_ply[0]:
-            material_scores.append(self._raw_material_score(board, us))
-
-
-        print(f"us = {'white' if us else 'black'}")
-
-        line = self._get_line(board, self.depth + 2)
-        for move, use_ply in zip(line, self.use_ply):
-            board.push(move)
-            if not use_ply:
-                continue
-
-            material_scores.append(self._raw_material_score(board, us))
+        balances = line_material_balances(board, line[:len(self.use_ply)])
+        if us == chess.BLACK:
+            balances = -balances
 
-        if len(material_scores) < self._feature_length:
-            material_scores += [float("nan")] * (self._feature_length - len(material_scores))
+        # First move is already done, the current material score comes first
+        plies = [i + 1 for i, use_ply in enumerate(self.use_ply) if use_ply]
+        if len(self.use_ply) > 1 and self.use_ply[0]:
+            plies.insert(0, 0)
+        scores = numpy.full(self._feature_length, numpy.nan)
+        available = [ply for ply in plies if ply < len(balances)]
+        scores[:len(available)] = balances[available]
+        return scores
 
-        return material_scores
+    def _line_scores(self, board: chess.Board, line: list[chess.Move]) -> list[float]:
+        return self.line_scores(board, line).tolist()
 
 
 class EngineEstimate(EngineFeature):
     """Computes the engine estimate score for this move """
-    def __init__(self, depth, mate_score=318):
+    def __init__(self, depth=None, mate_score=318, engine=None, **search):
+        super().__init__(engine, **search)
+        if depth is None and self.nodes is None and self.time is None:
+            raise ValueError("At least one of depth, nodes and time should be provided")
         self.depth = depth
         self.mate_score = mate_score
 
-    def __call__(self, board) -> float:
+    info = chess.engine.INFO_SCORE
+
+    def _search_limit(self) -> chess.engine.Limit:
+        return chess.engine.Limit(depth=self.depth)
+
+    def _from_analysis(self, board, infos) -> float:
         # We are in a situation where the move has already been played
         # So if we want to evaluate the value this move value it is seen as the
         # previous player point of view
         us = not board.turn
-        return self._get_pov_score(board, us, self.depth, self.mate_score)
+        return self._analysis_pov_score(infos[0], us, self.mate_score)
+
+
+class EngineTopScores(EngineEstimate):
+    """Computes the engine estimate score of the ``k`` best replies to this
+    move with a single multi-PV search, best first and NaN padded when there
+    are fewer legal replies."""
+    def __init__(self, k, depth=None, mate_score=318, engine=None, **search):
+        super().__init__(depth, mate_score, engine, **search)
+        self.multipv = k
+
+    def _from_analysis(self, board, infos) -> list[float]:
+        us = not board.turn
+        scores = [self._analysis_pov_score(info, us, self.mate_score) for info in infos[:self.multipv]]
+        return scores + [math.nan] * (self.multipv - len(scores))
+
+
+class EnginePipeline(EngineFeature):
+    """Computes several engine features from a single analysis per board.
+
+    The search goes as deep (and as long) as the most demanding feature
+    needs, with as many principal variations as the feature that wants the
+    most, and calling the
+    pipeline returns the list of the features values.
+    """
+    def __init__(self, features, engine=None, **search):
+        super().__init__(engine, **search)
+        self.features = list(features)
+        if not self.features:
+            raise ValueError("At least one feature should be provided")
+
+        self.info = chess.engine.INFO_NONE
+        for feature in self.features:
+            self.info |= feature.info
+        self.multipv = max(feature.multipv for feature in self.features)
+
+    def _search_limit(self) -> chess.engine.Limit:
+        return _merge_limits(f._bounded_limit() for f in self.features)
+
+    def _from_analysis(self, board, infos) -> list:
+        return [feature._from_analysis(board, infos) for feature in self.features]
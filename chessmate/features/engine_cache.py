@@ -0,0 +1,222 @@
+import collections
+import dataclasses
+import json
+import sqlite3
+import threading
+
+import chess
+import chess.engine
+import chess.polyglot
+
+
+def _position_key(board) -> int:
+    # SQLite integers are signed 64 bits
+    key = chess.polyglot.zobrist_hash(board)
+    return key - (1 << 64) if key >= (1 << 63) else key
+
+
+def _limit_key(limit: chess.engine.Limit):
+    """Splits a limit into a key and a depth. Depth only limits share the key
+    ``"depth"`` so deeper results can answer shallower requests, any other
+    limit only matches itself."""
+    fields = {k: v for k, v in dataclasses.asdict(limit).items() if v is not None}
+    if set(fields) == {"depth"}:
+        return "depth", fields["depth"]
+    return json.dumps(fields, sort_keys=True), 0
+
+
+def _encode_info(info) -> dict:
+    encoded = {k: info[k] for k in ("depth", "seldepth", "multipv", "nodes", "time") if k in info}
+    if "score" in info:
+        score = info["score"].white()
+        if score == chess.engine.MateGiven:
+            # White mated Black, Mate(0) would mean White is mated
+            encoded["score"] = {"mate_given": True}
+        elif score.is_mate():
+            encoded["score"] = {"mate": score.mate()}
+        else:
+            encoded["score"] = {"cp": score.score()}
+    if "pv" in info:
+        encoded["pv"] = [move.uci() for move in info["pv"]]
+    return encoded
+
+
+def _decode_info(encoded) -> dict:
+    info = dict(encoded)
+    if "score" in info:
+        score = info["score"]
+        if score.get("mate_given"):
+            score = chess.engine.MateGiven
+        elif "mate" in score:
+            score = chess.engine.Mate(score["mate"])
+        else:
+            score = chess.engine.Cp(score["cp"])
+        info["score"] = chess.engine.PovScore(score, chess.WHITE)
+    if "pv" in info:
+        info["pv"] = [chess.Move.from_uci(uci) for uci in info["pv"]]
+    return info
+
+
+_SCHEMA_VERSION = 3
+
+
+class AnalysisCache:
+    """Cache of engine analyses keyed by the Zobrist hash of the position, the
+    search limit and the engine identity.
+
+    Entries live in an in memory LRU tier of ``capacity`` positions and, when
+    ``path`` is given, in an SQLite database that survives between runs. An
+    analysis searched to a given depth answers requests for that depth or any
+    shallower one, and one with more principal variations answers requests
+    for fewer. Analyses with different numbers of principal variations are
+    kept side by side, a deeper one does not replace a wider one.
+    """
+    def __init__(self, path=None, capacity=100_000):
+        self.capacity = capacity
+        self._memory = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self._db = None
+        if path is not None:
+            self._db = sqlite3.connect(str(path), check_same_thread=False)
+            if self._db.execute("PRAGMA user_version").fetchone()[0] != _SCHEMA_VERSION:
+                # Older caches keyed entries without their multipv or stored
+                # checkmates of Black as White being mated, start over
+                self._db.execute("DROP TABLE IF EXISTS analyses")
+                self._db.execute(f"PRAGMA user_version = {_SCHEMA_VERSION}")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS analyses ("
+                " position INTEGER NOT NULL, engine TEXT NOT NULL, lim TEXT NOT NULL,"
+                " multipv INTEGER NOT NULL, depth INTEGER NOT NULL, infos TEXT NOT NULL,"
+                " PRIMARY KEY (position, engine, lim, multipv))")
+            self._db.commit()
+
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    @property
+    def hits(self) -> int:
+        return self.memory_hits + self.disk_hits
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def stats(self) -> dict:
+        return {"memory_hits": self.memory_hits, "disk_hits": self.disk_hits,
+                "misses": self.misses, "hit_rate": self.hit_rate}
+
+    def get(self, board, limit, engine_id, multipv=1):
+        """Returns the cached infos (one per principal variation, best first)
+        satisfying the request or ``None``."""
+        lim, depth = _limit_key(limit)
+        key = (_position_key(board), engine_id, lim)
+        with self._lock:
+            entries = self._memory.get(key, {})
+            for pvs, (entry_depth, infos) in entries.items():
+                if entry_depth >= depth and pvs >= multipv:
+                    self._memory.move_to_end(key)
+                    self.memory_hits += 1
+                    return [_decode_info(i) for i in infos[:multipv]]
+
+            if self._db is not None:
+                row = self._db.execute(
+                    "SELECT multipv, depth, infos FROM analyses"
+                    " WHERE position = ? AND engine = ? AND lim = ? AND depth >= ? AND multipv >= ?"
+                    " ORDER BY multipv LIMIT 1",
+                    (*key, depth, multipv)).fetchone()
+                if row is not None:
+                    infos = json.loads(row[2])
+                    self._remember(key, row[0], row[1], infos)
+                    self.disk_hits += 1
+                    return [_decode_info(i) for i in infos[:multipv]]
+
+            self.misses += 1
+            return None
+
+    def put(self, board, limit, engine_id, infos, multipv=None):
+        """Caches the ``infos`` of an analysis of ``board`` that asked for
+        ``multipv`` principal variations (positions with fewer moves return
+        less)."""
+        lim, depth = _limit_key(limit)
+        key = (_position_key(board), engine_id, lim)
+        encoded = [_encode_info(i) for i in infos]
+        if lim == "depth":
+            # Record the depth actually reached, it may answer deeper requests
+            depth = max([depth] + [i.get("depth", 0) for i in encoded])
+        multipv = max(len(encoded), multipv or 1)
+        with self._lock:
+            current = self._memory.get(key, {}).get(multipv)
+            if current is None or current[0] <= depth:
+                self._remember(key, multipv, depth, encoded)
+            if self._db is not None:
+                self._db.execute(
+                    "INSERT INTO analyses VALUES (?, ?, ?, ?, ?, ?)"
+                    " ON CONFLICT (position, engine, lim, multipv) DO UPDATE SET"
+                    " depth = excluded.depth, infos = excluded.infos"
+                    " WHERE excluded.depth >= analyses.depth",
+                    (*key, multipv, depth, json.dumps(encoded)))
+                self._db.commit()
+
+    def _remember(self, key, multipv, depth, infos):
+        self._memory.setdefault(key, {})[multipv] = (depth, infos)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.capacity:
+            self._memory.popitem(last=False)
+
+    def close(self):
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def _engine_id(engine):
+    return engine.id.get("name", "unknown")
+
+
+def _cache_info(info):
+    # Always fetch what the cache stores so any later request can be answered
+    return info | chess.engine.INFO_SCORE | chess.engine.INFO_PV
+
+
+class CachedEngine:
+    """Engine (or engine pool) wrapper whose :meth:`analyse` answers from an
+    :class:`AnalysisCache` when it can and caches the engine results
+    otherwise. It can be given to engine features in place of the engine."""
+    def __init__(self, engine, cache, engine_id=None):
+        self.engine = engine
+        self.cache = cache
+        self.engine_id = engine_id or _engine_id(engine)
+
+    @property
+    def id(self):
+        return self.engine.id
+
+    def analyse(self, board, limit, *, multipv=None, info=chess.engine.INFO_ALL, **kwargs):
+        infos = self.cache.get(board, limit, self.engine_id, multipv or 1)
+        if infos is None:
+            infos = self.engine.analyse(board, limit, multipv=multipv or 1, info=_cache_info(info), **kwargs)
+            self.cache.put(board, limit, self.engine_id, infos, multipv or 1)
+        return infos if multipv is not None else infos[0]
+
+    def analysis(self, board, limit=None, **kwargs):
+        """Streams the analysis of the wrapped engine, a search stopped
+        early cannot answer later requests so it is not cached."""
+        return self.engine.analysis(board, limit, **kwargs)
+
+
+class AsyncCachedEngine(CachedEngine):
+    """:class:`CachedEngine` for asyncio engines and engine pools."""
+    async def analyse(self, board, limit, *, multipv=None, info=chess.engine.INFO_ALL, **kwargs):
+        infos = self.cache.get(board, limit, self.engine_id, multipv or 1)
+        if infos is None:
+            infos = await self.engine.analyse(board, limit, multipv=multipv or 1, info=_cache_info(info), **kwargs)
+            self.cache.put(board, limit, self.engine_id, infos, multipv or 1)
+        return infos if multipv is not None else infos[0]
@@ -1,5 +1,15 @@
+import os
+import pathlib
+
+import chess
+import numpy
 import torch
 from torch import nn
+from torch.nn import functional as F
+
+from ..nnue_pytorch import halfka, halfkp
+from . import board as board_features
+from .nnue_file import NNUEFile
 
 
 # 3 layer fully connected network
@@ -7,36 +17,357 @@ L1 = 256
 L2 = 32
 L3 = 32
 
+# Stockfish quantization: the feature transformer is int16 scaled by 127
+# (activations clipped to [0, 127]), the FC weights int8 scaled by 64 and the
+# FC biases int32 scaled by 64 * 127
+FT_SCALE = 127
+WEIGHT_SCALE_BITS = 6
+WEIGHT_SCALE = 1 << WEIGHT_SCALE_BITS
+BIAS_SCALE = WEIGHT_SCALE * FT_SCALE
+# The output layer is scaled to centipawns (kPonanzaConstant * FV_SCALE)
+OUTPUT_SCALE = 9600
+
 # HalfKP Params
 NUM_SQ = 64
 NUM_PT = 10
 NUM_PLANES = (NUM_SQ * NUM_PT + 1)
 
 
+# Feature sets a .nnue network can be trained with
+FEATURE_SETS = (halfkp.Features, halfka.Features)
+
+
+def _feature_set(feature_hash):
+    for feature_set in FEATURE_SETS:
+        features = feature_set()
+        if features.hash == feature_hash:
+            return features
+    raise ValueError(f"Unknown feature set hash {feature_hash:#x}")
+
+
+def _float_state_dict(network):
+    """Dequantizes the weights of a :class:`NNUEFile` into an
+    :class:`NNUEEmbedding` state dict."""
+    def tensor(array, scale):
+        values = array.astype(numpy.float32)
+        values /= scale
+        return torch.from_numpy(values)
+
+    # The feature transformer is stored [num_features][L1], keep it row major
+    state_dict = {"input.weight": tensor(network.ft_weight, FT_SCALE).t(),
+                  "input.bias": tensor(network.ft_bias, FT_SCALE)}
+    for name in ("l1", "l2"):
+        weight, bias = network.layer(name)
+        state_dict[f"{name}.weight"] = tensor(weight, WEIGHT_SCALE)
+        state_dict[f"{name}.bias"] = tensor(bias, BIAS_SCALE)
+    weight, bias = network.layer("output")
+    state_dict["output.weight"] = tensor(weight, OUTPUT_SCALE / FT_SCALE)
+    state_dict["output.bias"] = tensor(bias, OUTPUT_SCALE)
+    return state_dict
+
+
 class NNUEEmbedding(nn.Module):
-    def __init__(self, checkpoint):
+    def __init__(self, checkpoint, features=None):
         super().__init__()
 
         # Stockfish trains its neural nets with HalfKP representation
         # which has 41024 features
-        num_features = NUM_PLANES * NUM_SQ
-        self.input = nn.Linear(num_features, L1)
-        self.l1 = nn.Linear(2 * L1, L2)
-        self.l2 = nn.Linear(L2, L3)
-        self.output = nn.Linear(L3, 1)
+        self.features = halfkp.Features() if features is None else features
+        num_features = self.features.num_real_features
+        # The layers take the checkpoint tensors as they are rather than
+        # being initialized and then overwritten
+        self.input = nn.Linear(num_features, L1, device="meta")
+        self.l1 = nn.Linear(2 * L1, L2, device="meta")
+        self.l2 = nn.Linear(L2, L3, device="meta")
+        self.output = nn.Linear(L3, 1, device="meta")
 
-        self.load_state_dict(torch.load(checkpoint))
+        state_dict = checkpoint if isinstance(checkpoint, dict) else torch.load(checkpoint)
+        self.load_state_dict(state_dict, assign=True)
         self.eval()
 
         # We only want the board encoding
         del self.output
 
+        # Store the feature transformer row major ([num_features][L1]) so that
+        # a feature's weights are contiguous for the sparse path, the dense
+        # path uses the transposed view at no extra cost
+        rows = self.input.weight.data.t().contiguous()
+        self.input.weight.data = rows.t()
+
+    @classmethod
+    def from_nnue(cls, path, features=None, cache_dir=None):
+        """Loads a Stockfish .nnue network, checking its hashes against
+        ``features`` (deduced from the file when not given, HalfKP and HalfKA
+        are supported).
+
+        The dequantized weights are cached as a checkpoint in ``cache_dir``
+        (next to the .nnue file by default, ``False`` disables the cache) so
+        later loads skip the conversion.
+        """
+        # Mapping the file only reads its header, it is always validated
+        path = pathlib.Path(path)
+        network = NNUEFile(path, L1, L2, L3)
+        if features is None:
+            features = _feature_set(network.feature_hash)
+        network.validate(features.hash)
+        if network.num_features != features.num_real_features:
+            raise ValueError(f"{path} has {network.num_features} features, "
+                             f"{features.name} has {features.num_real_features}")
+
+        cache = None
+        if cache_dir is not False:
+            stat = path.stat()
+            cache = pathlib.Path(cache_dir or path.parent) / f"{path.name}.{stat.st_size}-{stat.st_mtime_ns}.pt"
+            if cache.exists():
+                return cls(torch.load(cache, mmap=True), features)
+
+        state_dict = _float_state_dict(network)
+        if cache is not None:
+            tmp = cache.with_name(f"{cache.name}.{os.getpid()}.tmp")
+            try:
+                cache.parent.mkdir(parents=True, exist_ok=True)
+                torch.save(state_dict, tmp)
+                tmp.replace(cache)
+            except OSError:
+                # The cache is an optimization, read only locations are fine
+                tmp.unlink(missing_ok=True)
+        return cls(state_dict, features)
+
     def forward(self, current, other):
         w = self.input(current)
         b = self.input(other)
+        return self._forward_l0(w, b)
+
+    def forward_sparse(self, current_indices, current_offsets, other_indices, other_offsets):
+        """Same as :meth:`forward` but takes the active feature indices of
+        each side as flattened indices and bag offsets (see
+        :func:`chessmate.features.board.pack_indices`). The feature transformer
+        is then a sum of the weight rows of the active features."""
+        w = self._transform_sparse(current_indices, current_offsets)
+        b = self._transform_sparse(other_indices, other_offsets)
+        return self._forward_l0(w, b)
+
+    def embed_boards(self, boards):
+        """Embeds many boards (or FENs) in a single sparse batch."""
+        current, other, offsets = board_features.batch_indices(boards, self.features)
+        with torch.no_grad():
+            return self.forward_sparse(current, offsets, other, offsets)
+
+    def accumulator(self, board=None, features=None):
+        """Returns an :class:`Accumulator` starting at ``board`` (the initial
+        position by default)."""
+        return Accumulator(self, board, features)
+
+    def embed_game(self, moves, board=None, features=None):
+        """Embeds every position of a game, from ``board`` (the initial
+        position by default) through each of ``moves``. Returns a
+        ``len(moves) + 1`` rows tensor."""
+        accumulator = self.accumulator(board, features)
+        values, turns = [accumulator.value()], [accumulator.board.turn]
+        for move in moves:
+            accumulator.push(move)
+            values.append(accumulator.value())
+            turns.append(accumulator.board.turn)
+        return self._forward_accumulators(torch.stack(values), turns)
+
+    def _forward_accumulators(self, values, turns):
+        # values are [N][2][L1] white and black perspectives, reorder them
+        # as current and other player
+        turns = torch.as_tensor(turns, dtype=torch.bool)
+        w = torch.where(turns[:, None], values[:, 0], values[:, 1])
+        b = torch.where(turns[:, None], values[:, 1], values[:, 0])
+        return self._forward_l0(w, b)
+
+    def _transform_sparse(self, indices, offsets):
+        indices = torch.as_tensor(indices)
+        offsets = torch.as_tensor(offsets, dtype=indices.dtype)
+        rows = self.input.weight.t()
+        return F.embedding_bag(indices, rows, offsets, mode="sum") + self.input.bias
+
+    def _forward_l0(self, w, b):
         l0_ = torch.cat([w, b], dim=1)
         # clamp here is used as a clipped relu to (0.0, 1.0)
         l0_ = torch.clamp(l0_, 0.0, 1.0)
         l1_ = torch.clamp(self.l1(l0_), 0.0, 1.0)
         l2_ = torch.clamp(self.l2(l1_), 0.0, 1.0)
         return l2_
+
+
+class Accumulator:
+    """Feature transformer output of both perspectives, updated incrementally
+    as moves are pushed and popped instead of being recomputed for every
+    position. A perspective whose king moves is refreshed from scratch."""
+    def __init__(self, embedding, board=None, features=None):
+        self.embedding = embedding
+        self.features = embedding.features if features is None else features
+        if self.features.num_real_features != embedding.input.in_features:
+            raise ValueError(f"{self.features.name} features do not match the embedding input size")
+
+        self.board = chess.Board() if board is None else board.copy()
+        self._rows = embedding.input.weight.detach().t()
+        self._bias = embedding.input.bias.detach()
+        white, black = self.features.get_active_indices(self.board)
+        self._stack = [torch.stack([self._refresh(white), self._refresh(black)])]
+
+    def _refresh(self, indices):
+        return self._rows[torch.from_numpy(indices).long()].sum(dim=0) + self._bias
+
+    def value(self):
+        """Returns the [2][L1] white and black perspective accumulators."""
+        return self._stack[-1]
+
+    def push(self, move):
+        """Plays ``move`` and updates the accumulators. Returns the
+        ``(added, removed)`` indices of each perspective, ``None`` for
+        perspectives that were refreshed."""
+        delta = self.features.get_feature_delta(self.board, move)
+        self.board.push(move)
+
+        value = self._stack[-1].clone()
+        refreshed = None
+        for i, side in enumerate(delta):
+            if side is None:
+                if refreshed is None:
+                    refreshed = self.features.get_active_indices(self.board)
+                value[i] = self._refresh(refreshed[i])
+                continue
+            added, removed = side
+            value[i] += self._rows[torch.from_numpy(added).long()].sum(dim=0)
+            value[i] -= self._rows[torch.from_numpy(removed).long()].sum(dim=0)
+
+        self._stack.append(value)
+        return delta
+
+    def pop(self):
+        """Takes back the last move and restores the previous accumulators."""
+        if len(self._stack) == 1:
+            raise IndexError("pop from an empty move stack")
+        self._stack.pop()
+        return self.board.pop()
+
+    def embed(self):
+        """Returns the embedding of the current position, same as
+        :meth:`NNUEEmbedding.forward` on a batch of this single board."""
+        return self.embedding._forward_accumulators(self.value()[None], [self.board.turn])
+
+
+def _quantize(tensor, scale, dtype):
+    info = numpy.iinfo(dtype)
+    values = numpy.rint(tensor.detach().numpy() * scale)
+    return numpy.clip(values, info.min, info.max).astype(dtype)
+
+
+# Below this many active features marking the rows used costs more than
+# reading some of them twice
+_GATHER_ALL = 256
+
+
+class QuantizedNNUEEmbedding:
+    """Integer inference counterpart of :class:`NNUEEmbedding`, computed the
+    way Stockfish does: int16 feature transformer accumulators, clipped ReLU
+    activations in [0, 127] and int8 FC layers whose int32 outputs are scaled
+    back by 64.
+
+    This is the low memory path: the feature transformer takes half the
+    memory of the float one and, loaded with :meth:`from_nnue_file`, is
+    shared between processes. It is not faster than the float embedding,
+    its throughput is about the same on single positions and somewhat lower
+    on batches (see ``benchmarks/bench_quantized_nnue.py``). Outputs are
+    rescaled to [0, 1] so they can be compared with
+    :meth:`NNUEEmbedding.forward_sparse`.
+    """
+    def __init__(self, ft_weight, ft_bias, l1_weight, l1_bias, l2_weight, l2_bias):
+        # ft_weight is [num_features][L1], FC weights are [out][in]
+        self.ft_weight = ft_weight
+        self.ft_bias = ft_bias
+        self.l1_weight = l1_weight
+        self.l1_bias = l1_bias
+        self.l2_weight = l2_weight
+        self.l2_bias = l2_bias
+        # Activations, weights and biases are small integers whose sums of
+        # products stay below 2 ** 24, so float32 BLAS computes the FC layers
+        # exactly. The float32 [in][out] copies are made once, they are small
+        self._l1_weight_t = numpy.ascontiguousarray(numpy.asarray(l1_weight).T, dtype=numpy.float32)
+        self._l1_bias = numpy.asarray(l1_bias, dtype=numpy.float32)
+        self._l2_weight_t = numpy.ascontiguousarray(numpy.asarray(l2_weight).T, dtype=numpy.float32)
+        self._l2_bias = numpy.asarray(l2_bias, dtype=numpy.float32)
+
+    @classmethod
+    def from_embedding(cls, embedding):
+        """Quantizes the float weights of an :class:`NNUEEmbedding`."""
+        return cls(
+            _quantize(embedding.input.weight.t(), FT_SCALE, numpy.int16),
+            _quantize(embedding.input.bias, FT_SCALE, numpy.int16),
+            _quantize(embedding.l1.weight, WEIGHT_SCALE, numpy.int8),
+            _quantize(embedding.l1.bias, BIAS_SCALE, numpy.int32),
+            _quantize(embedding.l2.weight, WEIGHT_SCALE, numpy.int8),
+            _quantize(embedding.l2.bias, BIAS_SCALE, numpy.int32),
+        )
+
+    @classmethod
+    def from_nnue_file(cls, nnue_file):
+        """Runs on the weights of a :class:`chessmate.features.nnue_file.NNUEFile`
+        (or the path of a .nnue file) without copying its feature transformer,
+        which stays memory mapped and shared between processes."""
+        if not isinstance(nnue_file, NNUEFile):
+            nnue_file = NNUEFile(nnue_file, L1, L2, L3)
+        embedding = cls(nnue_file.ft_weight, nnue_file.ft_bias, *nnue_file.layer("l1"), *nnue_file.layer("l2"))
+        embedding._source = nnue_file
+        return embedding
+
+    def __reduce__(self):
+        # Memory mapped weights are mapped again rather than pickled
+        source = getattr(self, "_source", None)
+        if source is not None:
+            return type(self).from_nnue_file, (source,)
+        return super().__reduce__()
+
+    def transform(self, indices, offsets):
+        """Returns the int16 accumulators of the bags of active features."""
+        indices = numpy.asarray(indices, dtype=numpy.int64)
+        offsets = numpy.asarray(offsets, dtype=numpy.int64)
+        # Only the rows of the features active in the batch are read and
+        # converted to float32, where embedding_bag sums them. Sums of less
+        # than 512 int16 rows stay below 2 ** 24 and are exact in float32
+        if len(indices) <= _GATHER_ALL:
+            rows, bag_indices = indices, numpy.arange(len(indices))
+        else:
+            # Rows of features active in several bags are read once
+            used = numpy.zeros(len(self.ft_weight), dtype=bool)
+            used[indices] = True
+            rows = numpy.flatnonzero(used)
+            # Only the entries of the rows used are ever read
+            remap = numpy.empty(len(self.ft_weight), dtype=numpy.int64)
+            remap[rows] = numpy.arange(len(rows))
+            bag_indices = remap[indices]
+        weight = torch.from_numpy(self.ft_weight[rows].astype(numpy.float32))
+        acc = F.embedding_bag(torch.from_numpy(bag_indices), weight, torch.from_numpy(offsets), mode="sum")
+        acc = acc.numpy().astype(numpy.int32) + self.ft_bias
+        return acc.astype(numpy.int16)
+
+    @staticmethod
+    def _fc(x, weight_t, bias):
+        out = x @ weight_t
+        out += bias
+        # Flooring the exact division by a power of 2 is the arithmetic shift
+        out *= 1 / WEIGHT_SCALE
+        numpy.floor(out, out=out)
+        return numpy.clip(out, 0, FT_SCALE, out=out)
+
+    def forward_accumulators(self, current, other):
+        l0_ = numpy.concatenate([current, other], axis=1, dtype=numpy.float32)
+        numpy.clip(l0_, 0, FT_SCALE, out=l0_)
+        l1_ = self._fc(l0_, self._l1_weight_t, self._l1_bias)
+        l2_ = self._fc(l1_, self._l2_weight_t, self._l2_bias)
+        return torch.from_numpy(l2_ / FT_SCALE)
+
+    def forward_sparse(self, current_indices, current_offsets, other_indices, other_offsets):
+        """Same as :meth:`NNUEEmbedding.forward_sparse` with integer math."""
+        # Both sides are transformed as one batch of bags
+        current_indices = numpy.asarray(current_indices)
+        indices = numpy.concatenate([current_indices, numpy.asarray(other_indices)])
+        offsets = numpy.concatenate([current_offsets, numpy.asarray(other_offsets) + len(current_indices)])
+        current, other = numpy.split(self.transform(indices, offsets), 2)
+        return self.forward_accumulators(current, other)
+
+    __call__ = forward_sparse
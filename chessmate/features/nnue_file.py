@@ -0,0 +1,110 @@
+import numpy
+
+
+# Version of the Stockfish .nnue format written by nnue-pytorch
+VERSION = 0x7AF32F16
+
+
+def fc_hash(l1=256, l2=32, l3=32) -> int:
+    """Hash of the ``l1x2-l2-l3-1`` FC layers as computed by nnue-pytorch and
+    Stockfish."""
+    prev_hash = 0xEC42E90D ^ (2 * l1)
+    for out in (l2, l3, 1):
+        layer_hash = 0xCC03DAE4 + out
+        layer_hash ^= prev_hash >> 1
+        layer_hash ^= (prev_hash << 31) & 0xFFFFFFFF
+        if out != 1:
+            # Clipped ReLU hash
+            layer_hash = (layer_hash + 0x538D24C7) & 0xFFFFFFFF
+        prev_hash = layer_hash
+    return prev_hash
+
+
+def _padded(size):
+    # FC layer inputs are padded to 32 elements for SIMD
+    return (size + 31) // 32 * 32
+
+
+class NNUEFile:
+    """Stockfish .nnue network memory mapped read only.
+
+    The feature transformer blocks are zero-copy views into the file at their
+    parsed offsets, in the quantized layout Stockfish uses: ``ft_bias`` is
+    int16 ``[l1]`` and ``ft_weight`` int16 ``[num_features][l1]``. Processes
+    mapping the same file share a single page cache copy of it, and pickling
+    only sends the path, so DataLoader workers map the file again instead of
+    receiving a copy. The small FC layers are read by :meth:`layer` on
+    demand.
+
+    The number of features is deduced from the file size, so HalfKP and
+    HalfKA networks of the given layer sizes are both handled.
+    """
+    def __init__(self, path, l1=256, l2=32, l3=32):
+        self.path = str(path)
+        self.sizes = (l1, l2, l3)
+        self._map = numpy.memmap(self.path, dtype=numpy.uint8, mode="r")
+
+        version, self.hash, description_len = self._view(0, "<u4", (3,)).tolist()
+        if version != VERSION:
+            raise ValueError(f"Unsupported .nnue version {version:#x} in {self.path}")
+        offset = 12
+        self.description = bytes(self._map[offset:offset + description_len]).decode("utf-8", "replace")
+        offset += description_len
+
+        (self.ft_hash,) = self._view(offset, "<u4", (1,)).tolist()
+        offset += 4
+        self.ft_bias = self._view(offset, "<i2", (l1,))
+        offset += self.ft_bias.nbytes
+
+        # (name, out, in) of the FC layers, stored as int32 biases followed by
+        # int8 [out][padded in] weights
+        shapes = [("l1", l2, 2 * l1), ("l2", l3, l2), ("output", 1, l3)]
+        fc_bytes = 4 + sum(4 * out + out * _padded(inputs) for _, out, inputs in shapes)
+        ft_bytes = len(self._map) - offset - fc_bytes
+        if ft_bytes <= 0 or ft_bytes % (2 * l1):
+            raise ValueError(f"{self.path} does not hold a {l1}x2-{l2}-{l3}-1 network")
+        self.num_features = ft_bytes // (2 * l1)
+        self.ft_weight = self._view(offset, "<i2", (self.num_features, l1))
+        offset += ft_bytes
+
+        (self.fc_hash,) = self._view(offset, "<u4", (1,)).tolist()
+        offset += 4
+        self._layers = {}
+        for name, out, inputs in shapes:
+            self._layers[name] = (offset, out, inputs)
+            offset += 4 * out + out * _padded(inputs)
+        self._materialized = {}
+
+    def _view(self, offset, dtype, shape):
+        return numpy.ndarray(shape, dtype=dtype, buffer=self._map, offset=offset)
+
+    @property
+    def feature_hash(self) -> int:
+        """Hash of the feature set the network was trained with."""
+        return self.ft_hash ^ (2 * self.sizes[0])
+
+    def validate(self, feature_hash=None):
+        """Checks the FC layers hash against the layer sizes and the network
+        hash against its parts and, when given, the hash of the expected
+        feature set. Raises a ValueError on mismatch."""
+        expected = fc_hash(*self.sizes)
+        if self.fc_hash != expected:
+            raise ValueError(f"{self.path} FC layers hash is {self.fc_hash:#x}, expected {expected:#x}")
+        if self.hash != self.fc_hash ^ self.ft_hash:
+            raise ValueError(f"{self.path} network hash {self.hash:#x} does not match its layers")
+        if feature_hash is not None and self.feature_hash != feature_hash:
+            raise ValueError(f"{self.path} feature set hash is {self.feature_hash:#x}, expected {feature_hash:#x}")
+
+    def layer(self, name):
+        """Returns the ``(weight, bias)`` of the ``"l1"``, ``"l2"`` or
+        ``"output"`` FC layer as int8 ``[out][in]`` and int32 ``[out]`` arrays
+        (copied out of the file, without the padding)."""
+        if name not in self._materialized:
+            offset, out, inputs = self._layers[name]
+            bias = self._view(offset, "<i4", (out,))
+            weight = self._view(offset + bias.nbytes, numpy.int8, (out, _padded(inputs)))
+            self._materialized[name] = (weight[:, :inputs].copy(), bias.astype(numpy.int32))
+        return self._materialized[name]
+
+    def __reduce__(self):
+        return type(self), (self.path, *self.sizes)
@@ -1,8 +1,79 @@
+import chess
+import numpy
 from collections import OrderedDict
 
 def _get_main_factor_name(full_name):
     return full_name.replace('^', '')
 
+'''
+Returns the (square, piece) pairs that a move removes from and adds to the
+board, including castling rooks, en passant captures and promotions.
+The board is left as it was.
+'''
+def piece_changes(board: chess.Board, move: chess.Move):
+    def masks():
+        return [board.pieces_mask(pt, c) for c in chess.COLORS for pt in chess.PIECE_TYPES]
+    before = masks()
+    board.push(move)
+    try:
+        after = masks()
+    finally:
+        board.pop()
+
+    removed, added = [], []
+    pieces = [chess.Piece(pt, c) for c in chess.COLORS for pt in chess.PIECE_TYPES]
+    for p, b, a in zip(pieces, before, after):
+        removed.extend((sq, p) for sq in chess.scan_forward(b & ~a))
+        added.extend((sq, p) for sq in chess.scan_forward(a & ~b))
+    return removed, added
+
+'''
+Unpacks the piece bitboards of many boards (or FENs) at once. Returns a
+[N][2][6][64] boolean array indexed by board, color (white first), piece
+type - 1 and square, along with the [N] side to move of each board.
+'''
+def piece_bits(boards):
+    if len(boards) and all(isinstance(b, str) for b in boards):
+        return _fen_piece_bits(boards)
+
+    masks = numpy.empty((len(boards), 8), dtype=numpy.uint64)
+    turns = numpy.empty(len(boards), dtype=bool)
+    for i, board in enumerate(boards):
+        if isinstance(board, str):
+            board = chess.Board(board)
+        turns[i] = board.turn
+        masks[i] = (board.pawns, board.knights, board.bishops, board.rooks, board.queens, board.kings,
+                    board.occupied_co[chess.WHITE], board.occupied_co[chess.BLACK])
+    pieces = masks[:, None, :6] & masks[:, 6:, None]
+    bits = numpy.unpackbits(pieces.astype('<u8').view(numpy.uint8), axis=-1, bitorder='little')
+    return bits.reshape(len(boards), 2, 6, 64).astype(bool), turns
+
+_FEN_EXPAND = str.maketrans({str(i): '.' * i for i in range(1, 9)})
+_FEN_PIECES = numpy.frombuffer(b'PNBRQKpnbrqk', dtype=numpy.uint8).reshape(2, 6)
+_FEN_SQUARES = numpy.frombuffer(b'.PNBRQKpnbrqk', dtype=numpy.uint8)
+
+def _fen_piece_bits(fens):
+    # Expanding the empty squares makes each placement, with a '/' appended,
+    # 8 ranks of 8 squares and a '/', rank 8 first, which NumPy can compare
+    # against the piece symbols
+    fields = [f.split(' ', 2) for f in fens]
+    placement = ''.join(f[0].translate(_FEN_EXPAND) + '/' for f in fields).encode('ascii')
+    if len(placement) != 72 * len(fens):
+        raise ValueError('Invalid FEN board placement')
+    ranks = numpy.frombuffer(placement, dtype=numpy.uint8).reshape(len(fens), 8, 9)
+    if (ranks[:, :, 8] != ord('/')).any():
+        raise ValueError('Invalid FEN board placement, each rank needs 8 squares')
+    squares = ranks[:, ::-1, :8].reshape(len(fens), 1, 1, 64)
+    if not numpy.isin(squares, _FEN_SQUARES).all():
+        raise ValueError('Invalid FEN piece')
+    bits = squares == _FEN_PIECES[None, :, :, None]
+    if (bits[:, :, chess.KING - 1].sum(axis=-1) != 1).any():
+        raise ValueError('Invalid FEN, each side needs one king')
+    if any(len(f) >= 2 and f[1] not in ('w', 'b') for f in fields):
+        raise ValueError('Invalid FEN side to move')
+    turns = numpy.array([len(f) < 2 or f[1] == 'w' for f in fields], dtype=bool)
+    return bits, turns
+
 class FeatureBlock:
     '''
     This is the base class for all the network input features.
@@ -1,5 +1,5 @@
 import chess
-import torch
+import numpy
 from . import feature_block           # Changed to relative import
 from collections import OrderedDict
 from .feature_block import *          # Changed to relative import
@@ -20,14 +20,67 @@ class Features(FeatureBlock):
     super(Features, self).__init__('HalfKP', 0x5d69d5b8, OrderedDict([('HalfKP', NUM_PLANES * NUM_SQ)]))
 
   def get_active_features(self, board: chess.Board):
-    def piece_features(turn):
+    import torch   # Deferred, the sparse features do not need torch
+    def piece_features(active):
       indices = torch.zeros(NUM_PLANES * NUM_SQ)
-      for sq, p in board.piece_map().items():
-        if p.piece_type == chess.KING:
-          continue
-        indices[halfkp_idx(turn, orient(turn, board.king(turn)), sq, p)] = 1.0
+      indices[torch.from_numpy(active).long()] = 1.0
+      return indices
+    white, black = self.get_active_indices(board)
+    return (piece_features(white), piece_features(black))
+
+  '''
+  Sparse counterpart of get_active_features, returns only the indices of the
+  active features of each side as int32 arrays. Every active feature has
+  value 1, so with_values only pairs each array with a vector of ones.
+  '''
+  def get_active_indices(self, board: chess.Board, with_values=False):
+    pieces = [(sq, p) for sq, p in board.piece_map().items() if p.piece_type != chess.KING]
+    def piece_indices(turn):
+      king_sq = orient(turn, board.king(turn))
+      indices = numpy.fromiter((halfkp_idx(turn, king_sq, sq, p) for sq, p in pieces),
+                               dtype=numpy.int32, count=len(pieces))
+      if with_values:
+        return indices, numpy.ones(len(indices), dtype=numpy.float32)
       return indices
-    return (piece_features(chess.WHITE), piece_features(chess.BLACK))
+    return (piece_indices(chess.WHITE), piece_indices(chess.BLACK))
+
+  '''
+  Batched get_active_indices over many boards (or FENs), computed with
+  NumPy over the piece bitboards. Returns the white and black indices of
+  all boards concatenated, along with the offset of each board in them and
+  whether white is to move in each board.
+  '''
+  def get_active_indices_batch(self, boards):
+    bits, turns = feature_block.piece_bits(boards)
+    kings = bits[:, :, chess.KING - 1].argmax(axis=-1)
+    n, color, piece_type, sq = numpy.nonzero(bits[:, :, :5])
+    counts = numpy.bincount(n, minlength=len(bits))
+    offsets = numpy.zeros(len(bits), dtype=numpy.int32)
+    numpy.cumsum(counts[:-1], out=offsets[1:])
+    def piece_indices(turn):
+      flip = 63 * (not turn)
+      king_sq = kings[n, int(not turn)] ^ flip
+      p_idx = piece_type * 2 + (color != int(not turn))
+      return (1 + (sq ^ flip) + p_idx * NUM_SQ + king_sq * NUM_PLANES).astype(numpy.int32)
+    return piece_indices(chess.WHITE), piece_indices(chess.BLACK), offsets, turns
+
+  '''
+  Returns the features changed by playing move on board as an
+  (added, removed) pair of index arrays for each side. A side whose king
+  moves gets None instead, its features must be computed from scratch.
+  '''
+  def get_feature_delta(self, board: chess.Board, move: chess.Move):
+    removed, added = feature_block.piece_changes(board, move)
+    king_move = board.piece_type_at(move.from_square) == chess.KING
+    def side_delta(turn):
+      if king_move and board.turn == turn:
+        return None
+      king_sq = orient(turn, board.king(turn))
+      def indices(changes):
+        return numpy.array([halfkp_idx(turn, king_sq, sq, p) for sq, p in changes if p.piece_type != chess.KING],
+                           dtype=numpy.int32)
+      return indices(added), indices(removed)
+    return (side_delta(chess.WHITE), side_delta(chess.BLACK))
 
 class FactorizedFeatures(FeatureBlock):
   def __init__(self):
@@ -35,6 +88,7 @@ class FactorizedFeatures(FeatureBlock):
     self.base = Features()
 
   def get_active_features(self, board: chess.Board):
+    import torch   # Deferred, the sparse features do not need torch
     white, black = self.base.get_active_features(board)
     def piece_features(base, color):
       indices = torch.zeros(NUM_SQ * 11)
@@ -51,6 +105,27 @@ class FactorizedFeatures(FeatureBlock):
       return torch.cat((base, indices))
     return (piece_features(white, chess.WHITE), piece_features(black, chess.BLACK))
 
+  '''
+  Sparse counterpart of get_active_features. The HalfK factor is weighted by
+  the piece count, so the indices are always returned with their values.
+  '''
+  def get_active_indices(self, board: chess.Board, with_values=True):
+    if not with_values:
+      raise ValueError('HalfKP^ features are weighted, use with_values=True')
+    white, black = self.base.get_active_indices(board)
+    pieces = [(sq, p) for sq, p in board.piece_map().items() if p.piece_type != chess.KING]
+    def piece_indices(base, color):
+      offset = self.get_factor_base_feature('HalfK')
+      factors = [offset + orient(color, board.king(color))]
+      for sq, p in pieces:
+        p_idx = (p.piece_type - 1) * 2 + (p.color != color)
+        factors.append(offset + (p_idx + 1) * NUM_SQ + orient(color, sq))
+      indices = numpy.concatenate((base, numpy.array(factors, dtype=numpy.int32)))
+      values = numpy.ones(len(indices), dtype=numpy.float32)
+      values[len(base)] = len(pieces)
+      return indices, values
+    return (piece_indices(white, chess.WHITE), piece_indices(black, chess.BLACK))
+
   def get_feature_factors(self, idx):
     if idx >= self.num_real_features:
       raise Exception('Feature must be real')
@@ -1,16 +1,15 @@
 import argparse
-import features
 import math
-import model as M
 import numpy
-import nnue_bin_dataset
 import struct
 import torch
-import pytorch_lightning as pl
-from torch.utils.data import DataLoader
+from torch import nn
 from functools import reduce
 import operator
 
+from ..features import nnue as M
+from ..features.nnue_file import VERSION, fc_hash
+
 def ascii_hist(name, x, bins=6):
   N,X = numpy.histogram(x, bins=bins)
   total = 1.0*len(x)
@@ -23,28 +22,36 @@ def ascii_hist(name, x, bins=6):
     xi = '{0: <8.4g}'.format(xi).ljust(10)
     print('{0}| {1}'.format(xi,bar))
 
-# hardcoded for now
-VERSION = 0x7AF32F16
+FEATURE_SETS = {f().name: f for f in M.FEATURE_SETS}
 
+def get_feature_set_from_name(name):
+  if name not in FEATURE_SETS:
+    raise Exception('No feature set with name ' + name)
+  return FEATURE_SETS[name]()
 
 class NNUEReader():
   def __init__(self, f, feature_set):
     self.f = f
     self.feature_set = feature_set
-    self.model = M.NNUE(feature_set)
-    fc_hash = NNUEWriter.fc_hash(self.model)
-
-    self.read_header(feature_set, fc_hash)
+    self.model = nn.ModuleDict({
+      'input': nn.Linear(feature_set.num_real_features, M.L1),
+      'l1': nn.Linear(2 * M.L1, M.L2),
+      'l2': nn.Linear(M.L2, M.L3),
+      'output': nn.Linear(M.L3, 1),
+    })
+    layers_hash = fc_hash(M.L1, M.L2, M.L3)
+
+    self.read_header(feature_set, layers_hash)
     self.read_int32(feature_set.hash ^ (M.L1*2)) # Feature transformer hash
-    self.read_feature_transformer(self.model.input)
-    self.read_int32(fc_hash) # FC layers hash
-    self.read_fc_layer(self.model.l1)
-    self.read_fc_layer(self.model.l2)
-    self.read_fc_layer(self.model.output, is_output=True)
+    self.read_feature_transformer(self.model['input'])
+    self.read_int32(layers_hash) # FC layers hash
+    self.read_fc_layer(self.model['l1'])
+    self.read_fc_layer(self.model['l2'])
+    self.read_fc_layer(self.model['output'], is_output=True)
 
-  def read_header(self, feature_set, fc_hash):
+  def read_header(self, feature_set, layers_hash):
     self.read_int32(VERSION) # version
-    self.read_int32(fc_hash ^ feature_set.hash ^ (M.L1*2)) # halfkp network hash
+    self.read_int32(layers_hash ^ feature_set.hash ^ (M.L1*2)) # halfkp network hash
     desc_len = self.read_int32() # Network definition
     description = self.f.read(desc_len)
 
@@ -83,17 +90,17 @@ class NNUEReader():
   def read_int32(self, expected=None):
     v = struct.unpack("<I", self.f.read(4))[0]
     if expected is not None and v != expected:
-      raise Exception("Expected: %x, got %x" % (expected, v))
+      raise ValueError("Expected: %x, got %x" % (expected, v))
     return v
 
 def main():
   parser = argparse.ArgumentParser(description="Converts files between ckpt and nnue format.")
   parser.add_argument("source", help="Source file (can be .ckpt, .pt or .nnue)")
   parser.add_argument("target", help="Target file (can be .pt or .nnue)")
-  features.add_argparse_args(parser)
+  parser.add_argument("--features", default="HalfKP", choices=sorted(FEATURE_SETS), help="The feature set to use")
   args = parser.parse_args()
 
-  feature_set = features.get_feature_set_from_name(args.features)
+  feature_set = get_feature_set_from_name(args.features)
 
   print('Converting %s to %s' % (args.source, args.target))
 
@@ -102,7 +109,8 @@ def main():
       raise Exception("Target file must end with .pt")
     with open(args.source, 'rb') as f:
       reader = NNUEReader(f, feature_set)
-    torch.save(reader.model, args.target)
+    # Loadable with chessmate.features.nnue.NNUEEmbedding(args.target)
+    torch.save(reader.model.state_dict(), args.target)
   else:
     raise Exception('Invalid filetypes: ' + str(args))
 
@@ -1,39 +1,147 @@
-import io
-import zipfile
+import hashlib
+import itertools
+import os
+import pathlib
+import re
+import time
 
-import requests
 
+DATA_ROOT_ENV = "CHESSMATE_DATA_ROOT"
+GOOGLE_DRIVE_URL = "https://docs.google.com/uc?export=download"
+STOCKFISH_NNUE_URL = "https://tests.stockfishchess.org/api/nn/{name}"
 
-def download_nnue_from_stockfish(url: str):
-    pass
+_CHUNK_SIZE = 1 << 20
+# Bytes received by an interrupted read are lost, keep network reads small
+_NETWORK_CHUNK_SIZE = 1 << 16
+_STOCKFISH_NNUE_NAME = re.compile(r"nn-([0-9a-f]{12})\.nnue")
 
 
-def download_file_from_google_drive(id: str) -> io.BytesIO:
-    def get_confirm_token(response):
-        for key, value in response.cookies.items():
-            if key.startswith('download_warning'):
-                return value
+def data_root() -> pathlib.Path:
+    """Returns the directory caching the downloads and the preprocessed
+    datasets, ``$CHESSMATE_DATA_ROOT`` or ``chessmate`` in the user cache
+    directory."""
+    root = os.environ.get(DATA_ROOT_ENV)
+    if root:
+        return pathlib.Path(root).expanduser()
+    cache = os.environ.get("XDG_CACHE_HOME") or pathlib.Path.home() / ".cache"
+    return pathlib.Path(cache) / "chessmate"
 
-        return None
 
-    def save_response_content(response, destination):
-        CHUNK_SIZE = 32768
+def file_sha256(path) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
 
-        for chunk in response.iter_content(CHUNK_SIZE):
-            if chunk:  # filter out keep-alive new chunks
-                destination.write(chunk)
 
-    URL = "https://docs.google.com/uc?export=download"
+def _total_size(response, offset):
+    # Size of the whole file, from the Content-Range of a partial response
+    if response.status_code == 206:
+        total = response.headers.get("Content-Range", "").rpartition("/")[2]
+        return int(total) if total.isdigit() else None
+    length = response.headers.get("Content-Length", "")
+    return offset + int(length) if length.isdigit() else None
 
-    session = requests.Session()
 
-    response = session.get(URL, params={'id': id}, stream=True)
-    token = get_confirm_token(response)
+def _fetch(session, url, params, part: pathlib.Path, timeout) -> bool:
+    """Appends what ``part`` misses of ``url`` to it, returns whether it is
+    complete."""
+    offset = part.stat().st_size if part.exists() else 0
+    # Ranges count bytes of the stored file, not of a compressed transfer
+    headers = {"Accept-Encoding": "identity"}
+    if offset:
+        headers["Range"] = f"bytes={offset}-"
+    with session.get(url, params=params, headers=headers, stream=True, timeout=timeout) as response:
+        if offset and response.status_code == 416:
+            # Nothing left past the end of the part file
+            return True
+        response.raise_for_status()
+        if response.status_code != 206:
+            # The server ignored the range and sends the whole file
+            offset = 0
+        total = _total_size(response, offset)
+        with open(part, "ab" if offset else "wb") as f:
+            for chunk in response.iter_content(_NETWORK_CHUNK_SIZE):
+                f.write(chunk)
+            size = f.tell()
+    return total is None or size >= total
+
+
+def download(url, path, *, sha256=None, params=None, session=None, retries=5, backoff=1.0,
+             timeout=60) -> pathlib.Path:
+    """Downloads ``url`` to ``path`` unless already there, returns ``path``.
+
+    The response is streamed to a ``.part`` file beside ``path`` and only
+    moved to ``path`` once complete, so memory does not grow with the file
+    size. An interrupted download resumes where it stopped with an HTTP Range
+    request, in the up to ``retries`` retries (``backoff`` seconds apart,
+    doubling each time) or in a later call. ``sha256`` is the hex digest (or
+    a prefix of it) the complete file should have, a file that does not
+    match is deleted and ValueError raised.
+    """
+    import requests   # Deferred, only downloads need it
+
+    path = pathlib.Path(path)
+    if path.exists():
+        return path
+    path.parent.mkdir(parents=True, exist_ok=True)
+    part = path.with_name(path.name + ".part")
+    session = requests.Session() if session is None else session
+
+    for attempt in itertools.count():
+        try:
+            if _fetch(session, url, params, part, timeout):
+                break
+            error = OSError(f"Download of {url} ended early")
+        except (requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError) as e:
+            error = e
+        except requests.HTTPError as e:
+            if e.response.status_code < 500:
+                raise
+            error = e
+        if attempt >= retries:
+            raise error
+        time.sleep(backoff * 2 ** attempt)
+
+    if sha256 is not None:
+        digest = file_sha256(part)
+        if not digest.startswith(sha256.lower()):
+            part.unlink()
+            raise ValueError(f"Download of {url} has SHA-256 {digest}, expected {sha256}")
+    part.replace(path)
+    return path
 
-    if token:
-        params = {'id': id, 'confirm': token}
-        response = session.get(URL, params=params, stream=True)
 
-    zipdata = io.BytesIO()
-    save_response_content(response, zipdata)
-    return zipfile.ZipFile(zipdata).open("all_with_filtered_anotations_since1998.txt")
+def download_nnue_from_stockfish(url: str, directory=None) -> pathlib.Path:
+    """Downloads a Stockfish network given its URL or its file name (e.g.
+    ``nn-62ef826d1a6d.nnue``) to ``directory``, ``nnue`` in the data root by
+    default, and returns its path.
+
+    Stockfish names its networks after the start of their SHA-256, which is
+    checked."""
+    name = url.rstrip("/").rpartition("/")[2]
+    if url == name:
+        url = STOCKFISH_NNUE_URL.format(name=name)
+    directory = data_root() / "nnue" if directory is None else pathlib.Path(directory)
+    match = _STOCKFISH_NNUE_NAME.fullmatch(name)
+    return download(url, directory / name, sha256=match and match.group(1))
+
+
+def download_file_from_google_drive(id: str, path, *, sha256=None) -> pathlib.Path:
+    """Downloads the Google Drive file ``id`` to ``path``, see
+    :func:`download`."""
+    import requests   # Deferred, only downloads need it
+
+    path = pathlib.Path(path)
+    if path.exists():
+        return path
+
+    session = requests.Session()
+    params = {"id": id}
+    # Files too large to be scanned for viruses need a confirmation token
+    with session.get(GOOGLE_DRIVE_URL, params=params, stream=True, timeout=60) as response:
+        for key, value in response.cookies.items():
+            if key.startswith("download_warning"):
+                params["confirm"] = value
+    return download(GOOGLE_DRIVE_URL, path, sha256=sha256, params=params, session=session)
@@ -0,0 +1,111 @@
+"""Minimal UCI engine used by the tests in place of Stockfish.
+
+It searches nothing: every iteration reports the material balance from the
+side to move point of view and a principal variation made of the first legal
+moves (captures first), so results are deterministic and cheap.
+"""
+import sys
+import time
+
+import chess
+
+
+VALUES = {chess.PAWN: 100, chess.KNIGHT: 300, chess.BISHOP: 300, chess.ROOK: 500, chess.QUEEN: 900, chess.KING: 0}
+
+OPTIONS = [
+    "option name Threads type spin default 1 min 1 max 512",
+    "option name Hash type spin default 16 min 1 max 33554432",
+    "option name MultiPV type spin default 1 min 1 max 500",
+    "option name EvalFile type string default nn.nnue",
+    "option name Delay type spin default 0 min 0 max 10000",
+]
+
+
+def material(board):
+    score = sum(VALUES[p.piece_type] * (1 if p.color == board.turn else -1)
+                for p in board.piece_map().values())
+    return score
+
+
+def ordered_moves(board):
+    moves = sorted(board.legal_moves, key=lambda m: m.uci())
+    return sorted(moves, key=lambda m: not board.is_capture(m))
+
+
+def line(board, first, length):
+    board = board.copy(stack=False)
+    pv = [first]
+    board.push(first)
+    while len(pv) < length:
+        moves = ordered_moves(board)
+        if not moves:
+            break
+        pv.append(moves[0])
+        board.push(moves[0])
+    return pv
+
+
+def parse_go(tokens):
+    params = {}
+    for key, value in zip(tokens[::2], tokens[1::2]):
+        params[key] = int(value)
+    return params
+
+
+def main():
+    board = chess.Board()
+    options = {"multipv": 1, "delay": 0}
+    nodes_per_depth = 100
+
+    def send(line):
+        sys.stdout.write(line + "\n")
+        sys.stdout.flush()
+
+    for command in sys.stdin:
+        tokens = command.split()
+        if not tokens:
+            continue
+        if tokens[0] == "uci":
+            send("id name FakeEngine")
+            send("id author chessmate")
+            for option in OPTIONS:
+                send(option)
+            send("uciok")
+        elif tokens[0] == "isready":
+            send("readyok")
+        elif tokens[0] == "setoption":
+            name = " ".join(tokens[2:tokens.index("value")]).lower()
+            if name in options:
+                options[name] = int(tokens[tokens.index("value") + 1])
+        elif tokens[0] == "position":
+            if tokens[1] == "startpos":
+                board = chess.Board()
+                rest = tokens[2:]
+            else:
+                board = chess.Board(" ".join(tokens[2:8]))
+                rest = tokens[8:]
+            if rest and rest[0] == "moves":
+                for uci in rest[1:]:
+                    board.push_uci(uci)
+        elif tokens[0] == "go":
+            params = parse_go(tokens[1:])
+            depth = params.get("depth", 5)
+            if "nodes" in params:
+                depth = max(1, min(depth, params["nodes"] // nodes_per_depth))
+            time.sleep(options["delay"] / 1000)
+            moves = ordered_moves(board)
+            for d in range(1, depth + 1):
+                for i, move in enumerate(moves[:options["multipv"]]):
+                    after = board.copy(stack=False)
+                    after.push(move)
+                    score = -material(after)
+                    pv = " ".join(m.uci() for m in line(board, move, d))
+                    send(f"info depth {d} seldepth {d} multipv {i + 1} score cp {score} "
+                         f"nodes {d * nodes_per_depth} nps 1000 time 1 pv {pv}")
+            send(f"bestmove {moves[0].uci() if moves else '(none)'}")
+        elif tokens[0] == "quit":
+            break
+
+
+if __name__ == "__main__":
+    main()
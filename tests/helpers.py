@@ -0,0 +1,57 @@
+"""Helpers shared by the test modules."""
+import io
+import os
+import subprocess
+import sys
+
+import chess
+import torch
+
+from chessmate.features import nnue
+
+
+FENS = [
+    chess.STARTING_FEN,
+    "1r1q1rk1/3nbppp/p1bp4/2p1pN2/P2nP3/2NP3P/1BPQ1PP1/1R2KB1R b K - 6 16",
+    "rn2k3/p2b1p1p/3bp2B/8/1p6/1P1q4/P2P1PNP/R2QR1K1 w q - 0 18",
+]
+
+
+def make_checkpoint(directory, seed=0):
+    generator = torch.Generator().manual_seed(seed)
+    num_features = nnue.NUM_PLANES * nnue.NUM_SQ
+    shapes = {
+        "input": (nnue.L1, num_features),
+        "l1": (nnue.L2, 2 * nnue.L1),
+        "l2": (nnue.L3, nnue.L2),
+        "output": (1, nnue.L3),
+    }
+    state_dict = {}
+    for name, shape in shapes.items():
+        state_dict[f"{name}.weight"] = (torch.rand(shape, generator=generator) - 0.5) * 0.1
+        state_dict[f"{name}.bias"] = torch.rand(shape[0], generator=generator) * 0.5
+    path = os.path.join(directory, "nnue.pt")
+    torch.save(state_dict, path)
+    return path
+
+
+HEADER = "\n".join(f"# header line {i}" for i in range(5))
+LINES = [
+    "1 2000.03.14 1-0 2851 None 5 date_false result_false welo_false belo_true edate_true setup_false fen_false result2_false oyrange_false blen_false ### W1.e4 B1.e5 W2.Nf3 B2.Nc6 W3.Bb5 ",
+    "2 2000.03.15 0-1 2400 2500 4 date_false result_false welo_false belo_false edate_true setup_false fen_false result2_false oyrange_false blen_false ### W1.d4 B1.d5 W2.c4 B2.e6 ",
+    "3 2000.03.16 1/2-1/2 2600 2650 2 date_false result_true welo_false belo_false edate_true setup_false fen_false result2_false oyrange_false blen_false ### W1.e4 B1.c5 ",
+    "4 2000.03.17 1-0 2300 2200 2 date_false result_false welo_false belo_false edate_true setup_true fen_false result2_false oyrange_false blen_false ### W1.e4 B1.c5 ",
+    "5 1999.??.?? 1/2-1/2 2300 2200 2 date_true result_false welo_false belo_false edate_true setup_false fen_false result2_false oyrange_false blen_false ### W1.Nf3 B1.Nf6 ",
+]
+
+
+def make_content(lines=LINES):
+    return io.BytesIO((HEADER + "\n" + "\n".join(lines) + "\n").encode())
+
+
+def heavy_imports(module, heavy=("torch", "pandas", "requests")):
+    """Returns the heavy dependencies imported along with ``module`` by a new
+    interpreter."""
+    code = f"import sys, {module}; print(' '.join(m for m in {heavy!r} if m in sys.modules))"
+    output = subprocess.run([sys.executable, "-c", code], check=True, capture_output=True, text=True).stdout
+    return output.split()
@@ -0,0 +1,219 @@
+import os
+import pathlib
+import tempfile
+import unittest
+import zipfile
+from unittest import mock
+
+import chess
+import numpy
+import pandas
+import torch
+from torch.utils.data import DataLoader
+
+from chessmate.data import dataset
+
+from helpers import LINES, heavy_imports, make_content
+
+
+class TestPreprocess3500kSan(unittest.TestCase):
+    def test_preprocess(self):
+        df = dataset._preprocess_3500k_san(make_content())
+        self.assertEqual(list(df.columns),
+                         ["id", "date", "white_rating", "black_rating", "len", "moves", "winner"])
+        self.assertEqual(list(df["id"]), [1, 2, 3, 5])
+        self.assertEqual(df["moves"][0], "e4 e5 Nf3 Nc6 Bb5")
+        self.assertTrue(numpy.isnan(df["black_rating"][0]))
+        self.assertEqual(df["white_rating"][1], 2400)
+        self.assertEqual(df["date"][1], pandas.Timestamp("2000-03-15"))
+        self.assertTrue(pandas.isna(df["date"][3]))
+        self.assertEqual(list(df["winner"][:2]), ["W", "B"])
+        self.assertTrue(pandas.isna(df["winner"][2]))
+        self.assertEqual(df["winner"][3], "D")
+
+    def test_malformed_games_are_dropped(self):
+        lines = LINES + [LINES[0].replace("1 ", "x ", 1), LINES[1].replace(" 4 ", " ? ", 1)]
+        df = dataset._preprocess_3500k_san(make_content(lines))
+        self.assertEqual(list(df["id"]), [1, 2, 3, 5])
+        self.assertEqual(df["id"].dtype, numpy.int64)
+        self.assertEqual(df["len"].dtype, numpy.int64)
+
+    def test_chunks_match_whole(self):
+        expected = dataset._preprocess_3500k_san(make_content())
+        chunks = list(dataset._iter_3500k_san(make_content(), chunksize=2))
+        self.assertEqual(len(chunks), 3)
+        pandas.testing.assert_frame_equal(pandas.concat(chunks, ignore_index=True), expected)
+
+    def test_write_feather(self):
+        expected = dataset._preprocess_3500k_san(make_content())
+        with tempfile.TemporaryDirectory() as directory:
+            path = pathlib.Path(directory) / "games.feather"
+            dataset._write_3500k_san(dataset._iter_3500k_san(make_content(), chunksize=2), path)
+            result = pandas.read_feather(path)
+        pandas.testing.assert_frame_equal(result, expected)
+
+    def test_parallel_matches_serial(self):
+        lines = LINES * 50
+        expected = dataset._preprocess_3500k_san(make_content(lines))
+        with tempfile.TemporaryDirectory() as directory:
+            raw = pathlib.Path(directory) / "games.txt"
+            raw.write_bytes(make_content(lines).getvalue())
+            ranges = dataset._3500k_san_ranges(raw, chunk_bytes=1000)
+            self.assertGreater(len(ranges), 2)
+            path = pathlib.Path(directory) / "games.feather"
+            dataset._write_3500k_san(dataset._iter_3500k_san_parallel(raw, 2, chunk_bytes=1000), path)
+            result = pandas.read_feather(path)
+        pandas.testing.assert_frame_equal(result, expected)
+
+    def test_load_from_data_root(self):
+        expected = dataset._preprocess_3500k_san(make_content())
+        with tempfile.TemporaryDirectory() as directory, \
+                mock.patch.dict(os.environ, {"CHESSMATE_DATA_ROOT": directory}):
+            # A cached archive is not downloaded again
+            with zipfile.ZipFile(pathlib.Path(directory) / "3500k_san.zip", "w") as archive:
+                archive.writestr("all_with_filtered_anotations_since1998.txt", make_content().getvalue())
+            pandas.testing.assert_frame_equal(dataset.load_3500k_san(), expected)
+            self.assertTrue((pathlib.Path(directory) / "3500k_san.feather").exists())
+            with mock.patch.object(dataset, "_fetch_3500k_san") as fetch:
+                pandas.testing.assert_frame_equal(dataset.load_3500k_san(), expected)
+                # The encoded table is built from the cached plain one
+                encoded = dataset.load_3500k_san(encode=True)
+            fetch.assert_not_called()
+            pandas.testing.assert_frame_equal(encoded, dataset.encode_games(expected))
+            self.assertTrue((pathlib.Path(directory) / "3500k_san_encoded.feather").exists())
+
+    def test_encode_option(self):
+        expected = dataset.encode_games(dataset._preprocess_3500k_san(make_content()))
+        pandas.testing.assert_frame_equal(dataset._preprocess_3500k_san(make_content(), encode=True), expected)
+        with tempfile.TemporaryDirectory() as directory:
+            path = pathlib.Path(directory) / "games.feather"
+            dataset._write_3500k_san(dataset._iter_3500k_san(make_content(), chunksize=2, encode=True), path,
+                                     encode=True)
+            pandas.testing.assert_frame_equal(pandas.read_feather(path), expected)
+
+
+GAME = "e4 e5 Nf3 Nc6 Bb5 a6 Ba4 Nf6 O-O Be7 Re1 b5 Bb3 d6"
+
+
+class TestBuildBoard(unittest.TestCase):
+    def _replay(self, ply):
+        board = chess.Board()
+        for move in GAME.split(" ")[:ply]:
+            board.push_san(move)
+        return board
+
+    def test_move_index(self):
+        self.assertEqual(dataset.build_board(GAME), self._replay(14))
+        self.assertEqual(dataset.build_board(GAME, 0), chess.Board())
+        self.assertEqual(dataset.build_board(GAME, 5), self._replay(5))
+        with self.assertRaises(IndexError):
+            dataset.build_board(GAME, 15)
+
+    def test_iter_boards(self):
+        fens = [b.fen() for b in dataset.iter_boards(GAME)]
+        self.assertEqual(fens, [self._replay(i).fen() for i in range(1, 15)])
+
+    def test_checkpoints(self):
+        checkpoints = dataset.BoardCheckpoints(GAME, every=4)
+        self.assertEqual(len(checkpoints), 15)
+        for ply in [9, 2, 14, 0, 8, 13]:
+            board = checkpoints.board_at(ply)
+            self.assertEqual(board, self._replay(ply))
+            self.assertEqual(board.move_stack, self._replay(ply).move_stack)
+        self.assertEqual(len(checkpoints._snapshots), 4)
+        with self.assertRaises(IndexError):
+            checkpoints.board_at(15)
+
+
+class TestEncodeMoves(unittest.TestCase):
+    def test_round_trip(self):
+        moves = "e4 d5 exd5 Nf6 d4 Nxd5 c4 Nb6 c5 N6d7 c6 e5 cxb7 Bb4+ Bd2 O-O bxa8=N"
+        codes, invalid = dataset.encode_moves(moves)
+        self.assertEqual(codes.dtype, numpy.uint16)
+        self.assertEqual(invalid, -1)
+        boards = [b.fen() for b in dataset.replay_encoded(codes)]
+        self.assertEqual(boards, [b.fen() for b in dataset.iter_boards(moves)])
+        self.assertEqual(dataset.decode_move(codes[-1]), chess.Move.from_uci("b7a8n"))
+
+    def test_invalid_and_truncated(self):
+        codes, invalid = dataset.encode_moves("e4 e5 Ke3 Nc6")
+        self.assertEqual((len(codes), invalid), (2, 2))
+        codes, invalid = dataset.encode_moves("e4 e5 N")
+        self.assertEqual((len(codes), invalid), (2, 2))
+
+    def test_preprocess_flags_invalid_games(self):
+        lines = LINES[:1] + [LINES[1].replace("W2.c4", "W2.c5")]
+        df = dataset._preprocess_3500k_san(make_content(lines), encode=True)
+        self.assertEqual(list(df["invalid_ply"]), [-1, 2])
+        self.assertEqual([len(c) for c in df["encoded_moves"]], [5, 2])
+
+
+class TestGamePositions(unittest.TestCase):
+    def setUp(self):
+        self.games = dataset._preprocess_3500k_san(make_content())
+        self.num_positions = sum(len(m.split(" ")) for m in self.games["moves"])
+
+    def _keys(self, samples):
+        return sorted((int(s["id"]), int(s["ply"])) for s in samples)
+
+    def test_positions(self):
+        samples = list(dataset.GamePositions(self.games))
+        self.assertEqual(len(samples), self.num_positions)
+        first = samples[0]
+        self.assertEqual((first["id"], first["ply"]), (1, 1))
+        # After 1. e4 black is to move and lost the game
+        self.assertEqual(first["result"], 0.0)
+        self.assertEqual(samples[1]["result"], 1.0)
+        self.assertEqual(first["current"].dtype, numpy.int32)
+        self.assertTrue(all(numpy.isnan(s["result"]) for s in samples if s["id"] == 3))
+
+    def test_invalid_game_is_truncated(self):
+        games = self.games.copy()
+        games.loc[0, "moves"] = "e4 e5 Ke3 Nc6"
+        samples = [s for s in dataset.GamePositions(games) if s["id"] == 1]
+        self.assertEqual(len(samples), 2)
+
+    def test_encoded_matches_san(self):
+        expected = list(dataset.iter_positions(self.games))
+        result = list(dataset.iter_positions(dataset.encode_games(self.games)))
+        self.assertEqual(len(result), len(expected))
+        for r, e in zip(result, expected):
+            numpy.testing.assert_array_equal(r["current"], e["current"])
+            self.assertEqual((r["id"], r["ply"]), (e["id"], e["ply"]))
+
+    def test_shuffle_buffer(self):
+        positions = dataset.GamePositions(self.games, shuffle_buffer=4, seed=1)
+        first = [(s["id"], s["ply"]) for s in positions]
+        self.assertNotEqual(first, [(s["id"], s["ply"]) for s in dataset.GamePositions(self.games)])
+        self.assertEqual(sorted(first), self._keys(dataset.GamePositions(self.games)))
+        self.assertEqual(first, [(s["id"], s["ply"]) for s in positions])
+        positions.set_epoch(1)
+        self.assertNotEqual(first, [(s["id"], s["ply"]) for s in positions])
+
+    def test_data_loader_workers(self):
+        loader = DataLoader(dataset.GamePositions(self.games), batch_size=3, num_workers=2,
+                            collate_fn=dataset.collate_positions)
+        keys = []
+        for batch in loader:
+            self.assertEqual(batch["current_offsets"].shape, batch["result"].shape)
+            keys += list(zip(batch["id"].tolist(), batch["ply"].tolist()))
+        self.assertEqual(sorted(keys), self._keys(dataset.GamePositions(self.games)))
+
+    def test_distributed_ranks(self):
+        keys = []
+        for rank in range(2):
+            with mock.patch("torch.distributed.is_initialized", return_value=True), \
+                    mock.patch("torch.distributed.get_rank", return_value=rank), \
+                    mock.patch("torch.distributed.get_world_size", return_value=2):
+                keys += self._keys(dataset.GamePositions(self.games))
+        self.assertEqual(sorted(keys), self._keys(dataset.GamePositions(self.games)))
+
+
+class TestImports(unittest.TestCase):
+    def test_dataset_imports_no_heavy_dependencies(self):
+        self.assertEqual(heavy_imports("chessmate.data.dataset"), [])
+        self.assertEqual(heavy_imports("chessmate.data.labeling"), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,87 @@
+import json
+import os
+import sys
+import tempfile
+import unittest
+
+import chess
+
+from chessmate.data import dataset, labeling
+from chessmate.features import engine
+
+from helpers import make_content
+
+
+FAKE_ENGINE = [sys.executable, os.path.join(os.path.dirname(__file__), "fake_uci_engine.py")]
+
+
+class TestLabelGames(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.games = dataset._preprocess_3500k_san(make_content())
+        cls.pool = engine.EnginePool(FAKE_ENGINE, size=2)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.pool.close()
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+
+    def features(self):
+        return {"estimate": engine.EngineEstimate(2, engine=self.pool),
+                "material": engine.RawMaterialScores(depth=2, engine=self.pool)}
+
+    def read(self):
+        return labeling.read_labels(self.directory.name).to_pandas().sort_values(["id", "ply"], ignore_index=True)
+
+    def test_labels(self):
+        manifest = labeling.label_games(self.games, self.directory.name, self.features(), self.pool,
+                                        positions_per_shard=4, progress=False)
+        labels = self.read()
+        # 1. e4 is played in three games and labeled once
+        self.assertEqual(manifest["positions"], 12)
+        self.assertEqual(len(labels), 12)
+        self.assertEqual(labels["zobrist"].nunique(), 12)
+        self.assertEqual(manifest["games"], 4)
+        self.assertEqual(len(manifest["shards"]), 3)
+
+        board = chess.Board(labels["fen"][0])
+        self.assertEqual(labels["estimate"][0], engine.EngineEstimate(2, engine=self.pool)(board))
+        self.assertEqual(list(labels["material"][0]), engine.RawMaterialScores(depth=2, engine=self.pool)(board))
+
+    def test_resume(self):
+        expected = labeling.label_games(self.games, os.path.join(self.directory.name, "all"), self.features(),
+                                        self.pool, positions_per_shard=4, progress=False)
+
+        directory = os.path.join(self.directory.name, "resumed")
+        budget = engine.LabelingBudget(nodes=2500)
+        with self.assertRaises(engine.BudgetExhausted):
+            labeling.label_games(self.games, directory, self.features(), self.pool,
+                                 positions_per_shard=100, progress=False, budget=budget)
+        with open(os.path.join(directory, labeling.MANIFEST)) as f:
+            interrupted = json.load(f)
+        # The games finished before the budget ran out are saved
+        self.assertGreater(interrupted["games"], 0)
+        self.assertLess(interrupted["games"], 4)
+
+        manifest = labeling.label_games(self.games, directory, self.features(), self.pool,
+                                        positions_per_shard=100, progress=False)
+        self.assertEqual(manifest["games"], 4)
+        self.assertEqual(manifest["positions"], expected["positions"])
+        self.assertEqual(len(manifest["shards"]), 2)
+        labels = labeling.read_labels(directory).to_pandas()
+        self.assertEqual(labels["zobrist"].nunique(), len(labels))
+        all_labels = labeling.read_labels(os.path.join(self.directory.name, "all")).to_pandas()
+        self.assertEqual(set(labels["zobrist"]), set(all_labels["zobrist"]))
+
+    def test_config_mismatch(self):
+        labeling.label_games(self.games[:1], self.directory.name, self.features(), self.pool, progress=False)
+        with self.assertRaises(ValueError):
+            labeling.label_games(self.games, self.directory.name, {"other": engine.EngineEstimate(2)}, self.pool,
+                                 progress=False)
+
+
+if __name__ == "__main__":
+    unittest.main()
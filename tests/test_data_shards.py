@@ -0,0 +1,55 @@
+import tempfile
+import unittest
+
+import numpy
+from torch.utils.data import DataLoader
+
+from chessmate.data import dataset, shards
+
+from helpers import make_content
+
+
+class TestPositionShards(unittest.TestCase):
+    def setUp(self):
+        self.games = dataset._preprocess_3500k_san(make_content())
+        self.expected = list(dataset.iter_positions(self.games))
+        self.directory = tempfile.TemporaryDirectory()
+        self.paths = shards.write_position_shards(self.games, self.directory.name, positions_per_shard=4)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_random_access(self):
+        positions = shards.PositionShards(self.directory.name)
+        self.assertEqual(len(self.paths), 4)
+        self.assertEqual(len(positions), len(self.expected))
+        for i in [0, 3, 4, 9, len(self.expected) - 1, -1]:
+            sample, expected = positions[i], self.expected[i]
+            self.assertIsInstance(sample["current"], numpy.memmap)
+            numpy.testing.assert_array_equal(sample["current"], expected["current"])
+            numpy.testing.assert_array_equal(sample["other"], expected["other"])
+            for key in ("id", "ply", "result", "white_rating", "black_rating"):
+                numpy.testing.assert_equal(sample[key], expected[key])
+        with self.assertRaises(IndexError):
+            positions[len(self.expected)]
+
+    def test_shuffled_loader(self):
+        positions = shards.PositionShards(self.directory.name)
+        loader = DataLoader(positions, batch_size=5, shuffle=True, collate_fn=dataset.collate_positions)
+        keys = []
+        for batch in loader:
+            keys += list(zip(batch["id"].tolist(), batch["ply"].tolist()))
+        self.assertEqual(sorted(keys), sorted((int(p["id"]), p["ply"]) for p in self.expected))
+
+    def test_rewrite(self):
+        games = self.games[self.games["id"] == 1]
+        paths = shards.write_position_shards(games, self.directory.name, positions_per_shard=4)
+        self.assertEqual(paths, self.paths[:2])
+        # Shards of the first run beyond the new ones are gone
+        self.assertEqual(sorted(p.name for p in paths[0].parent.iterdir()), [p.name for p in paths])
+        positions = shards.PositionShards(self.directory.name)
+        self.assertEqual([positions[i]["ply"] for i in range(len(positions))], list(range(1, 6)))
+
+
+if __name__ == "__main__":
+    unittest.main()
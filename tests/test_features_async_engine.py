@@ -0,0 +1,121 @@
+import asyncio
+import os
+import signal
+import sys
+import unittest
+
+import chess
+import chess.engine
+
+from chessmate.features import async_engine, engine, engine_cache
+
+
+FAKE_ENGINE = [sys.executable, os.path.join(os.path.dirname(__file__), "fake_uci_engine.py")]
+
+
+def game_boards():
+    boards = [chess.Board()]
+    for san in ["e4", "d5", "exd5", "Qxd5"]:
+        boards.append(boards[-1].copy())
+        boards[-1].push_san(san)
+    return boards
+
+
+class TestAsyncEnginePool(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.pool = await async_engine.AsyncEnginePool(FAKE_ENGINE, size=2, hash=16).start()
+
+    async def asyncTearDown(self):
+        await self.pool.close()
+
+    async def test_engine_estimate(self):
+        estimate = async_engine.AsyncEngineEstimate(2, engine=self.pool)
+        result = await self.pool.map(estimate, game_boards())
+        self.assertEqual(result, [0, 0, -100, 0, 0])
+
+    async def test_matches_blocking_features(self):
+        with engine.EnginePool(FAKE_ENGINE, size=1) as pool:
+            expected = [engine.RawMaterialScores(depth=3, engine=pool)(b) for b in game_boards()]
+        rms = async_engine.AsyncRawMaterialScores(depth=3, engine=self.pool)
+        result = await asyncio.gather(*(rms(b) for b in game_boards()))
+        self.assertEqual(result, expected)
+
+    async def test_adaptive_depth(self):
+        board = game_boards()[1]
+        expected = await async_engine.AsyncEngineEstimate(3, engine=self.pool)(board)
+        infos = await async_engine.analyse_until_stable(self.pool, board, chess.engine.Limit(depth=20))
+        self.assertEqual([info["depth"] for info in infos], [3])
+        infos = await async_engine.analyse_until_stable(self.pool, board, chess.engine.Limit(depth=2))
+        self.assertEqual([info["depth"] for info in infos], [2])
+
+        for search in (self.pool, engine_cache.AsyncCachedEngine(self.pool, engine_cache.AnalysisCache())):
+            adaptive = async_engine.AsyncEngineEstimate(20, engine=search, stable_depths=3)
+            self.assertEqual(await adaptive(board), expected)
+
+        transport, protocol = await chess.engine.popen_uci(FAKE_ENGINE)
+        try:
+            adaptive = async_engine.AsyncEngineEstimate(20, engine=protocol, stable_depths=3)
+            self.assertEqual(await adaptive(board), expected)
+        finally:
+            await protocol.quit()
+
+    async def test_restarts_dead_engine(self):
+        for transport in list(self.pool._engines.values()):
+            os.kill(transport.get_pid(), signal.SIGKILL)
+        await asyncio.sleep(0.1)
+
+        result = await self.pool.analyse(chess.Board(), chess.engine.Limit(depth=1))
+        self.assertEqual(result["depth"], 1)
+
+    async def test_adaptive_depth_restarts_dead_engine(self):
+        engines = list(self.pool._engines)
+        for transport in list(self.pool._engines.values()):
+            os.kill(transport.get_pid(), signal.SIGKILL)
+        await asyncio.sleep(0.1)
+
+        adaptive = async_engine.AsyncEngineEstimate(20, engine=self.pool, stable_depths=3)
+        for _ in range(3):
+            self.assertEqual(await adaptive(chess.Board()), 0)
+        self.assertEqual(len(self.pool._engines), 2)
+        self.assertTrue(all(e not in self.pool._engines for e in engines))
+
+    async def test_failed_restart_drops_dead_engine(self):
+        engines = list(self.pool._engines)
+        for transport in list(self.pool._engines.values()):
+            os.kill(transport.get_pid(), signal.SIGKILL)
+        await asyncio.sleep(0.1)
+
+        self.pool.path = "/nonexistent/stockfish"
+        for _ in engines:
+            with self.assertRaises(OSError):
+                await self.pool.analyse(chess.Board(), chess.engine.Limit(depth=1))
+        self.assertEqual(self.pool._engines, {})
+        self.assertEqual(list(self.pool._idle._queue), [None, None])
+        with self.assertRaises(RuntimeError):
+            self.pool.id
+        with self.assertRaises(OSError):
+            await self.pool.analyse(chess.Board(), chess.engine.Limit(depth=1))
+
+        # Empty slots start a new engine once it can be started again
+        self.pool.path = FAKE_ENGINE
+        for _ in engines:
+            result = await self.pool.analyse(chess.Board(), chess.engine.Limit(depth=1))
+            self.assertEqual(result["depth"], 1)
+        self.assertEqual(len(self.pool._engines), 2)
+        self.assertTrue(all(e not in self.pool._engines for e in engines))
+
+    async def test_closed_pool_raises(self):
+        await self.pool.close()
+        with self.assertRaises(RuntimeError):
+            await self.pool.analyse(chess.Board(), chess.engine.Limit(depth=1))
+
+
+class TestAsyncEngineFeature(unittest.IsolatedAsyncioTestCase):
+    async def test_missing_engine_raises(self):
+        estimate = async_engine.AsyncEngineEstimate(2)
+        with self.assertRaises(RuntimeError):
+            await estimate(chess.Board())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,109 @@
+import unittest
+
+import chess
+import numpy
+import torch
+
+from chessmate.features import board as board_features
+
+from helpers import heavy_imports
+
+
+FENS = [
+    chess.STARTING_FEN,
+    "1r1q1rk1/3nbppp/p1bp4/2p1pN2/P2nP3/2NP3P/1BPQ1PP1/1R2KB1R b K - 6 16",
+    "rn2k3/p2b1p1p/3bp2B/8/1p6/1P1q4/P2P1PNP/R2QR1K1 w q - 0 18",
+    "8/8/4k3/8/8/3K4/8/8 w - - 0 1",
+]
+
+
+def _dense(indices, size, values=None):
+    dense = torch.zeros(size)
+    dense[torch.from_numpy(indices).long()] = 1.0 if values is None else torch.from_numpy(values)
+    return dense
+
+
+class TestSparseIndices(unittest.TestCase):
+    def test_halfkp_matches_dense(self):
+        for fen in FENS:
+            board = chess.Board(fen)
+            current, other = board_features.halfkp(board)
+            current_idx, other_idx = board_features.halfkp_indices(board)
+            self.assertEqual(current_idx.dtype, numpy.int32)
+            self.assertTrue(torch.equal(_dense(current_idx, current.shape[0]), current))
+            self.assertTrue(torch.equal(_dense(other_idx, other.shape[0]), other))
+
+    def test_halfka_matches_dense(self):
+        for fen in FENS:
+            board = chess.Board(fen)
+            current, other = board_features.halfka(board)
+            current_idx, other_idx = board_features.halfka_indices(board)
+            self.assertTrue(torch.equal(_dense(current_idx, current.shape[0]), current))
+            self.assertTrue(torch.equal(_dense(other_idx, other.shape[0]), other))
+
+    def test_factorized_halfkp_matches_dense(self):
+        for fen in FENS:
+            board = chess.Board(fen)
+            current, other = board_features.factorized_halfkp(board)
+            (current_idx, current_val), (other_idx, other_val) = board_features.factorized_halfkp_indices(board)
+            self.assertTrue(torch.equal(_dense(current_idx, current.shape[0], current_val), current))
+            self.assertTrue(torch.equal(_dense(other_idx, other.shape[0], other_val), other))
+
+    def test_pack_indices(self):
+        boards = [chess.Board(fen) for fen in FENS]
+        samples = [board_features.halfkp_indices(b)[0] for b in boards]
+        flat, offsets = board_features.pack_indices(samples)
+        self.assertEqual(len(flat), sum(len(s) for s in samples))
+        for sample, start, end in zip(samples, offsets, list(offsets[1:]) + [len(flat)]):
+            numpy.testing.assert_array_equal(flat[start:end], sample)
+
+
+class TestBatchIndices(unittest.TestCase):
+    def _check(self, batch, single, inputs):
+        current, other, offsets = batch(inputs)
+        ends = list(offsets[1:]) + [len(current)]
+        self.assertEqual(current.dtype, numpy.int32)
+        for fen, start, end in zip(FENS, offsets, ends):
+            expected_current, expected_other = single(chess.Board(fen))
+            self.assertEqual(sorted(current[start:end]), sorted(expected_current))
+            self.assertEqual(sorted(other[start:end]), sorted(expected_other))
+
+    def test_halfkp_boards(self):
+        self._check(board_features.halfkp_batch, board_features.halfkp_indices,
+                    [chess.Board(fen) for fen in FENS])
+
+    def test_halfkp_fens(self):
+        self._check(board_features.halfkp_batch, board_features.halfkp_indices, FENS)
+
+    def test_halfka_boards(self):
+        self._check(board_features.halfka_batch, board_features.halfka_indices,
+                    [chess.Board(fen) for fen in FENS])
+
+    def test_batch_indices(self):
+        features = board_features.nnue_halfkp.Features()
+        self._check(lambda boards: board_features.batch_indices(boards, features),
+                    board_features.halfkp_indices, FENS)
+
+    def test_invalid_fens(self):
+        for fen in ["8/8/4k3/8/8/3K4/8/7X w - - 0 1", "8/8/4k3/8/8/8/8/8 w - - 0 1",
+                    "8/8/4k3/8/8/3K4/8/8 x - - 0 1", "8/8/4k3/8/8/3K4/8 w - - 0 1"]:
+            with self.assertRaises(ValueError):
+                board_features.halfkp_batch([FENS[0], fen])
+        # 64 squares, but not 8 ranks of 8
+        for fen in ["rnbqkbnrp/ppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1",
+                    "rnbqkbnr/pppppppp/88/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1",
+                    "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR/ w KQkq - 0 1"]:
+            with self.assertRaises(ValueError):
+                chess.Board(fen)
+            with self.assertRaises(ValueError):
+                board_features.halfkp_batch([FENS[0], fen])
+
+
+class TestImports(unittest.TestCase):
+    def test_board_features_import_no_heavy_dependencies(self):
+        self.assertEqual(heavy_imports("chessmate.features.board"), [])
+        self.assertEqual(heavy_imports("chessmate.features.engine"), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
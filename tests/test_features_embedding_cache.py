@@ -0,0 +1,62 @@
+import tempfile
+import unittest
+from unittest import mock
+
+import chess
+import torch
+
+from chessmate.features import embedding_cache, nnue
+
+from helpers import FENS, make_checkpoint
+
+
+def play(sans):
+    board = chess.Board()
+    for san in sans.split(" "):
+        board.push_san(san)
+    return board
+
+
+class TestEmbeddingCache(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        with tempfile.TemporaryDirectory() as directory:
+            cls.embedding = nnue.NNUEEmbedding(make_checkpoint(directory))
+
+    def test_matches_embedding(self):
+        cache = embedding_cache.EmbeddingCache(self.embedding)
+        expected = self.embedding.embed_boards(FENS)
+        torch.testing.assert_close(cache.embed_boards(FENS), expected)
+        torch.testing.assert_close(cache.embed_boards(FENS[::-1]), expected.flip(0))
+        self.assertEqual(cache.stats(), {"hits": 3, "misses": 3, "hit_rate": 0.5, "size": 3,
+                                         "capacity": cache.capacity})
+
+    def test_only_misses_are_embedded(self):
+        cache = embedding_cache.EmbeddingCache(self.embedding)
+        cache.embed_boards([FENS[0]])
+        # Both transpositions reach the same position
+        boards = [play("e4 e5 Nf3"), FENS[0], play("Nf3 e5 e4"), FENS[1]]
+        with mock.patch.object(self.embedding, "embed_boards", wraps=self.embedding.embed_boards) as embed:
+            result = cache.embed_boards(boards)
+            (computed,), _ = embed.call_args
+        self.assertEqual(embed.call_count, 1)
+        self.assertEqual([b.fen() for b in computed][1:], [FENS[1]])
+        torch.testing.assert_close(result[0], result[2])
+        # The transposition is embedded once but both boards missed the cache
+        self.assertEqual((cache.hits, cache.misses), (1, 4))
+
+    def test_clock_eviction(self):
+        cache = embedding_cache.EmbeddingCache(self.embedding, memory_budget=2 * (nnue.L3 * 4 + 9))
+        self.assertEqual(cache.capacity, 2)
+        cache.embed_boards(FENS[:2])
+        cache.embed_boards(FENS[:1])
+        # The first position was used again so the second one is evicted
+        cache.embed_boards(FENS[2:])
+        self.assertEqual(len(cache), 2)
+        cache.embed_boards(FENS[:1])
+        cache.embed_boards(FENS[1:2])
+        self.assertEqual((cache.hits, cache.misses), (2, 4))
+
+
+if __name__ == "__main__":
+    unittest.main()
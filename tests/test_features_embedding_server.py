@@ -0,0 +1,103 @@
+import os
+import tempfile
+import threading
+import time
+import unittest
+
+import chess
+import numpy
+import torch
+
+from chessmate.features import embedding_server, nnue
+
+from helpers import FENS, make_checkpoint
+
+
+class TestEmbeddingServer(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        with tempfile.TemporaryDirectory() as directory:
+            cls.embedding = nnue.NNUEEmbedding(make_checkpoint(directory))
+        cls.expected = cls.embedding.embed_boards(FENS)
+
+    def test_embed_boards(self):
+        boards = [chess.Board(fen) for fen in FENS]
+        torch.testing.assert_close(self.embedding.embed_boards(boards), self.expected)
+        for board, expected in zip(boards, self.expected):
+            torch.testing.assert_close(self.embedding.accumulator(board).embed()[0], expected)
+
+    def test_micro_batches(self):
+        fens = FENS * 20
+        with embedding_server.EmbeddingServer(self.embedding, max_batch_size=16, max_latency=0.05) as server:
+            results = [None] * 4
+            def work(i):
+                results[i] = server.embed_many(fens[i::4])
+            threads = [threading.Thread(target=work, args=(i,)) for i in range(4)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            torch.testing.assert_close(server.embed(FENS[1]), self.expected[1])
+            stats = server.stats()
+
+        for i, result in enumerate(results):
+            torch.testing.assert_close(result, self.expected.repeat(20, 1)[i::4])
+        self.assertEqual(stats["requests"], len(fens) + 1)
+        self.assertLess(stats["batches"], stats["requests"])
+        self.assertGreater(stats["mean_batch_size"], 1)
+        self.assertLessEqual(stats["p50"], stats["p99"])
+
+    def test_invalid_board(self):
+        with embedding_server.EmbeddingServer(self.embedding, max_latency=0.05) as server:
+            invalid = ["not a fen", "8/8/4k3/8/8/3K4/8/7X w - - 0 1", "8/8/4k3/8/8/8/8/8 w - - 0 1"]
+            futures = [server.submit(fen) for fen in [FENS[0], *invalid, FENS[2]]]
+            torch.testing.assert_close(futures[0].result(), self.expected[0])
+            for future in futures[1:-1]:
+                with self.assertRaises(ValueError):
+                    future.result()
+            torch.testing.assert_close(futures[-1].result(), self.expected[2])
+        with self.assertRaises(RuntimeError):
+            server.submit(FENS[0])
+
+    def test_concurrent_stats_and_close(self):
+        server = embedding_server.EmbeddingServer(self.embedding, max_latency=0.001, window=8)
+        futures, stop = [], threading.Event()
+
+        def submit():
+            while not stop.is_set():
+                try:
+                    futures.append(server.submit(FENS[0]))
+                except RuntimeError:
+                    return
+
+        def poll():
+            while not stop.is_set():
+                server.stats()
+
+        threads = [threading.Thread(target=submit) for _ in range(2)] + [threading.Thread(target=poll)]
+        for thread in threads:
+            thread.start()
+        while len(futures) < 200:
+            time.sleep(0.001)
+        server.close()
+        stop.set()
+        for thread in threads:
+            thread.join()
+        # Every accepted request was served
+        for future in futures:
+            torch.testing.assert_close(future.result(timeout=10), self.expected[0])
+
+    def test_unix_socket(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "embeddings.sock")
+            with embedding_server.EmbeddingServer(self.embedding) as server:
+                server.serve_unix(path)
+                result = embedding_server.request_embeddings(path, [chess.Board(fen) for fen in FENS])
+                with self.assertRaises(ValueError):
+                    embedding_server.request_embeddings(path, ["not a fen"])
+            self.assertFalse(os.path.exists(path))
+        numpy.testing.assert_allclose(result, self.expected.numpy(), rtol=1e-6)
+
+
+if __name__ == "__main__":
+    unittest.main()
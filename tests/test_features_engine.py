@@ -1,10 +1,21 @@
+import concurrent.futures
+import math
+import os
+import signal
+import subprocess
+import sys
+import time
 import unittest
 from unittest import mock
 
 import chess
 import chess.engine
+import numpy
 
-from chessmate.features import engine
+from chessmate.features import engine, engine_cache
+
+
+FAKE_ENGINE = [sys.executable, os.path.join(os.path.dirname(__file__), "fake_uci_engine.py")]
 
 
 class TestEngineFeature(unittest.TestCase):
@@ -221,6 +232,315 @@ class TestRawMaterialScore(unittest.TestCase):
 
         self.assertSequenceEqual(result, expected_scores)
 
+class TestMaterialBalance(unittest.TestCase):
+    # Covers en passant, promotion with capture, both castlings and king moves
+    GAME = "e4 d5 e5 f5 exf6 Nc6 fxg7 Bd7 gxh8=Q e6 Nf3 Qe7 Qxg8 O-O-O Bc4 Kb8 O-O Qf6 Kh1"
+
+    def test_line_matches_played_line(self):
+        board = chess.Board()
+        line, expected = [], [engine.material_balance(board)]
+        for san in self.GAME.split(" "):
+            line.append(board.push_san(san))
+            expected.append(engine.material_balance(board))
+
+        start = chess.Board()
+        numpy.testing.assert_array_equal(engine.line_material_balances(start, line), expected)
+        self.assertEqual(start, chess.Board())
+
+        boards = [chess.Board()]
+        for move in line:
+            boards.append(boards[-1].copy())
+            boards[-1].push(move)
+        numpy.testing.assert_array_equal(engine.material_balances(boards), expected)
+
+    def test_chess960_castling(self):
+        start = chess.Board("1r2k2r/8/8/8/8/8/8/1R2K2R w BHbh - 0 1", chess960=True)
+        board = start.copy()
+        # The castled rook must be found on d1 to be captured
+        line = [board.push_san(san) for san in ("O-O-O", "Rxh1+", "Rxh1")]
+        self.assertEqual(engine.line_material_balances(start, line).tolist(), [0, 0, -5, 0])
+
+    def test_line_scores_array(self):
+        fen = "1r1q1rk1/3nbppp/p1bp4/2p1pN2/P2nP3/2NP3P/1BPQ1PP1/1R2KB1R b K - 6 16"
+        board = chess.Board(fen=fen)
+        line = [chess.Move.from_uci(m) for m in ("d4f5", "e4f5", "e7g5")]
+        rms = engine.RawMaterialScores(relative_plies=[0, 1, 4])
+        scores = rms.line_scores(board, line)
+        self.assertIsInstance(scores, numpy.ndarray)
+        numpy.testing.assert_array_equal(scores, [0, -3, 0, numpy.nan])
+        self.assertEqual(board.fen(), fen)
+
+
+class TestEnginePipeline(unittest.TestCase):
+    def test_single_analysis(self):
+        fen = "1r1q1rk1/3nbppp/p1bp4/2p1pN2/P2nP3/2NP3P/1BPQ1PP1/1R2KB1R b K - 6 16"
+        board = chess.Board(fen=fen)
+        analyse_return_value = {
+            'depth': 7,
+            'score': chess.engine.PovScore(chess.engine.Cp(648), chess.BLACK),
+            'pv': [
+                chess.Move.from_uci('d4f5'),
+                chess.Move.from_uci('e4f5'),
+                chess.Move.from_uci('e7g5'),
+                chess.Move.from_uci('d2d1'),
+                chess.Move.from_uci('d8a5'),
+                chess.Move.from_uci('b2a1'),
+                chess.Move.from_uci('d6d5')
+            ]
+        }
+
+        pipeline = engine.EnginePipeline([
+            engine.RawMaterialScores(depth=5),
+            engine.EngineEstimate(3, mate_score=318),
+        ])
+
+        with mock.patch("chessmate.features.engine.EngineFeature.engine") as mock_engine:
+            mock_engine.analyse.return_value = analyse_return_value
+            result = pipeline(board)
+
+        self.assertEqual(mock_engine.analyse.call_count, 1)
+        _, limit = mock_engine.analyse.call_args.args
+        self.assertEqual(limit.depth, 7)
+        self.assertEqual(mock_engine.analyse.call_args.kwargs["info"],
+                         chess.engine.INFO_PV | chess.engine.INFO_SCORE)
+        self.assertSequenceEqual(result, [[0, -3, 0, 0, 0, 0], -648])
+        self.assertEqual(board.fen(), fen)
+
+    def test_matches_separate_features(self):
+        board = chess.Board()
+        board.push_san("e4")
+        board.push_san("d5")
+        with engine.EnginePool(FAKE_ENGINE, size=1) as pool:
+            features = [engine.RawMaterialScores(depth=3, engine=pool), engine.EngineEstimate(5, engine=pool)]
+            expected = [f(board) for f in features]
+            result = engine.EnginePipeline(features, engine=pool)(board)
+        self.assertEqual(result, expected)
+
+    def test_requires_features(self):
+        with self.assertRaises(ValueError):
+            engine.EnginePipeline([])
+
+
+class TestSearchModes(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.pool = engine.EnginePool(FAKE_ENGINE, size=1)
+        cls.board = chess.Board()
+        cls.board.push_san("e4")
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.pool.close()
+
+    def test_limits(self):
+        with self.assertRaises(ValueError):
+            engine.EngineEstimate()
+        estimate = engine.EngineEstimate(nodes=300, time=0.5)
+        self.assertEqual(estimate._limit(), chess.engine.Limit(nodes=300, time=0.5))
+        pipeline = engine.EnginePipeline([engine.RawMaterialScores(depth=3), estimate])
+        self.assertEqual(pipeline._limit(), chess.engine.Limit(depth=5, nodes=300, time=0.5))
+
+    def test_nodes(self):
+        with mock.patch.object(self.pool, "analyse", wraps=self.pool.analyse) as analyse:
+            result = engine.EngineEstimate(nodes=300, engine=self.pool)(self.board)
+        self.assertEqual(analyse.call_args.args[1], chess.engine.Limit(nodes=300))
+        self.assertEqual(result, engine.EngineEstimate(3, engine=self.pool)(self.board))
+
+    def test_budget(self):
+        budget = engine.LabelingBudget(nodes=1000, positions=4)
+        estimate = engine.EngineEstimate(10, engine=self.pool, budget=budget)
+        limits = []
+        for _ in range(4):
+            limits.append(estimate._limit())
+            estimate(self.board)
+        # What a search leaves unspent goes to the following ones
+        self.assertEqual([limit.nodes for limit in limits], [250, 266, 300, 300])
+        self.assertEqual((budget.spent_nodes, budget.searches), (1000, 4))
+        self.assertTrue(budget.exhausted)
+        with self.assertRaises(engine.BudgetExhausted):
+            estimate(self.board)
+
+    def test_adaptive_depth(self):
+        infos = engine.analyse_until_stable(self.pool, self.board, chess.engine.Limit(depth=20), stable_depths=3)
+        self.assertEqual([info["depth"] for info in infos], [3])
+        adaptive = engine.EngineEstimate(20, engine=self.pool, stable_depths=3)
+        self.assertEqual(adaptive(self.board), engine.EngineEstimate(3, engine=self.pool)(self.board))
+
+    def test_adaptive_depth_never_stable(self):
+        # The search ends before the score is stable, or without any score
+        infos = engine.analyse_until_stable(self.pool, self.board, chess.engine.Limit(depth=2), stable_depths=3)
+        self.assertEqual([info["depth"] for info in infos], [2])
+
+        analysis = mock.MagicMock()
+        analysis.__enter__.return_value = analysis
+        analysis.__iter__.return_value = iter([{"depth": 1, "string": "no score"}])
+        analysis.multipv = [{"depth": 1, "pv": []}]
+        mock_engine = mock.Mock()
+        mock_engine.analysis.return_value = analysis
+        infos = engine.analyse_until_stable(mock_engine, self.board, chess.engine.Limit(depth=1))
+        self.assertEqual(infos, [{"depth": 1, "pv": []}])
+        material = engine.RawMaterialScores(depth=1, engine=mock_engine, stable_depths=3)
+        self.assertEqual(len(material(self.board)), len(material._from_analysis(self.board, infos)))
+
+    def test_adaptive_depth_through_cache(self):
+        cached = engine_cache.CachedEngine(self.pool, engine_cache.AnalysisCache())
+        adaptive = engine.EngineEstimate(20, engine=cached, stable_depths=3)
+        self.assertEqual(adaptive(self.board), engine.EngineEstimate(3, engine=self.pool)(self.board))
+
+    def test_top_scores(self):
+        scores = engine.EngineTopScores(3, depth=2, engine=self.pool)(self.board)
+        self.assertEqual(len(scores), 3)
+        self.assertEqual(scores[0], engine.EngineEstimate(2, engine=self.pool)(self.board))
+        self.assertEqual(scores, sorted(scores))
+
+        scores = engine.EngineTopScores(25, depth=2, engine=self.pool, stable_depths=2)(self.board)
+        self.assertEqual(sum(math.isnan(s) for s in scores), 5)
+
+
+class TestEngineSession(unittest.TestCase):
+    def test_import_starts_no_engine(self):
+        code = ("import chess.engine\n"
+                "chess.engine.SimpleEngine.popen_uci = None\n"
+                "from chessmate.features import engine\n"
+                "engine.EngineEstimate(2)\n"
+                "assert not engine.default_session().started\n")
+        subprocess.run([sys.executable, "-c", code], check=True, env={**os.environ, "CHESSMATE_ENGINE": "missing"})
+
+    def test_lazy_start(self):
+        with engine.EngineSession(FAKE_ENGINE, threads=2, hash=32, nnue="nn-test.nnue") as session:
+            self.assertFalse(session.started)
+            estimate = engine.EngineEstimate(2, engine=session)
+            self.assertEqual(estimate(chess.Board()), 0)
+            self.assertTrue(session.started)
+            self.assertEqual(session.id["name"], "FakeEngine")
+            config = session.engine.protocol.config
+            self.assertEqual((config["Threads"], config["Hash"], config["EvalFile"]), (2, 32, "nn-test.nnue"))
+        self.assertFalse(session.started)
+
+    def test_environment(self):
+        environ = {"CHESSMATE_ENGINE": "/opt/sf", "CHESSMATE_ENGINE_THREADS": "4", "CHESSMATE_ENGINE_HASH": "256",
+                   "CHESSMATE_ENGINE_NNUE": "net.nnue"}
+        with mock.patch.dict(os.environ, environ):
+            session = engine.EngineSession(hash=64)
+        self.assertEqual(session.path, "/opt/sf")
+        self.assertEqual(session.options, {"Threads": 4, "Hash": 64, "EvalFile": "net.nnue", "Use NNUE": True})
+        self.assertEqual(engine.engine_settings({})["path"], engine.stockfish_path)
+
+    def test_missing_engine_raises(self):
+        estimate = engine.EngineEstimate(2, engine=engine.EngineSession("/nonexistent/stockfish"))
+        with self.assertRaises(RuntimeError):
+            estimate(chess.Board())
+
+    def test_shared_session(self):
+        session = engine.EngineSession(FAKE_ENGINE)
+        previous = engine.set_default_session(session)
+        try:
+            self.assertIs(engine.EngineEstimate(2).engine, session)
+            self.assertEqual(engine.EngineEstimate(2)(chess.Board()), 0)
+
+            pid = os.fork()
+            if pid == 0:
+                # The child starts its own engine instead of the parent one
+                shared = engine.default_session()
+                os._exit(0 if shared is not session and not shared.started else 1)
+            _, status = os.waitpid(pid, 0)
+            self.assertEqual(os.waitstatus_to_exitcode(status), 0)
+            self.assertTrue(session.started)
+        finally:
+            engine.set_default_session(previous)
+            session.close()
+
+    def test_default_session_created_once(self):
+        def slow_session():
+            time.sleep(0.01)
+            return object()
+
+        previous = engine.set_default_session(None)
+        try:
+            with mock.patch.object(engine, "EngineSession", side_effect=slow_session) as session_class, \
+                    concurrent.futures.ThreadPoolExecutor(8) as executor:
+                sessions = list(executor.map(lambda _: engine.default_session(), range(8)))
+            self.assertEqual(session_class.call_count, 1)
+            self.assertTrue(all(s is sessions[0] for s in sessions))
+        finally:
+            engine.set_default_session(previous)
+
+
+class TestEnginePool(unittest.TestCase):
+    def setUp(self):
+        self.pool = engine.EnginePool(FAKE_ENGINE, size=2, threads=1, hash=16)
+
+    def tearDown(self):
+        self.pool.close()
+
+    def test_configure(self):
+        self.assertEqual(self.pool.id["name"], "FakeEngine")
+        self.assertEqual(len(self.pool._engines), 2)
+
+    def test_map_keeps_order(self):
+        boards = [chess.Board()]
+        for san in ["e4", "d5", "exd5", "Qxd5"]:
+            boards.append(boards[-1].copy())
+            boards[-1].push_san(san)
+
+        estimate = engine.EngineEstimate(2, engine=self.pool)
+        expected = [estimate(b) for b in boards]
+        self.assertEqual(self.pool.map(estimate, boards), expected)
+        self.assertEqual(list(self.pool.imap(estimate, iter(boards))), expected)
+        self.assertEqual(expected, [0, 0, -100, 0, 0])
+
+    def test_restarts_dead_engine(self):
+        for e in list(self.pool._engines):
+            os.kill(e.transport.get_pid(), signal.SIGKILL)
+            e.returncode.result(timeout=10)
+
+        result = self.pool.analyse(chess.Board(), chess.engine.Limit(depth=1))
+        self.assertEqual(result["depth"], 1)
+        self.assertEqual(len(self.pool._engines), 2)
+
+    def test_adaptive_depth_restarts_dead_engine(self):
+        engines = list(self.pool._engines)
+        for e in engines:
+            os.kill(e.transport.get_pid(), signal.SIGKILL)
+            e.returncode.result(timeout=10)
+
+        adaptive = engine.EngineEstimate(20, engine=self.pool, stable_depths=3)
+        for _ in range(3):
+            self.assertEqual(adaptive(chess.Board()), 0)
+        self.assertEqual(len(self.pool._engines), 2)
+        self.assertTrue(all(e not in self.pool._engines for e in engines))
+
+    def test_failed_restart_drops_dead_engine(self):
+        engines = list(self.pool._engines)
+        for e in engines:
+            os.kill(e.transport.get_pid(), signal.SIGKILL)
+            e.returncode.result(timeout=10)
+
+        self.pool.path = "/nonexistent/stockfish"
+        for _ in engines:
+            with self.assertRaises(OSError):
+                self.pool.analyse(chess.Board(), chess.engine.Limit(depth=1))
+        self.assertEqual(self.pool._engines, [])
+        self.assertEqual(list(self.pool._idle.queue), [None, None])
+        with self.assertRaises(RuntimeError):
+            self.pool.id
+        with self.assertRaises(OSError):
+            self.pool.analyse(chess.Board(), chess.engine.Limit(depth=1))
+
+        # Empty slots start a new engine once it can be started again
+        self.pool.path = FAKE_ENGINE
+        for _ in engines:
+            result = self.pool.analyse(chess.Board(), chess.engine.Limit(depth=1))
+            self.assertEqual(result["depth"], 1)
+        self.assertEqual(len(self.pool._engines), 2)
+        self.assertTrue(all(e not in self.pool._engines for e in engines))
+
+    def test_closed_pool_raises(self):
+        self.pool.close()
+        with self.assertRaises(RuntimeError):
+            self.pool.analyse(chess.Board(), chess.engine.Limit(depth=1))
+
+
 class TestEngineEstimate(unittest.TestCase):
     def test_fail(self):
         raise NotImplementedError()
\ No newline at end of file
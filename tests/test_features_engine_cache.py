@@ -0,0 +1,141 @@
+import os
+import sqlite3
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+import chess
+import chess.engine
+
+from chessmate.features import engine, engine_cache
+
+
+FAKE_ENGINE = [sys.executable, os.path.join(os.path.dirname(__file__), "fake_uci_engine.py")]
+
+
+def make_info(depth, cp=35, pv=("e2e4", "e7e5")):
+    return {
+        "depth": depth,
+        "multipv": 1,
+        "score": chess.engine.PovScore(chess.engine.Cp(cp), chess.BLACK),
+        "pv": [chess.Move.from_uci(m) for m in pv],
+    }
+
+
+class TestAnalysisCache(unittest.TestCase):
+    def test_round_trip(self):
+        cache = engine_cache.AnalysisCache()
+        board = chess.Board()
+        cache.put(board, chess.engine.Limit(depth=10), "sf", [make_info(10)])
+        (info,) = cache.get(board, chess.engine.Limit(depth=10), "sf")
+        self.assertEqual(info["score"].pov(chess.BLACK).score(), 35)
+        self.assertEqual(info["pv"], make_info(10)["pv"])
+
+    def test_deeper_answers_shallower(self):
+        cache = engine_cache.AnalysisCache()
+        board = chess.Board()
+        cache.put(board, chess.engine.Limit(depth=10), "sf", [make_info(10)])
+        self.assertIsNotNone(cache.get(board, chess.engine.Limit(depth=6), "sf"))
+        self.assertIsNone(cache.get(board, chess.engine.Limit(depth=12), "sf"))
+        self.assertIsNone(cache.get(board, chess.engine.Limit(depth=6), "other"))
+        self.assertIsNone(cache.get(board, chess.engine.Limit(nodes=1000), "sf"))
+        self.assertIsNone(cache.get(board, chess.engine.Limit(depth=6), "sf", multipv=2))
+        self.assertEqual(cache.stats(), {"memory_hits": 1, "disk_hits": 0, "misses": 4, "hit_rate": 0.2})
+
+    def test_deeper_does_not_hide_wider(self):
+        cache = engine_cache.AnalysisCache()
+        board = chess.Board()
+        cache.put(board, chess.engine.Limit(depth=12), "sf", [make_info(12)])
+        cache.put(board, chess.engine.Limit(depth=6), "sf", [make_info(6), make_info(6, cp=20)])
+        self.assertEqual(len(cache.get(board, chess.engine.Limit(depth=6), "sf", multipv=2)), 2)
+        (info,) = cache.get(board, chess.engine.Limit(depth=10), "sf")
+        self.assertEqual(info["depth"], 12)
+        self.assertIsNone(cache.get(board, chess.engine.Limit(depth=10), "sf", multipv=2))
+
+        # A position with a single move answers any multipv it was asked for
+        cache.put(board, chess.engine.Limit(depth=4), "sf", [make_info(20)], multipv=5)
+        self.assertEqual(len(cache.get(board, chess.engine.Limit(depth=15), "sf", multipv=5)), 1)
+
+    def test_other_limits_match_exactly(self):
+        cache = engine_cache.AnalysisCache()
+        board = chess.Board()
+        cache.put(board, chess.engine.Limit(nodes=1000), "sf", [make_info(8)])
+        self.assertIsNotNone(cache.get(board, chess.engine.Limit(nodes=1000), "sf"))
+        self.assertIsNone(cache.get(board, chess.engine.Limit(nodes=2000), "sf"))
+
+    def test_lru_eviction(self):
+        cache = engine_cache.AnalysisCache(capacity=1)
+        first, second = chess.Board(), chess.Board()
+        second.push_san("e4")
+        cache.put(first, chess.engine.Limit(depth=5), "sf", [make_info(5)])
+        cache.put(second, chess.engine.Limit(depth=5), "sf", [make_info(5)])
+        self.assertIsNone(cache.get(first, chess.engine.Limit(depth=5), "sf"))
+        self.assertIsNotNone(cache.get(second, chess.engine.Limit(depth=5), "sf"))
+
+    def test_disk_tier_survives(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "analyses.sqlite")
+            board = chess.Board()
+            with engine_cache.AnalysisCache(path) as cache:
+                cache.put(board, chess.engine.Limit(depth=10), "sf", [make_info(10)])
+                cache.put(board, chess.engine.Limit(depth=4), "sf", [make_info(4, cp=0)])
+                cache.put(board, chess.engine.Limit(depth=4), "sf", [make_info(4), make_info(4, cp=0)])
+
+            with engine_cache.AnalysisCache(path) as cache:
+                (info,) = cache.get(board, chess.engine.Limit(depth=8), "sf")
+                self.assertEqual(info["depth"], 10)
+                self.assertIsNotNone(cache.get(board, chess.engine.Limit(depth=8), "sf"))
+                self.assertEqual(len(cache.get(board, chess.engine.Limit(depth=4), "sf", multipv=2)), 2)
+                self.assertEqual((cache.disk_hits, cache.memory_hits), (2, 1))
+
+    def test_checkmate_with_black_to_move(self):
+        board = chess.Board()
+        for san in ("e4", "f6", "d4", "g5", "Qh5#"):
+            board.push_san(san)
+        info = {"depth": 0, "score": chess.engine.PovScore(chess.engine.Mate(-0), chess.BLACK)}
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "analyses.sqlite")
+            with engine_cache.AnalysisCache(path) as cache:
+                cache.put(board, chess.engine.Limit(depth=10), "sf", [info])
+                (cached,) = cache.get(board, chess.engine.Limit(depth=10), "sf")
+                self.assertEqual(cached["score"].white(), chess.engine.MateGiven)
+            with engine_cache.AnalysisCache(path) as cache:
+                (cached,) = cache.get(board, chess.engine.Limit(depth=10), "sf")
+                self.assertEqual(cache.disk_hits, 1)
+                self.assertEqual(cached["score"].white(), chess.engine.MateGiven)
+                self.assertEqual(cached["score"].pov(chess.BLACK), chess.engine.Mate(-0))
+
+    def test_old_disk_tier_is_reset(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "analyses.sqlite")
+            db = sqlite3.connect(path)
+            db.execute("CREATE TABLE analyses (position INTEGER, engine TEXT, lim TEXT, depth INTEGER,"
+                       " multipv INTEGER, infos TEXT, PRIMARY KEY (position, engine, lim))")
+            db.commit()
+            db.close()
+            with engine_cache.AnalysisCache(path) as cache:
+                cache.put(chess.Board(), chess.engine.Limit(depth=4), "sf", [make_info(4)])
+            with engine_cache.AnalysisCache(path) as cache:
+                self.assertIsNotNone(cache.get(chess.Board(), chess.engine.Limit(depth=4), "sf"))
+
+
+class TestCachedEngine(unittest.TestCase):
+    def test_feature_hits_cache(self):
+        board = chess.Board()
+        board.push_san("e4")
+        cache = engine_cache.AnalysisCache()
+        with engine.EnginePool(FAKE_ENGINE, size=1) as pool:
+            cached = engine_cache.CachedEngine(pool, cache)
+            with mock.patch.object(pool, "analyse", wraps=pool.analyse) as analyse:
+                deep = engine.EngineEstimate(6, engine=cached)(board)
+                shallow = engine.EngineEstimate(3, engine=cached)(board)
+                self.assertEqual(analyse.call_count, 1)
+            self.assertEqual(shallow, engine.EngineEstimate(3, engine=pool)(board))
+        self.assertEqual(deep, shallow)
+        self.assertEqual(cached.engine_id, "FakeEngine")
+        self.assertEqual(cache.stats()["memory_hits"], 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
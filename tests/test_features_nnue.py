@@ -0,0 +1,151 @@
+import tempfile
+import unittest
+
+import chess
+import numpy
+import torch
+
+from chessmate.features import board as board_features
+from chessmate.features import nnue
+from chessmate.nnue_pytorch import halfka, halfkp
+
+from helpers import FENS, make_checkpoint
+
+
+# Covers en passant, promotion with capture, both castlings and king moves
+GAME = "e4 d5 e5 f5 exf6 Nc6 fxg7 Bd7 gxh8=Q e6 Nf3 Qe7 Qxg8 O-O-O Bc4 Kb8 O-O Qf6 Kh1"
+
+
+def game_moves():
+    board = chess.Board()
+    moves = []
+    for san in GAME.split(" "):
+        moves.append(board.push_san(san))
+    return moves
+
+
+class TestNNUEEmbedding(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        with tempfile.TemporaryDirectory() as directory:
+            cls.embedding = nnue.NNUEEmbedding(make_checkpoint(directory))
+
+    def test_sparse_matches_dense(self):
+        boards = [chess.Board(fen) for fen in FENS]
+        dense = [board_features.halfkp(b) for b in boards]
+        current = torch.stack([c for c, _ in dense])
+        other = torch.stack([o for _, o in dense])
+
+        sparse = [board_features.halfkp_indices(b) for b in boards]
+        current_idx, current_off = board_features.pack_indices([c for c, _ in sparse])
+        other_idx, other_off = board_features.pack_indices([o for _, o in sparse])
+
+        with torch.no_grad():
+            expected = self.embedding(current, other)
+            result = self.embedding.forward_sparse(current_idx, current_off, other_idx, other_off)
+
+        self.assertEqual(result.shape, (len(boards), nnue.L3))
+        torch.testing.assert_close(result, expected, rtol=1e-4, atol=1e-5)
+
+    def _embed_from_scratch(self, board):
+        current, other = board_features.halfkp_indices(board)
+        offsets = numpy.zeros(1, dtype=numpy.int32)
+        return self.embedding.forward_sparse(current, offsets, other, offsets)
+
+    def test_accumulator_matches_refresh(self):
+        board = chess.Board()
+        accumulator = self.embedding.accumulator()
+        with torch.no_grad():
+            for move in game_moves():
+                accumulator.push(move)
+                board.push(move)
+                torch.testing.assert_close(accumulator.embed(), self._embed_from_scratch(board),
+                                           rtol=1e-4, atol=1e-5)
+
+    def test_accumulator_pop(self):
+        accumulator = self.embedding.accumulator()
+        with torch.no_grad():
+            expected = accumulator.embed()
+            for move in game_moves():
+                accumulator.push(move)
+            for _ in game_moves():
+                accumulator.pop()
+            torch.testing.assert_close(accumulator.embed(), expected)
+        self.assertEqual(accumulator.board, chess.Board())
+        with self.assertRaises(IndexError):
+            accumulator.pop()
+
+    def test_embed_game(self):
+        moves = game_moves()
+        with torch.no_grad():
+            result = self.embedding.embed_game(moves)
+            board = chess.Board()
+            expected = [self._embed_from_scratch(board)]
+            for move in moves:
+                board.push(move)
+                expected.append(self._embed_from_scratch(board))
+        self.assertEqual(result.shape, (len(moves) + 1, nnue.L3))
+        torch.testing.assert_close(result, torch.cat(expected), rtol=1e-4, atol=1e-5)
+
+    def test_accumulator_rejects_other_features(self):
+        with self.assertRaises(ValueError):
+            self.embedding.accumulator(features=halfka.Features())
+
+
+class TestQuantizedNNUEEmbedding(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        with tempfile.TemporaryDirectory() as directory:
+            cls.embedding = nnue.NNUEEmbedding(make_checkpoint(directory))
+        cls.quantized = nnue.QuantizedNNUEEmbedding.from_embedding(cls.embedding)
+
+    def test_dtypes(self):
+        self.assertEqual(self.quantized.ft_weight.dtype, numpy.int16)
+        self.assertEqual(self.quantized.ft_weight.shape, (nnue.NUM_PLANES * nnue.NUM_SQ, nnue.L1))
+        self.assertEqual(self.quantized.l1_weight.dtype, numpy.int8)
+        self.assertEqual(self.quantized.l1_bias.dtype, numpy.int32)
+
+    def test_matches_float(self):
+        boards = [chess.Board(fen) for fen in FENS + ["8/8/4k3/8/8/3K4/8/8 w - - 0 1"]]
+        current, other, offsets = board_features.halfkp_batch(boards)
+        with torch.no_grad():
+            expected = self.embedding.forward_sparse(current, offsets, other, offsets)
+        result = self.quantized.forward_sparse(current, offsets, other, offsets)
+        self.assertEqual(result.shape, expected.shape)
+        torch.testing.assert_close(result, expected, rtol=0, atol=0.05)
+
+    def test_empty_bags(self):
+        indices = numpy.array([5, 7], dtype=numpy.int32)
+        offsets = numpy.array([0, 0, 2], dtype=numpy.int32)
+        acc = self.quantized.transform(indices, offsets)
+        expected = self.quantized.ft_bias + self.quantized.ft_weight[5].astype(int) + self.quantized.ft_weight[7]
+        numpy.testing.assert_array_equal(acc[0], self.quantized.ft_bias)
+        numpy.testing.assert_array_equal(acc[1], expected)
+        numpy.testing.assert_array_equal(acc[2], self.quantized.ft_bias)
+
+
+class TestFeatureDelta(unittest.TestCase):
+    def _check(self, features):
+        board = chess.Board()
+        for move in game_moves():
+            before = [set(i) for i in features.get_active_indices(board)]
+            delta = features.get_feature_delta(board, move)
+            board.push(move)
+            after = [set(i) for i in features.get_active_indices(board)]
+            king_move = board.piece_type_at(move.to_square) == chess.KING
+            for b, a, d in zip(before, after, delta):
+                if d is None:
+                    self.assertTrue(king_move)
+                    continue
+                added, removed = d
+                self.assertEqual((b - set(removed)) | set(added), a)
+
+    def test_halfkp(self):
+        self._check(halfkp.Features())
+
+    def test_halfka(self):
+        self._check(halfka.Features())
+
+
+if __name__ == "__main__":
+    unittest.main()
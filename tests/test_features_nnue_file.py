@@ -0,0 +1,171 @@
+import os
+import pickle
+import struct
+import tempfile
+import unittest
+from unittest import mock
+
+import chess
+import numpy
+import torch
+
+from chessmate.features import board as board_features
+from chessmate.features import nnue, nnue_file
+from chessmate.nnue_pytorch import halfka, halfkp, serialize
+
+from helpers import FENS, make_checkpoint
+
+
+def write_nnue(path, quantized, feature_hash=0x5D69D5B8, fc_hash=0x63337156, description="test network"):
+    """Writes the weights of a :class:`nnue.QuantizedNNUEEmbedding` in the
+    Stockfish .nnue layout, with an all zero output layer."""
+    description = description.encode("utf-8")
+    ft_hash = feature_hash ^ (2 * nnue.L1)
+    with open(path, "wb") as f:
+        f.write(struct.pack("<III", nnue_file.VERSION, fc_hash ^ ft_hash, len(description)))
+        f.write(description)
+        f.write(struct.pack("<I", ft_hash))
+        f.write(quantized.ft_bias.astype("<i2").tobytes())
+        f.write(quantized.ft_weight.astype("<i2").tobytes())
+        f.write(struct.pack("<I", fc_hash))
+        layers = [(quantized.l1_weight, quantized.l1_bias), (quantized.l2_weight, quantized.l2_bias),
+                  (numpy.zeros((1, nnue.L3), numpy.int8), numpy.zeros(1, numpy.int32))]
+        for weight, bias in layers:
+            padded = numpy.zeros((weight.shape[0], (weight.shape[1] + 31) // 32 * 32), numpy.int8)
+            padded[:, :weight.shape[1]] = weight
+            f.write(bias.astype("<i4").tobytes())
+            f.write(padded.tobytes())
+    return path
+
+
+class TestNNUEFile(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.directory = tempfile.TemporaryDirectory()
+        embedding = nnue.NNUEEmbedding(make_checkpoint(cls.directory.name))
+        cls.quantized = nnue.QuantizedNNUEEmbedding.from_embedding(embedding)
+        cls.path = write_nnue(os.path.join(cls.directory.name, "test.nnue"), cls.quantized)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.directory.cleanup()
+
+    def test_header(self):
+        network = nnue_file.NNUEFile(self.path)
+        self.assertEqual(network.description, "test network")
+        self.assertEqual(network.num_features, nnue.NUM_PLANES * nnue.NUM_SQ)
+        self.assertEqual(network.feature_hash, 0x5D69D5B8)
+        self.assertEqual(network.hash, 0x3E5AA6EE)
+
+    def test_zero_copy_views(self):
+        network = nnue_file.NNUEFile(self.path)
+        self.assertIsInstance(network.ft_weight.base, numpy.memmap)
+        self.assertFalse(network.ft_weight.flags.writeable)
+        numpy.testing.assert_array_equal(network.ft_weight, self.quantized.ft_weight)
+        numpy.testing.assert_array_equal(network.ft_bias, self.quantized.ft_bias)
+
+    def test_layers(self):
+        network = nnue_file.NNUEFile(self.path)
+        weight, bias = network.layer("l1")
+        numpy.testing.assert_array_equal(weight, self.quantized.l1_weight)
+        numpy.testing.assert_array_equal(bias, self.quantized.l1_bias)
+        weight, bias = network.layer("output")
+        self.assertEqual((weight.shape, bias.shape), ((1, nnue.L3), (1,)))
+
+    def test_quantized_embedding(self):
+        boards = [chess.Board(fen) for fen in FENS]
+        inputs = []
+        for features in zip(*(board_features.halfkp_indices(b) for b in boards)):
+            inputs.extend(board_features.pack_indices(features))
+        from_file = nnue.QuantizedNNUEEmbedding.from_nnue_file(self.path)
+        numpy.testing.assert_array_equal(from_file(*inputs), self.quantized(*inputs))
+
+        unpickled = pickle.loads(pickle.dumps(from_file))
+        self.assertIsInstance(unpickled.ft_weight.base, numpy.memmap)
+        numpy.testing.assert_array_equal(unpickled(*inputs), self.quantized(*inputs))
+
+    def test_rejects_other_files(self):
+        path = os.path.join(self.directory.name, "bad.nnue")
+        with open(path, "wb") as f:
+            f.write(struct.pack("<III", 0x12345678, 0, 0))
+        with self.assertRaises(ValueError):
+            nnue_file.NNUEFile(path)
+        with self.assertRaises(ValueError):
+            nnue_file.NNUEFile(self.path, l1=512)
+
+
+def random_quantized(num_features, seed=0):
+    rng = numpy.random.default_rng(seed)
+    return nnue.QuantizedNNUEEmbedding(
+        rng.integers(-20, 20, (num_features, nnue.L1), dtype=numpy.int16),
+        rng.integers(0, 60, nnue.L1, dtype=numpy.int16),
+        rng.integers(-10, 10, (nnue.L2, 2 * nnue.L1), dtype=numpy.int8),
+        rng.integers(0, 4000, nnue.L2, dtype=numpy.int32),
+        rng.integers(-10, 10, (nnue.L3, nnue.L2), dtype=numpy.int8),
+        rng.integers(0, 4000, nnue.L3, dtype=numpy.int32),
+    )
+
+
+class TestNNUEEmbeddingFromFile(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.quantized = random_quantized(nnue.NUM_PLANES * nnue.NUM_SQ)
+        self.path = write_nnue(os.path.join(self.directory.name, "halfkp.nnue"), self.quantized)
+
+    def test_dequantized_weights(self):
+        embedding = nnue.NNUEEmbedding.from_nnue(self.path, cache_dir=False)
+        self.assertEqual(embedding.features.name, "HalfKP")
+        self.assertTrue(embedding.input.weight.t().is_contiguous())
+        numpy.testing.assert_allclose(embedding.input.weight.detach().t().numpy(), self.quantized.ft_weight / nnue.FT_SCALE,
+                                      rtol=1e-6)
+        numpy.testing.assert_allclose(embedding.l2.bias.detach().numpy(), self.quantized.l2_bias / nnue.BIAS_SCALE, rtol=1e-6)
+        self.assertEqual(os.listdir(self.directory.name), ["halfkp.nnue"])
+
+        # The integer and float paths agree up to the integer rounding
+        inputs = []
+        boards = [chess.Board(fen) for fen in FENS]
+        for features in zip(*(board_features.halfkp_indices(b) for b in boards)):
+            inputs.extend(board_features.pack_indices(features))
+        expected = nnue.QuantizedNNUEEmbedding.from_nnue_file(self.path)(*inputs)
+        torch.testing.assert_close(embedding.forward_sparse(*inputs), expected, atol=3 / nnue.FT_SCALE, rtol=0)
+
+    def test_cache(self):
+        cache_dir = os.path.join(self.directory.name, "cache")
+        first = nnue.NNUEEmbedding.from_nnue(self.path, cache_dir=cache_dir)
+        self.assertEqual(len(os.listdir(cache_dir)), 1)
+        with mock.patch.object(nnue, "_float_state_dict") as convert:
+            second = nnue.NNUEEmbedding.from_nnue(self.path, cache_dir=cache_dir)
+            convert.assert_not_called()
+        for name, value in first.state_dict().items():
+            torch.testing.assert_close(second.state_dict()[name], value)
+
+    def test_halfka(self):
+        quantized = random_quantized(halfka.Features().num_real_features)
+        path = write_nnue(os.path.join(self.directory.name, "halfka.nnue"), quantized,
+                          feature_hash=halfka.Features().hash)
+        embedding = nnue.NNUEEmbedding.from_nnue(path, cache_dir=False)
+        self.assertEqual(embedding.features.name, "HalfKA")
+        # Accumulators default to the network features
+        board = chess.Board(FENS[1])
+        torch.testing.assert_close(embedding.accumulator(board).embed(),
+                                   embedding.forward(*(x[None] for x in board_features.halfka(board))))
+
+    def test_rejects_mismatches(self):
+        with self.assertRaises(ValueError):
+            nnue.NNUEEmbedding.from_nnue(self.path, features=halfka.Features(), cache_dir=False)
+        path = write_nnue(os.path.join(self.directory.name, "bad.nnue"), self.quantized, fc_hash=0x1234)
+        with self.assertRaises(ValueError):
+            nnue.NNUEEmbedding.from_nnue(path, cache_dir=False)
+
+    def test_serialize_reader(self):
+        with open(self.path, "rb") as f:
+            reader = serialize.NNUEReader(f, halfkp.Features())
+        embedding = nnue.NNUEEmbedding(reader.model.state_dict())
+        expected = nnue.NNUEEmbedding.from_nnue(self.path, cache_dir=False)
+        for name, value in expected.state_dict().items():
+            torch.testing.assert_close(embedding.state_dict()[name], value)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,155 @@
+import hashlib
+import http.server
+import os
+import pathlib
+import random
+import tempfile
+import threading
+import unittest
+import urllib.parse
+from unittest import mock
+
+from chessmate.utils import fetch
+
+
+CONTENT = random.Random(0).randbytes(300_000)
+SHA256 = hashlib.sha256(CONTENT).hexdigest()
+NNUE_NAME = f"nn-{SHA256[:12]}.nnue"
+
+
+class FileServer(http.server.ThreadingHTTPServer):
+    """Serves ``CONTENT`` with Range support, the first ``drops`` responses
+    are cut halfway through."""
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), FileHandler)
+        self.drops = 0
+        self.ranges = True
+        self.requests = []
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server_port}"
+
+
+class FileHandler(http.server.BaseHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        url = urllib.parse.urlparse(self.path)
+        query = urllib.parse.parse_qs(url.query)
+        self.server.requests.append((url.path, query, self.headers.get("Range")))
+        if url.path == "/uc" and "confirm" not in query:
+            # Google Drive asks to confirm the download of large files
+            self.send_response(200)
+            self.send_header("Set-Cookie", "download_warning_123=token; Path=/")
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        if url.path not in ("/file", "/uc") and not url.path.startswith("/api/nn/"):
+            self.send_error(404)
+            return
+
+        start = 0
+        if self.headers.get("Range") and self.server.ranges:
+            start = int(self.headers["Range"][len("bytes="):].rstrip("-"))
+            if start >= len(CONTENT):
+                self.send_error(416)
+                return
+            self.send_response(206)
+            self.send_header("Content-Range", f"bytes {start}-{len(CONTENT) - 1}/{len(CONTENT)}")
+        else:
+            self.send_response(200)
+        body = CONTENT[start:]
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if self.server.drops:
+            self.server.drops -= 1
+            self.wfile.write(body[:len(body) // 2])
+            self.wfile.flush()
+            self.close_connection = True
+            return
+        self.wfile.write(body)
+
+
+class TestDownload(unittest.TestCase):
+    def setUp(self):
+        self.server = FileServer()
+        thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        thread.start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = pathlib.Path(directory.name)
+
+    def download(self, **kwargs):
+        return fetch.download(f"{self.server.url}/file", self.directory / "file", backoff=0, **kwargs)
+
+    def test_download_is_cached(self):
+        path = self.download(sha256=SHA256)
+        self.assertEqual(path.read_bytes(), CONTENT)
+        self.assertEqual(self.download(), path)
+        self.assertEqual(len(self.server.requests), 1)
+        self.assertEqual(list(self.directory.iterdir()), [path])
+
+    def test_resume(self):
+        self.server.drops = 2
+        path = self.download(sha256=SHA256)
+        self.assertEqual(path.read_bytes(), CONTENT)
+        # Each retry resumes past the bytes received so far
+        offsets = [int(r[len("bytes="):-1]) if r else 0 for _, _, r in self.server.requests]
+        self.assertEqual(len(offsets), 3)
+        self.assertTrue(0 == offsets[0] < offsets[1] < offsets[2] < len(CONTENT))
+
+    def test_resume_later(self):
+        self.server.drops = 2
+        with self.assertRaises(Exception):
+            self.download(retries=1)
+        self.assertFalse((self.directory / "file").exists())
+        received = (self.directory / "file.part").read_bytes()
+        self.assertGreater(len(received), 0)
+        self.assertEqual(received, CONTENT[:len(received)])
+
+        self.assertEqual(self.download(sha256=SHA256).read_bytes(), CONTENT)
+        self.assertEqual(self.server.requests[-1][2], f"bytes={len(received)}-")
+
+    def test_restart_without_range_support(self):
+        self.server.drops = 1
+        self.server.ranges = False
+        self.assertEqual(self.download(sha256=SHA256).read_bytes(), CONTENT)
+
+    def test_checksum_mismatch(self):
+        with self.assertRaises(ValueError):
+            self.download(sha256="0" * 64)
+        self.assertEqual(list(self.directory.iterdir()), [])
+
+    def test_missing_file_raises(self):
+        with self.assertRaises(Exception):
+            fetch.download(f"{self.server.url}/missing", self.directory / "missing", backoff=0)
+        self.assertEqual(len(self.server.requests), 1)
+
+    def test_nnue_from_stockfish(self):
+        url = f"{self.server.url}/api/nn/{{name}}"
+        with mock.patch.object(fetch, "STOCKFISH_NNUE_URL", url), \
+                mock.patch.dict(os.environ, {fetch.DATA_ROOT_ENV: str(self.directory)}):
+            path = fetch.download_nnue_from_stockfish(NNUE_NAME)
+        self.assertEqual(path, self.directory / "nnue" / NNUE_NAME)
+        self.assertEqual(path.read_bytes(), CONTENT)
+
+        corrupted = NNUE_NAME.replace(SHA256[:12], "0" * 12)
+        with self.assertRaises(ValueError):
+            fetch.download_nnue_from_stockfish(f"{self.server.url}/api/nn/{corrupted}", self.directory)
+        self.assertFalse((self.directory / corrupted).exists())
+
+    def test_google_drive_confirmation(self):
+        with mock.patch.object(fetch, "GOOGLE_DRIVE_URL", f"{self.server.url}/uc?export=download"):
+            path = fetch.download_file_from_google_drive("abc", self.directory / "archive.zip")
+        self.assertEqual(path.read_bytes(), CONTENT)
+        _, query, _ = self.server.requests[-1]
+        self.assertEqual(query, {"export": ["download"], "id": ["abc"], "confirm": ["token"]})
+
+
+if __name__ == "__main__":
+    unittest.main()